@@ -1,33 +1,52 @@
 import os
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import Qdrant
-from qdrant_client import QdrantClient
+from qdrant_client import QdrantClient, AsyncQdrantClient
 from langchain_core.documents import Document
 from dotenv import load_dotenv
-from langchain_community.embeddings import HuggingFaceInferenceAPIEmbeddings
 
 
 load_dotenv()
 
-# Initialize embeddings
-embedding = HuggingFaceInferenceAPIEmbeddings(
-    api_key=os.getenv("HF_API_TOKEN"),
-    model_name="sentence-transformers/all-MiniLM-L6-v2",
-)
+from utils.embedding_engine import build_embeddings, EMBEDDING_MODEL
+from utils.retrieval_cache import CachedEmbeddings, CachedRetriever
+
+# Initialize embeddings (EMBEDDING_BACKEND=remote|local, see utils/embedding_engine.py)
+# Query embeddings are cached in memory + on disk by model and normalized text.
+embedding = CachedEmbeddings(build_embeddings(), model_name=EMBEDDING_MODEL)
 
 # Connect to Qdrant Cloud
 qdrant_client = QdrantClient(
     url=os.getenv("QDRANT_URL"), api_key=os.getenv("QDRANT_API_KEY")
 )
 
+# Async client so retriever.ainvoke searches without a worker thread
+async_qdrant_client = AsyncQdrantClient(
+    url=os.getenv("QDRANT_URL"), api_key=os.getenv("QDRANT_API_KEY")
+)
+
 # Connect to collection
 vectorstore = Qdrant(
-    client=qdrant_client, collection_name="ecommerece-chatbot-rag", embeddings=embedding
+    client=qdrant_client,
+    async_client=async_qdrant_client,
+    collection_name="ecommerece-chatbot-rag",
+    embeddings=embedding,
 )
 
-retriever = vectorstore.as_retriever(
-    search_type="similarity_score_threshold",
-    search_kwargs={"score_threshold": 0.5, "k": 3},
+# RAG_INDEX=local serves searches from an in-process index synced from Qdrant
+# (exact NumPy top-k for small corpora, HNSW above HNSW_THRESHOLD).
+search_backend = vectorstore
+if os.getenv("RAG_INDEX", "qdrant").lower() == "local":
+    from utils.vector_index import LocalVectorIndex
+    search_backend = LocalVectorIndex.open(vectorstore)
+
+# Same search as as_retriever(search_type="similarity_score_threshold"), with
+# results cached per query embedding until the collection changes.
+retriever = CachedRetriever(
+    vectorstore=search_backend,
+    embeddings=embedding,
+    k=3,
+    score_threshold=0.5,
 )
 
 docs = [
@@ -69,8 +88,8 @@ docs = [
     ),
 ]
 
-# Upload to Qdrant
-# vectorstore.add_documents(documents=docs)
+# Upload to Qdrant (through the retriever so its cache is invalidated)
+# retriever.add_documents(docs)
 
 # docs_retrieve = retriever.invoke("how to update my password?")
 
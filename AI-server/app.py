@@ -1,24 +1,64 @@
 from typing import Optional
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
-from langchain.memory import ConversationBufferMemory
+from langchain_core.messages import SystemMessage, RemoveMessage
+from langgraph.graph.message import REMOVE_ALL_MESSAGES
 from dotenv import load_dotenv
-from fastapi import FastAPI, Query, HTTPException
+from fastapi import FastAPI, Query, HTTPException, Header, Request, WebSocket
 from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from routes.chat_routes import router as chat_router
+from routes.chat_routes import router as chat_router, InsightRequest
+from routes.geo_routes import router as geo_router
 import json
 from utils.memory_utils import summarize_messages, serialise_ai_message_chunk
 from utils.graph_config import graph, llm, _generate_followups, style_message
 import re
-from helper.conversations import (pg_get_conversation, pg_append_messages, pg_upsert_greeting)
+from helper.conversations import (pg_get_conversation, pg_append_messages, pg_upsert_greeting,
+                                  pg_conversation_version, pg_get_messages_page, CHAT_PAGE_SIZE, CHAT_PAGE_MAX)
+from controllers.chat_controllers import chat_history_response, stream_insight
 from helper.extractionHelpers import (_unwrap_tool_output, _safe)
+from utils.arrow_results import rows_to_columnar
+from utils.latency_budget import LatencyBudget, until_deadline
+from utils.context_builder import build_chat_context
+from utils.token_utils import count_tokens
+from utils.checkpointing import get_chat_graph, load_checkpointed_history, forget_chat_thread, close_chat_graph
+from utils import metrics
+from utils.stream_runs import start_run, resume_run, find_run, client_attached, draining, drain_runs, drain_on_signals
+from utils.tools import close_tool_clients
+from utils.llm_scheduler import set_llm_principal, set_llm_deadline, request_client
+from database import get_db_connection, close_db_connection
+from utils.ws_mux import ChatMultiplexer, StreamRequestError
+from pydantic import ValidationError
 
 
 import asyncio
+import os
+import signal
+import time
+import weakref
+from contextlib import aclosing, asynccontextmanager
+from functools import partial
 
 load_dotenv()
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Connections are per worker and opened here, in the worker, so workers
+    # of a pre-forking server never share a socket (see serve.py)
+    get_db_connection()
+    await get_chat_graph()
+    # uvicorn installed its handlers before startup: refuse new turns from the first SIGTERM
+    drain_on_signals(signal.SIGTERM, signal.SIGINT)
+    print(f"🚀 Worker {os.getpid()} ready")
+    yield
+    # The server has stopped accepting requests; let running turns finish
+    # and save their answers before the connections go away
+    print(f"🛑 Worker {os.getpid()} drained: {await drain_runs()}")
+    await close_chat_graph()
+    await close_tool_clients()
+    close_db_connection()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -26,9 +66,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["Content-Type"]
+    expose_headers=["Content-Type", "ETag"]
 )
 
+# Tools whose results are tabular and reported as the "db" source
+DB_RESULT_TOOLS = ("pgsql_query_structured", "transactions_analytics")
+
 REFINER_PROMPT = """
     You are an expert technical writer.
 
@@ -50,16 +93,60 @@ REFINER_PROMPT = """
 # ---------------------------------------------------------
 # Main async generator: streams AI content + handles memory
 # ---------------------------------------------------------
-async def generate_chat_responses(user_id: Optional[str], message: str):
+# Each turn replaces its thread's checkpointed messages with its own
+# context, so two concurrent turns of one user would drop each other's
+# exchange: turns of a signed-in user run one at a time (per worker)
+_thread_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+async def generate_chat_responses(
+    user_id: Optional[str], message: str, db_format: str = "rows", client: Optional[str] = None
+):
+    turn = _chat_turn(user_id, message, db_format, client)
+    if not (user_id and user_id.strip()):
+        async with aclosing(turn):
+            async for frame in turn:
+                yield frame
+        return
+    lock = _thread_locks.setdefault(user_id, asyncio.Lock())
+    if lock.locked():
+        metrics.incr("chat_turns_serialized")
+    async with lock, aclosing(turn):
+        async for frame in turn:
+            yield frame
+
+
+async def _chat_turn(
+    user_id: Optional[str], message: str, db_format: str = "rows", client: Optional[str] = None
+):
     events = None  # Initialize to None for finally block
+    # Set when the turn ended without the graph checkpointing it
+    forget_checkpoint = False
     
     # Determine if user is signed in
     is_signed_in = bool(user_id and user_id.strip())
+    # The turn's LLM calls queue fairly per user (anonymous: per client)
+    set_llm_principal(user_id, client)
     
     try:
-        # --- Load conversation history from Postgres (only for signed-in users)
+        setup_start = time.perf_counter()
+
+        # --- Resume from the thread's last checkpoint when there is one
+        # (signed-in users only; the checkpointed graph is keyed by user_id)
+        chat_graph = await get_chat_graph() if is_signed_in else None
+        checkpointed_history = None
+        if chat_graph is not None:
+            try:
+                checkpointed_history = await load_checkpointed_history(
+                    chat_graph, {"configurable": {"thread_id": user_id}}
+                )
+            except Exception as e:
+                print(f"Error loading checkpoint, running without persistence: {e}")
+                chat_graph = None
+
+        # --- Otherwise load conversation history from Postgres (only for signed-in users)
         existing_messages = []
-        if is_signed_in:
+        if is_signed_in and checkpointed_history is None:
             try:
                 pg_record = pg_get_conversation(user_id)
                 existing_messages = pg_record["messages"] if pg_record else []
@@ -75,7 +162,7 @@ async def generate_chat_responses(user_id: Optional[str], message: str):
                 return
 
         # --- Keep only role & content from DB
-        filtered_messages = [
+        filtered_messages = checkpointed_history if checkpointed_history is not None else [
             {"role": m["role"], "content": m["content"]}
             for m in existing_messages
             if m.get("content")
@@ -83,51 +170,47 @@ async def generate_chat_responses(user_id: Optional[str], message: str):
 
         print("================== Existing Messages ===============", filtered_messages)
 
-        memory = ConversationBufferMemory(return_messages=True)
-
-        # --- Summarize long conversations and keep last 10 messages
-        try:
-            if len(filtered_messages) > 12:
-                summary_messages = filtered_messages[:-10]
-                latest_messages = filtered_messages[-10:]
-                summary_text = await summarize_messages(summary_messages)
-                memory.chat_memory.add_message(
-                    SystemMessage(content=f"Conversation Summary: {summary_text}")
-                )
-                messages_to_load = latest_messages
-            else:
-                messages_to_load = filtered_messages[-10:]
-        except Exception as e:
-            print(f"Error summarizing messages: {e}")
-            # Continue without summary
-            messages_to_load = filtered_messages[-10:]
-
-        # --- Load messages into memory
-        for msg in messages_to_load:
-            role = msg["role"]
-            if role in ("user", "human"):
-                memory.chat_memory.add_message(HumanMessage(content=msg["content"]))
-            elif role in ("ai", "assistant"):
-                memory.chat_memory.add_message(AIMessage(content=msg["content"]))
-            elif role == "system":
-                memory.chat_memory.add_message(SystemMessage(content=msg["content"]))
-
-        # --- Add new user message
-        memory.chat_memory.add_message(HumanMessage(content=message))
+        # --- Fill the token budget with history, newest first (summary of the rest)
+        context_messages, context_stats = await build_chat_context(
+            filtered_messages, message, [style_message], summarize=summarize_messages
+        )
+        metrics.observe(
+            "turn_setup_ms",
+            (time.perf_counter() - setup_start) * 1000,
+            label="resume" if checkpointed_history is not None else "cold",
+        )
 
         # Use a safe identifier for logging
         user_identifier = user_id if is_signed_in else "anonymous"
         print(f"================ Messages sent to LLM for user {user_identifier} ===============")
-        for i, m in enumerate(memory.chat_memory.messages):
+        for i, m in enumerate(context_messages):
             print(f"{i+1}. Role: {m.type} | Content: {m.content}")
+        print(f"Prompt context: {context_stats}")
         print("===================================================================")
 
         # --- Config for React-style agent graph
-        config = {"configurable": {"thread_id": user_id if is_signed_in else "anonymous"}}
+        # The latency budget travels with the config so every tool call gets
+        # a deadline derived from what is left of this turn.
+        budget = LatencyBudget()
+        # Also for model calls made from threads, which until_deadline cannot cancel
+        set_llm_deadline(budget.deadline)
+        config = {
+            "configurable": {
+                "thread_id": user_id if is_signed_in else "anonymous",
+                "latency_budget": budget,
+            }
+        }
         
+        # The checkpointed thread state is replaced by this turn's budgeted
+        # context; the graph saves it (plus the answer) for the next turn.
+        if chat_graph is not None:
+            turn_input = [RemoveMessage(id=REMOVE_ALL_MESSAGES), *context_messages]
+        else:
+            turn_input = context_messages
+
         try:
-            events = graph.astream_events(
-                {"messages": [style_message, *memory.chat_memory.messages]},
+            events = (chat_graph or graph).astream_events(
+                {"messages": turn_input},
                 config=config,
                 version="v2"
             )
@@ -156,7 +239,8 @@ async def generate_chat_responses(user_id: Optional[str], message: str):
         has_sent_content = False
 
         try:
-            async for event in events:
+            # Hard stop at the turn's deadline, even while waiting for the next event
+            async for event in until_deadline(events, budget):
                 etype = event["event"]
                 meta = event.get("metadata", {}) or {}
                 node = meta.get("langgraph_node")
@@ -190,7 +274,7 @@ async def generate_chat_responses(user_id: Optional[str], message: str):
                         yield f'data: {{"type":"stage","stage":"searching"}}\n\n'
                         yield f'data: {{"type":"search_start","query":"{_safe(tinput.get("query",""))}","engine":"tavily"}}\n\n'
 
-                    elif "pgsql_query_structured" in tname or "rag_tool" in tname:
+                    elif any(t in tname for t in DB_RESULT_TOOLS) or "rag_tool" in tname:
                         yield f'data: {{"type":"stage","stage":"reading"}}\n\n'
 
                 # --- Tool end ---
@@ -200,6 +284,10 @@ async def generate_chat_responses(user_id: Optional[str], message: str):
                     tout = raw_data.get("output") if isinstance(raw_data, dict) else raw_data
                     result_data = _unwrap_tool_output(tout)
 
+                    if isinstance(result_data, dict) and result_data.get("timed_out"):
+                        yield f'data: {{"type":"tool_timeout","tool":"{_safe(tname)}"}}\n\n'
+                        continue
+
                     if "web_search" in tname:
                         urls = [
                             r["url"]
@@ -209,25 +297,57 @@ async def generate_chat_responses(user_id: Optional[str], message: str):
                         aggregated["sources"]["web"] = {"engine": "tavily", "urls": urls}
                         yield f'data: {{"type":"search_results","urls":{json.dumps(urls)}}}\n\n'
 
-                    elif "pgsql_query_structured" in tname and isinstance(result_data, dict):
+                    elif any(t in tname for t in DB_RESULT_TOOLS) and isinstance(result_data, dict):
                         db_payload = {
                             "rowcount": result_data.get("rowcount"),
                             "columns": result_data.get("columns", []),
                             "sample_rows": result_data.get("rows", []),
                         }
+                        if result_data.get("stats"):
+                            db_payload["stats"] = result_data["stats"]
+                            db_payload["truncated"] = result_data.get("truncated", False)
                         aggregated["sources"]["db"] = db_payload
-                        yield f'data: {{"type":"query_db_results","payload":{json.dumps(db_payload)}}}\n\n'
+
+                        # Columnar encoding: column names once, values per column
+                        sse_payload = db_payload
+                        if db_format == "columnar":
+                            sse_payload = {
+                                **{k: v for k, v in db_payload.items() if k != "sample_rows"},
+                                **rows_to_columnar(db_payload["columns"], db_payload["sample_rows"]),
+                            }
+                        yield f'data: {{"type":"query_db_results","payload":{json.dumps(sse_payload, default=str)}}}\n\n'
+
+        except TimeoutError:
+            print(f"⏱️ Latency budget exhausted: {budget.summary()}")
+            metrics.incr("chat_budget_exhausted")
+            # The graph never saved this turn; the next one rebuilds from Postgres
+            forget_checkpoint = chat_graph is not None
+            if not has_sent_content:
+                yield (
+                    'data: {'
+                    '"type":"error",'
+                    '"message":"The request took too long to complete. Please try again.",'
+                    '"code":"TIMEOUT"'
+                    '}\n\n'
+                )
+                return
+            aggregated["content"] = ai_response
 
         except asyncio.CancelledError:
-            print("Client disconnected, stopping generator")
-            # Don't send error for client disconnect - it's expected
-            return
+            # Shutdown, or the run was abandoned by its client (utils.stream_runs);
+            # closing `events` below aborts the in-flight model request
+            print("Stream run cancelled, stopping generator")
+            metrics.incr("chat_runs_cancelled")
+            metrics.observe("chat_cancelled_answer_tokens", count_tokens(ai_response))
+            forget_checkpoint = chat_graph is not None
+            raise
 
         except Exception as e:
             # 🔥 IMPROVED ERROR HANDLING - Send detailed error to frontend
             print(f"Streaming error: {e}")
             import traceback
             traceback.print_exc()
+            forget_checkpoint = chat_graph is not None
 
             # Determine error type and message
             error_message = str(e)
@@ -259,13 +379,21 @@ async def generate_chat_responses(user_id: Optional[str], message: str):
             )
             return  # Exit early, don't continue processing
 
-        # --- Generate followups AFTER model fully finishes ---
-        if ai_response.strip():
+        print(f"⏱️ Latency budget: {budget.summary()}")
+
+        # --- Generate followups AFTER model fully finishes (skipped once over budget or with nobody listening) ---
+        if ai_response.strip() and not client_attached():
+            metrics.incr("followups_skipped_detached")
+        elif ai_response.strip() and not budget.expired():
             try:
+                # Interactive: the end of the turn (and saving it) waits on
+                # this, bounded by FOLLOWUP_TIMEOUT_S without retries
                 followups = await _generate_followups(ai_response)
                 aggregated["followups"] = followups
                 if followups:
                     yield f'data: {{"type":"followup","items":{json.dumps(followups)}}}\n\n'
+            except TimeoutError:
+                metrics.incr("followups_timed_out")
             except Exception as e:
                 print(f"Error generating followups: {e}")
                 # Continue without followups - not critical
@@ -312,23 +440,59 @@ async def generate_chat_responses(user_id: Optional[str], message: str):
                 await events.aclose()
             except Exception as e:
                 print(f"Error closing event stream: {e}")
+        if forget_checkpoint:
+            await forget_chat_thread(user_id)
 
 
 # -------------------
 # HTTP route: stream
 # -------------------
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",  # Disable nginx buffering
+}
+
+
 @app.get("/chat_stream")
 async def chat_stream(
+    request: Request,
     query: str = Query(...), 
     user_id: Optional[str] = Query(None),  # Changed to Optional
-    checkpoint_id: Optional[str] = None
+    checkpoint_id: Optional[str] = None,
+    db_format: str = Query("rows", pattern="^(rows|columnar)$"),
+    last_event_id: Optional[str] = Header(None),
 ):
     """
     Stream chat responses with proper error handling.
     Errors are sent as SSE events with type="error".
     
     user_id is now optional - if not provided, messages won't be saved to DB.
+
+    db_format: "rows" (default) or "columnar" for the query_db_results payload.
+
+    The turn runs detached from the connection (utils.stream_runs). Every
+    frame has an id; reconnecting with Last-Event-ID replays the missed
+    frames and follows the live tail instead of running the agent again.
     """
+    owner = user_id if user_id and user_id.strip() else None
+
+    # Reconnect: attach to the running (or just finished) stream
+    if last_event_id:
+        follower = resume_run(last_event_id, owner)
+        if follower is not None:
+            return StreamingResponse(follower, media_type="text/event-stream", headers=SSE_HEADERS)
+
+        async def expired_generator():
+            yield (
+                'data: {'
+                '"type":"error",'
+                '"message":"This response is no longer available. Please reload the conversation.",'
+                '"code":"STREAM_EXPIRED"'
+                '}\n\n'
+            )
+        return StreamingResponse(expired_generator(), media_type="text/event-stream", headers=SSE_HEADERS)
+
     # Validate inputs
     if not query or not query.strip():
         # Return error as SSE event instead of raising HTTPException
@@ -344,16 +508,23 @@ async def chat_stream(
 
     # Note: user_id validation removed - it's now optional for anonymous users
 
+    if draining():
+        async def draining_generator():
+            yield (
+                'data: {'
+                '"type":"error",'
+                '"message":"The server is restarting. Please try again.",'
+                '"code":"SERVER_DRAINING"'
+                '}\n\n'
+            )
+        return StreamingResponse(draining_generator(), media_type="text/event-stream", headers={**SSE_HEADERS, "Connection": "close"})
+
     try:
-        return StreamingResponse(
-            generate_chat_responses(user_id=user_id, message=query),
-            media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "X-Accel-Buffering": "no",  # Disable nginx buffering
-            }
+        run = start_run(
+            generate_chat_responses(user_id=user_id, message=query, db_format=db_format, client=request_client(request)),
+            owner,
         )
+        return StreamingResponse(run.follow(), media_type="text/event-stream", headers=SSE_HEADERS)
     except Exception as e:
         print(f"Error in chat_stream endpoint: {e}")
         # Return error as SSE event
@@ -368,6 +539,63 @@ async def chat_stream(
         return StreamingResponse(error_generator(), media_type="text/event-stream")
 
 
+# -----------------------
+# WebSocket route: chat_ws
+# -----------------------
+async def open_ws_stream(message: dict, client: Optional[str] = None):
+    """(run, follower) for a chat_ws start/resume message (see utils.ws_mux for the protocol)."""
+    user_id = message.get("user_id")
+    owner = user_id if user_id and str(user_id).strip() else None
+
+    if message["type"] == "resume":
+        last_event_id = str(message.get("last_event_id") or "")
+        follower = resume_run(last_event_id, owner)
+        if follower is None:
+            raise StreamRequestError(
+                "STREAM_EXPIRED", "This response is no longer available. Please reload the conversation."
+            )
+        return find_run(last_event_id, owner), follower
+
+    if draining():
+        raise StreamRequestError("SERVER_DRAINING", "The server is restarting. Please try again.")
+
+    kind = message.get("kind", "chat")
+    if kind == "chat":
+        query = message.get("query")
+        db_format = message.get("db_format", "rows")
+        if not isinstance(query, str) or not query.strip():
+            raise StreamRequestError("INVALID_INPUT", "Please provide a valid message.")
+        if db_format not in ("rows", "columnar"):
+            raise StreamRequestError("INVALID_INPUT", "db_format must be rows or columnar.")
+        run = start_run(
+            generate_chat_responses(user_id=owner, message=query, db_format=db_format, client=client), owner
+        )
+        return run, run.follow()
+
+    if kind == "insight":
+        fields = message.get("request") or {}
+        if not isinstance(fields, dict):
+            raise StreamRequestError("INVALID_INPUT", "Invalid insight request: request must be an object")
+        try:
+            request = InsightRequest(**{"user_id": owner, **fields})
+        except ValidationError as e:
+            raise StreamRequestError("INVALID_INPUT", f"Invalid insight request: {e.errors()[0].get('msg')}")
+        run = start_run(stream_insight(request, client), owner)
+        return run, run.follow()
+
+    raise StreamRequestError("INVALID_INPUT", f"Unknown stream kind: {kind}")
+
+
+@app.websocket("/chat_ws")
+async def chat_ws(websocket: WebSocket):
+    """
+    Chat and insight streams multiplexed over one connection, with the
+    same events as /chat_stream plus per-stream ids, credits and cancel.
+    """
+    await websocket.accept()
+    await ChatMultiplexer(websocket, partial(open_ws_stream, client=request_client(websocket))).serve()
+
+
 # -----------------------
 # HTTP route: chat_boot
 # -----------------------
@@ -375,10 +603,14 @@ async def chat_stream(
 async def chat_boot(
     user_id: Optional[str] = Query(None), 
     fname: Optional[str] = Query(None),
-    skip_greeting: Optional[bool] = Query(False)  # 👈 NEW: Allow skipping greeting
+    skip_greeting: Optional[bool] = Query(False),  # 👈 NEW: Allow skipping greeting
+    limit: int = Query(CHAT_PAGE_SIZE, ge=1, le=CHAT_PAGE_MAX),
+    if_none_match: Optional[str] = Header(None),
 ):
     """
-    If user_id provided and greeted=True -> return stored messages.
+    If user_id provided and greeted=True -> return the newest page of stored
+    messages (older pages via get-chat-messages?before=), with an ETag so an
+    unchanged history is a 304.
     Otherwise generate a greeting:
       - personalize if fname provided,
       - generic if no fname.
@@ -390,21 +622,25 @@ async def chat_boot(
         # Determine if user is signed in
         is_signed_in = bool(user_id and user_id.strip())
         
-        # If user_id provided, fetch the conversation and check greeted
-        pg_record = None
+        # If user_id provided, fetch the conversation version and check greeted
+        version = None
         greeted = False
         
         if is_signed_in:
             try:
-                pg_record = pg_get_conversation(user_id)
-                greeted = pg_record["greeted"] if pg_record else False
+                version = pg_conversation_version(user_id)
+                greeted = version["greeted"] if version else False
             except Exception as e:
                 print(f"Database error in chat_boot: {e}")
                 # Continue with greeting generation for signed-in users even if DB fails
 
-        # If already greeted and we have a record, return stored messages
-        if greeted and pg_record:
-            return {"messages": pg_record["messages"]}
+        # If already greeted and we have a record, return the newest page of stored messages
+        if greeted and version:
+            def latest_page():
+                record = pg_get_messages_page(user_id, limit=limit)
+                return {"messages": record["messages"], "page": record["page"], "archived": record["archived"]}
+
+            return chat_history_response(version, latest_page, if_none_match, limit=limit)
 
         # 🔥 NEW: If skip_greeting is true, return empty messages
         # This happens when user just logged in with existing anonymous chat
@@ -435,6 +671,7 @@ async def chat_boot(
         if is_signed_in:
             try:
                 pg_upsert_greeting(user_id, fname, formatted)
+                await forget_chat_thread(user_id)
                 print(f"✅ Greeting saved for user {user_id}")
             except Exception as e:
                 print(f"Error saving greeting to database: {e}")
@@ -487,6 +724,7 @@ async def sync_anonymous_messages(request: dict):
         # Append messages to the user's conversation
         try:
             pg_append_messages(user_id, messages)
+            await forget_chat_thread(user_id)
             print(f"✅ Successfully synced {len(messages)} messages for user {user_id}")
             
             return {
@@ -515,4 +753,5 @@ async def sync_anonymous_messages(request: dict):
         )
 
 
-app.include_router(chat_router, prefix="/api/ai")
\ No newline at end of file
+app.include_router(chat_router, prefix="/api/ai")
+app.include_router(geo_router, prefix="/api/ai/geo")
\ No newline at end of file
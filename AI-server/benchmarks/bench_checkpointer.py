@@ -0,0 +1,120 @@
+"""
+Per-turn setup cost of the chat agent: cold (full history -> token-budgeted
+context, summarizing what does not fit) vs resumed from the thread's
+checkpoint. Turns are simulated on a synthetic conversation; the answer is
+written to the checkpoint without calling the agent.
+
+Uses CHECKPOINT_BACKEND (sqlite by default without PGSQL_HOST). The
+summarizer is a stub sleeping --summary-ms unless --llm-summary is given;
+with --user-id the cold path reads that user's history from Postgres.
+
+    cd AI-server && python -m benchmarks.bench_checkpointer --turns 30
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from langchain_core.messages import AIMessage, RemoveMessage
+from langgraph.graph.message import REMOVE_ALL_MESSAGES
+
+from utils.checkpointing import open_checkpointer, close_checkpointer, load_checkpointed_history, checkpoint_backend
+from utils.context_builder import build_chat_context
+from utils.graph_config import build_graph, style_message
+
+
+def _synthetic_turn(i: int):
+    question = f"How did apartment prices in Dubai Marina change in {2015 + i % 10}? " * 3
+    answer = (
+        f"## TL;DR\nPrices moved {i % 7}% year over year.\n\n"
+        + "| area | year | avg price/m2 |\n|---|---|---|\n"
+        + "".join(f"| Dubai Marina | {2015 + j} | {15000 + 37 * i + j} |\n" for j in range(8 + i % 12))
+    )
+    return question, answer
+
+
+def _p50(xs):
+    return statistics.median(xs) if xs else 0.0
+
+
+async def main(turns: int, history: int, summary_ms: float, llm_summary: bool, user_id: str):
+    calls = {"cold": 0, "resume": 0}
+    if llm_summary:
+        from utils.memory_utils import summarize_messages
+    else:
+        async def summarize_messages(messages):
+            await asyncio.sleep(summary_ms / 1000)
+            return f"User asked about Dubai Marina prices across {len(messages)} messages."
+
+    def counting(path):
+        async def summarize(messages):
+            calls[path] += 1
+            return await summarize_messages(messages)
+        return summarize
+
+    saver = await open_checkpointer()
+    graph = build_graph(checkpointer=saver)
+    config = {"configurable": {"thread_id": f"bench-{uuid.uuid4()}"}}
+
+    full_history = []
+    for i in range(history):
+        q, a = _synthetic_turn(i)
+        full_history += [{"role": "user", "content": q}, {"role": "ai", "content": a}]
+
+    cold, resume, save = [], [], []
+    try:
+        for t in range(turns):
+            question, answer = _synthetic_turn(history + t)
+
+            # Cold: whatever the store has, re-budgeted and re-summarized
+            start = time.perf_counter()
+            if user_id:
+                from helper.conversations import pg_get_conversation
+                record = pg_get_conversation(user_id)
+                base = [{"role": m["role"], "content": m["content"]} for m in (record or {}).get("messages", []) if m.get("content")]
+            else:
+                base = full_history
+            await build_chat_context(base, question, [style_message], summarize=counting("cold"))
+            cold.append((time.perf_counter() - start) * 1000)
+
+            # Resumed: last checkpoint (cold on the very first turn)
+            start = time.perf_counter()
+            saved = await load_checkpointed_history(graph, config)
+            messages, _ = await build_chat_context(
+                saved if saved is not None else full_history, question, [style_message], summarize=counting("resume")
+            )
+            if saved is not None:
+                resume.append((time.perf_counter() - start) * 1000)
+
+            start = time.perf_counter()
+            await graph.aupdate_state(
+                config,
+                {"messages": [RemoveMessage(id=REMOVE_ALL_MESSAGES), *messages, AIMessage(content=answer)]},
+                as_node="agent",
+            )
+            save.append((time.perf_counter() - start) * 1000)
+            full_history += [{"role": "user", "content": question}, {"role": "ai", "content": answer}]
+
+        print(f"backend: {checkpoint_backend()}, history {len(full_history)} messages, {turns} turns")
+        print(f"cold setup      p50 {_p50(cold):8.1f} ms   max {max(cold):8.1f} ms   summarizer calls {calls['cold']}")
+        print(f"resumed setup   p50 {_p50(resume):8.1f} ms   max {max(resume or [0]):8.1f} ms   summarizer calls {calls['resume']}")
+        print(f"checkpoint save p50 {_p50(save):8.1f} ms")
+        await saver.adelete_thread(config["configurable"]["thread_id"])
+    finally:
+        await close_checkpointer(saver)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument("--history", type=int, default=60, help="synthetic prior turns")
+    parser.add_argument("--summary-ms", type=float, default=800, help="stub summarizer latency")
+    parser.add_argument("--llm-summary", action="store_true")
+    parser.add_argument("--user-id", default=None)
+    args = parser.parse_args()
+    asyncio.run(main(args.turns, args.history, args.summary_ms, args.llm_summary, args.user_id))
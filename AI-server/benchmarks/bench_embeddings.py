@@ -0,0 +1,76 @@
+"""
+Query-embedding throughput/latency: HF Inference API vs local CPU engine
+(fp32, int8, onnx) with concurrent callers merged by the MicroBatcher.
+
+    cd AI-server && python -m benchmarks.bench_embeddings --queries 256 --concurrency 16
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from utils.embedding_engine import LocalEmbeddings, build_embeddings
+
+QUESTIONS = [
+    "how do I change my password",
+    "what is the rental yield in Dubai Marina",
+    "update my email address",
+    "average price per sqft in JVC",
+    "return policy for purchases",
+    "villa prices in Arabian Ranches",
+]
+
+
+async def _run(embeddings, queries: int, concurrency: int):
+    sem = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i):
+        async with sem:
+            start = time.perf_counter()
+            await embeddings.aembed_query(f"{QUESTIONS[i % len(QUESTIONS)]} #{i}")
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    # Warm up (model load / connection setup)
+    await embeddings.aembed_query("warm up")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(queries)))
+    total = time.perf_counter() - start
+    return total, latencies
+
+
+def _report(label, total, latencies, queries):
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(
+        f"{label:<12} {queries / total:8.1f} q/s   "
+        f"p50 {statistics.median(latencies):7.1f} ms   p95 {p95:7.1f} ms"
+    )
+
+
+async def main(queries: int, concurrency: int, skip_remote: bool):
+    print(f"queries={queries}, concurrency={concurrency}")
+
+    if not skip_remote:
+        total, lat = await _run(build_embeddings("remote"), queries, concurrency)
+        _report("remote", total, lat, queries)
+
+    for quantize in ("none", "int8", "onnx"):
+        engine = LocalEmbeddings(quantize=quantize)
+        total, lat = await _run(engine, queries, concurrency)
+        _report(f"local-{quantize}", total, lat, queries)
+        print(f"{'':<12} avg batch size {engine.batcher.items / max(engine.batcher.batches, 1):.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=256)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--skip-remote", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(main(args.queries, args.concurrency, args.skip_remote))
@@ -0,0 +1,82 @@
+"""
+Multi-tool turn latency: sync tools one after another vs coroutine tools
+awaited concurrently by the ToolNode (what graph.astream_events does).
+
+Needs the same .env as the server (DB, Tavily, Qdrant, Groq).
+
+    cd AI-server && python -m benchmarks.bench_tool_concurrency --rounds 5
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from langchain_core.messages import AIMessage
+from langgraph.prebuilt import ToolNode
+
+from utils.tools import ALL_TOOLS
+from utils.search_cache import SearchCache
+import utils.tools as tools_module
+
+
+def _turn(tag: str) -> AIMessage:
+    """One model turn requesting four independent tool calls."""
+    calls = [
+        ("rag_tool", {"query": f"how do I change my password {tag}"}),
+        ("web_search", {"query": f"Dubai Marina rental yield {tag}"}),
+        ("pgsql_query_structured", {"user_query": "average actual_worth of villas by year"}),
+        ("image_search", {"query": f"Palm Jumeirah villas {tag}"}),
+    ]
+    return AIMessage(
+        content="",
+        tool_calls=[
+            {"name": name, "args": args, "id": str(uuid.uuid4()), "type": "tool_call"}
+            for name, args in calls
+        ],
+    )
+
+
+def _run_sequential(msg: AIMessage):
+    by_name = {t.name: t for t in ALL_TOOLS}
+    for call in msg.tool_calls:
+        by_name[call["name"]].invoke(call["args"])
+
+
+async def _run_concurrent(node: ToolNode, msg: AIMessage):
+    await node.ainvoke({"messages": [msg]})
+
+
+async def main(rounds: int):
+    # Disable the shared search cache so every round pays for the upstream call
+    tools_module.search_cache = SearchCache(path=None, max_entries=0)
+
+    node = ToolNode(ALL_TOOLS)
+    seq, conc = [], []
+
+    # One event loop for the whole run: the async engine and HTTP client are
+    # bound to the loop they were first used on.
+    for i in range(rounds):
+        msg = _turn(f"seq-{i}")
+        start = time.perf_counter()
+        _run_sequential(msg)
+        seq.append((time.perf_counter() - start) * 1000)
+
+        msg = _turn(f"conc-{i}")
+        start = time.perf_counter()
+        await _run_concurrent(node, msg)
+        conc.append((time.perf_counter() - start) * 1000)
+
+    print(f"rounds={rounds}, tools per turn=4")
+    print(f"sync sequential : median {statistics.median(seq):8.1f} ms  max {max(seq):8.1f} ms")
+    print(f"async concurrent: median {statistics.median(conc):8.1f} ms  max {max(conc):8.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=5)
+    asyncio.run(main(parser.parse_args().rounds))
@@ -0,0 +1,108 @@
+"""
+Analytical queries on the local transactions snapshot vs the equivalent
+Postgres queries. Builds/refreshes the snapshot first.
+
+Needs the same .env as the server (TARGET_DB_URI).
+
+    cd AI-server && python -m benchmarks.bench_tx_snapshot --rounds 5
+"""
+import argparse
+import statistics
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from sqlalchemy import text
+
+from utils.tools import engine
+from utils.tx_snapshot import TransactionsSnapshot, TX_SNAPSHOT_TABLE
+from utils.tx_analytics import filter_transactions, aggregate, add_yoy
+
+_PROPERTY_TYPE_CASE = """
+    CASE
+      WHEN dpt.property_type = 'Unit' AND dps.property_sub_type = 'Flat' THEN 'Apartment'
+      WHEN dpt.property_type = 'Unit' AND dps.property_sub_type = 'Stacked Townhouses' THEN 'Stacked Townhouses'
+      WHEN dpt.property_type = 'Villa' THEN 'Villa'
+      WHEN dpt.property_type = 'Unit' AND dps.property_sub_type = 'Shop' THEN 'Shop'
+      WHEN dpt.property_type = 'Unit' AND dps.property_sub_type = 'Hotel Apartment' THEN 'Hotel Apartment'
+      WHEN dpt.property_type = 'Unit' AND dps.property_sub_type = 'Hotel Rooms' THEN 'Hotel Rooms'
+      WHEN dpt.property_type = 'Office' OR (dpt.property_type = 'Unit' AND dps.property_sub_type = 'Office') THEN 'Office'
+    END"""
+
+
+def _cases(snapshot: TransactionsSnapshot):
+    """(label, postgres sql, snapshot kernel) triples computing the same aggregates."""
+    t = TX_SNAPSHOT_TABLE
+    return [
+        (
+            "yearly volume + price/m2",
+            f"""SELECT EXTRACT(YEAR FROM instance_date) AS year, COUNT(*), SUM(actual_worth),
+                       AVG(meter_sale_price) FROM {t} GROUP BY 1 ORDER BY 1""",
+            lambda: aggregate(snapshot, snapshot.fact, ["year"]),
+        ),
+        (
+            "per area, last year",
+            f"""SELECT da.area_name_en, COUNT(*), SUM(t.actual_worth), AVG(t.meter_sale_price)
+                FROM {t} t JOIN dim_area da ON da.area_id = t.area_id
+                WHERE EXTRACT(YEAR FROM t.instance_date) = EXTRACT(YEAR FROM CURRENT_DATE) - 1
+                GROUP BY 1""",
+            lambda: aggregate(
+                snapshot,
+                filter_transactions(snapshot, start_year=time.localtime().tm_year - 1, end_year=time.localtime().tm_year - 1),
+                ["area"],
+            ),
+        ),
+        (
+            "type x year + YoY",
+            f"""WITH g AS (
+                  SELECT {_PROPERTY_TYPE_CASE} AS property_type, EXTRACT(YEAR FROM t.instance_date) AS year,
+                         COUNT(*) AS n, AVG(t.meter_sale_price) AS p
+                  FROM {t} t
+                  LEFT JOIN dim_property_type dpt ON dpt.property_type_id = t.property_type_id
+                  LEFT JOIN dim_property_sub_type dps ON dps.property_sub_type_id = t.property_sub_type_id
+                  GROUP BY 1, 2)
+                SELECT *, (p / LAG(p) OVER w - 1) * 100, (n::float / LAG(n) OVER w - 1) * 100
+                FROM g WINDOW w AS (PARTITION BY property_type ORDER BY year)""",
+            lambda: add_yoy(aggregate(snapshot, snapshot.fact, ["property_type", "year"]), ["property_type", "year"]),
+        ),
+    ]
+
+
+def _time(fn, rounds: int):
+    latencies = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def main(rounds: int):
+    snapshot = TransactionsSnapshot()
+    print("refresh:", snapshot.refresh(engine, force=True))
+    print(f"snapshot rows: {snapshot.fact.num_rows:,}, watermark {snapshot.manifest['watermark']}")
+
+    def run_sql(sql):
+        with engine.connect() as conn:
+            conn.execute(text(sql)).fetchall()
+
+    for label, sql, kernel in _cases(snapshot):
+        pg = _time(lambda: run_sql(sql), rounds)
+        local = _time(kernel, rounds)
+        print(
+            f"{label:<26} postgres p50 {statistics.median(pg):9.1f} ms   "
+            f"snapshot p50 {statistics.median(local):8.1f} ms   "
+            f"x{statistics.median(pg) / max(statistics.median(local), 1e-6):.1f}"
+        )
+
+    # Second refresh only pulls rows on/after the watermark
+    print("incremental refresh:", snapshot.refresh(engine, force=True))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    main(args.rounds)
@@ -0,0 +1,77 @@
+"""
+Recall@k and query latency of the in-process index (exact and HNSW) against
+Qdrant local mode (QdrantClient(":memory:")) as the stand-in for Qdrant Cloud.
+
+    cd AI-server && python -m benchmarks.bench_vector_index --n 20000 --dim 384
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.models import Distance, PointStruct, VectorParams
+
+from utils.vector_index import HNSWGraph, _normalize_rows
+
+
+def _time_queries(fn, queries):
+    latencies, results = [], []
+    for q in queries:
+        start = time.perf_counter()
+        results.append(fn(q))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return results, latencies
+
+
+def _recall(truth, found, k):
+    return statistics.mean(len(set(t) & set(f)) / k for t, f in zip(truth, found))
+
+
+def main(n: int, dim: int, queries: int, k: int):
+    rng = np.random.default_rng(0)
+    vectors = _normalize_rows(rng.normal(size=(n, dim)))
+    qs = _normalize_rows(rng.normal(size=(queries, dim)))
+
+    def exact(q):
+        sims = vectors @ q
+        top = np.argpartition(-sims, k - 1)[:k]
+        return top[np.argsort(-sims[top])].tolist()
+
+    truth, exact_lat = _time_queries(exact, qs)
+
+    start = time.perf_counter()
+    graph = HNSWGraph(vectors).build()
+    build_s = time.perf_counter() - start
+    hnsw, hnsw_lat = _time_queries(lambda q: [i for _, i in graph.search(q, k)], qs)
+
+    client = QdrantClient(":memory:")
+    client.create_collection("bench", vectors_config=VectorParams(size=dim, distance=Distance.COSINE))
+    for lo in range(0, n, 1000):
+        client.upsert("bench", [
+            PointStruct(id=i, vector=vectors[i].tolist()) for i in range(lo, min(lo + 1000, n))
+        ])
+    qdrant, qdrant_lat = _time_queries(
+        lambda q: [p.id for p in client.query_points("bench", query=q.tolist(), limit=k).points], qs
+    )
+
+    print(f"n={n}, dim={dim}, queries={queries}, k={k}, hnsw build {build_s:.1f}s")
+    for label, found, lat in (
+        ("numpy exact", truth, exact_lat),
+        ("hnsw", hnsw, hnsw_lat),
+        ("qdrant local", qdrant, qdrant_lat),
+    ):
+        print(
+            f"{label:<13} recall@{k} {_recall(truth, found, k):.3f}   "
+            f"p50 {statistics.median(lat):7.3f} ms   max {max(lat):7.3f} ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    args = parser.parse_args()
+    main(args.n, args.dim, args.queries, args.k)
@@ -0,0 +1,109 @@
+"""
+Throughput of the API by worker count. Starts `serve.py --workers N` for
+each N, waits for it to answer, then keeps --concurrency requests in flight
+for --seconds and reports requests/s, latency and the speedup over the
+first worker count.
+
+The default request is the fuzzy area-name lookup, which is CPU-bound in
+the worker (sync route in the threadpool), so one process is limited by
+the GIL and more workers should scale until the cores run out.
+
+    cd AI-server && python -m benchmarks.bench_workers --workers 1 2 4
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import statistics
+import subprocess
+
+import httpx
+
+QUERIES = ["jvc", "busines bay", "dubai marina", "downtwn", "palm jumeira", "arjan", "jlt", "al barsha south"]
+
+
+async def _wait_ready(base: str, path: str, timeout: float = 120):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(base + path.format(q="jvc"))).status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.5)
+    raise TimeoutError(f"server at {base} did not come up")
+
+
+async def _load(base: str, path: str, concurrency: int, seconds: float):
+    latencies, errors = [], 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base, limits=limits, timeout=30) as client:
+        deadline = time.monotonic() + seconds
+
+        async def worker():
+            nonlocal errors
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                try:
+                    res = await client.get(path.format(q=random.choice(QUERIES)))
+                    if res.status_code != 200:
+                        errors += 1
+                        continue
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return len(latencies) / elapsed, latencies, errors
+
+
+def _p(xs, q):
+    return statistics.quantiles(xs, n=100)[q - 1] if len(xs) > 1 else (xs[0] if xs else 0.0)
+
+
+async def main(workers, port, path, concurrency, seconds):
+    base = f"http://127.0.0.1:{port}"
+    results = []
+    if max(workers) >= (os.cpu_count() or 1):
+        # The load generator runs on the same box: beyond cores - 1 workers
+        # compete with it (and each other) and throughput goes down, not up
+        print(f"note: {os.cpu_count()} cores; worker counts >= cores measure contention, not scaling")
+    for n in workers:
+        proc = subprocess.Popen(
+            [sys.executable, "serve.py", "--workers", str(n), "--port", str(port), "--host", "127.0.0.1"],
+            env={**os.environ, "PYTHONUNBUFFERED": "1"},
+            stdout=subprocess.DEVNULL,
+        )
+        try:
+            await _wait_ready(base, path)
+            await _load(base, path, concurrency, 2)  # warm every worker
+            rps, latencies, errors = await _load(base, path, concurrency, seconds)
+        finally:
+            proc.terminate()
+            proc.wait(timeout=60)
+        results.append((n, rps))
+        print(
+            f"workers {n:2d}: {rps:8.1f} req/s   p50 {_p(latencies, 50):7.1f} ms   "
+            f"p99 {_p(latencies, 99):7.1f} ms   errors {errors}"
+        )
+
+    base_n, base_rps = results[0]
+    for n, rps in results[1:]:
+        print(f"{n} vs {base_n} workers: x{rps / base_rps:.2f} throughput ({os.cpu_count()} cores)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--path", default="/api/ai/geo/area-names?q={q}&limit=5")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--seconds", type=float, default=15)
+    args = parser.parse_args()
+    asyncio.run(main(args.workers, args.port, args.path, args.concurrency, args.seconds))
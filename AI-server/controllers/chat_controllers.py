@@ -1,31 +1,87 @@
-from fastapi import Body, HTTPException
-from database import init_db_connection
-from psycopg2.extras import RealDictCursor
+from fastapi import Body, HTTPException, Response
+from fastapi.responses import JSONResponse
+from database import get_db_connection
+from typing import Optional
+from helper.conversations import (
+    CHAT_PAGE_SIZE,
+    pg_conversation_version,
+    pg_get_messages_page,
+    history_etag,
+)
+from helper.message_archive import load_segment
 from utils.insights_graph import insight_graph
+from utils.stream_runs import sse_frame
+from utils.llm_scheduler import set_llm_principal, BACKGROUND, INTERACTIVE
 
-db = init_db_connection()
+CHAT_HISTORY_CACHE_CONTROL = "private, no-cache"
 
-def fetch_chat_messages(user_id: str):
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    return bool(if_none_match) and (
+        if_none_match.strip() == "*"
+        or etag in [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    )
+
+
+def chat_history_response(version, payload_fn, if_none_match: Optional[str] = None, **params):
+    """
+    Conditional JSON response for a view of the history: 304 when the
+    client's ETag matches the conversation's current version, otherwise
+    payload_fn() with the ETag attached.
+    """
+    etag = history_etag(version, **params)
+    headers = {"ETag": etag, "Cache-Control": CHAT_HISTORY_CACHE_CONTROL}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=payload_fn(), headers=headers)
+
+
+def fetch_chat_messages(
+    user_id: str,
+    before: Optional[int] = None,
+    after: Optional[int] = None,
+    limit: int = CHAT_PAGE_SIZE,
+    segment: Optional[int] = None,
+    if_none_match: Optional[str] = None,
+):
+    """
+    One page of hot messages (newest by default, or around a before/after
+    message id cursor), or with `segment` one archived segment (0 = oldest).
+    `archived.next_segment` is the segment to page in next when scrolling
+    back past the hot tier, None once the history is exhausted.
+    """
     # You can add stricter validation if needed, e.g. UUID regex
     if not user_id or not isinstance(user_id, str):
         raise HTTPException(status_code=400, detail="Invalid user ID")
 
-    with db.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute(
-            """
-            SELECT messages
-            FROM conversations
-            WHERE session_id = %s
-            LIMIT 1
-            """,
-            (user_id,),
-        )
-        record = cur.fetchone()
+    version = pg_conversation_version(user_id)
+    if not version:
+        return {"messages": [], "archived": {"segments": 0, "messages": 0, "next_segment": None}}
+
+    if segment is None:
+        def page():
+            try:
+                record = pg_get_messages_page(user_id, before=before, after=after, limit=limit)
+            except LookupError:
+                raise HTTPException(status_code=404, detail="Message cursor not found")
+            return {"messages": record["messages"], "page": record["page"], "archived": record["archived"]}
+
+        return chat_history_response(version, page, if_none_match, before=before, after=after, limit=limit)
+
+    if segment >= version["archived_segments"]:
+        raise HTTPException(status_code=404, detail="Archived segment not found")
 
-    if not record:
-        return {"messages": []}
+    def archived_segment():
+        messages = load_segment(get_db_connection(), version["id"], segment)
+        if messages is None:
+            raise HTTPException(status_code=404, detail="Archived segment not found")
+        return {
+            "messages": messages,
+            "segment": segment,
+            "archived": {"next_segment": segment - 1 if segment > 0 else None},
+        }
 
-    return {"messages": record.get("messages", [])}
+    return chat_history_response(version, archived_segment, if_none_match, segment=segment)
 
 
 async def generate_insight(chart_type, context, data_summary, detail_level):
@@ -36,3 +92,52 @@ async def generate_insight(chart_type, context, data_summary, detail_level):
         "detail_level": detail_level,
     })
     return {"insight": result["insight"]}
+
+
+def insight_state(request) -> dict:
+    return {
+        "chart_type": request.chart_type,
+        "context": request.context,
+        "data_summary": request.data_summary,
+        "detail_level": request.detail_level,
+        "mode": request.mode,
+    }
+
+
+def insight_payload(mode: str, result: dict) -> dict:
+    """Response body of /generate/insights for a finished insight_graph run."""
+    if mode == "narrative":
+        return {"aiNarrative": result.get("narrative", "No narrative generated.")}
+    elif "agent_output" in result:
+        return {"agent_output": result["agent_output"]}
+    elif mode == "snapshot":
+        return {
+            "snapshotVerdict": result.get("snapshot_verdict", "Neutral"),
+            "snapshotReason": result.get("snapshot_reason", "")
+        }
+    elif mode == "investment_score":
+        return {
+            "score": result.get("score"),
+            "label": result.get("label"),
+            "drivers": result.get("drivers"),
+            "ai_explanation": result.get("ai_explanation"),
+        }
+    else:
+        return {"insight": result.get("insight", "No insight generated.")}
+
+
+def set_insight_principal(request, client: Optional[str] = None):
+    set_llm_principal(request.user_id, client, BACKGROUND if request.priority == "background" else INTERACTIVE)
+
+
+async def stream_insight(request, client: Optional[str] = None):
+    """An insight run as SSE frames (stage, then insight_result or error), for utils.stream_runs."""
+    set_insight_principal(request, client)
+    yield sse_frame({"type": "stage", "stage": "analyzing"})
+    try:
+        result = await insight_graph.ainvoke(insight_state(request))
+    except Exception as e:
+        print("❌ AI generation error:", e)
+        yield sse_frame({"type": "error", "message": "Failed to generate AI insight.", "code": "INSIGHT_ERROR"})
+        return
+    yield sse_frame({"type": "insight_result", "mode": request.mode, "payload": insight_payload(request.mode, result)})
@@ -0,0 +1,73 @@
+from fastapi import HTTPException, Response
+from utils.geo_index import get_geo_index
+from utils.geometry_service import get_geometry_service
+from utils.area_resolver import get_area_resolver
+
+MAX_POINTS_PER_CALL = 50000
+
+
+def resolve_points(points: list):
+    """Map [[lon, lat], ...] to the most specific area polygon containing each point."""
+    if not points:
+        return {"areas": []}
+    if len(points) > MAX_POINTS_PER_CALL:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_POINTS_PER_CALL} points per call")
+    try:
+        lon = [float(p[0]) for p in points]
+        lat = [float(p[1]) for p in points]
+    except (TypeError, ValueError, IndexError):
+        raise HTTPException(status_code=400, detail="points must be [[lon, lat], ...]")
+
+    return {"areas": get_geo_index().resolve(lon, lat)}
+
+
+def resolve_area_names(q: str, limit: int = 5):
+    """Fuzzy/alias area-name lookup -> canonical location and dim_area ids."""
+    from utils.tools import engine  # shared DB engine, loaded with the agent tools
+
+    if not q or not q.strip():
+        raise HTTPException(status_code=400, detail="q is required")
+    return {"query": q, "matches": get_area_resolver(engine).resolve(q, limit=limit)}
+
+
+GEOMETRY_CACHE_CONTROL = "public, max-age=86400"
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """Whether Accept-Encoding allows gzip, honouring q-values (gzip;q=0 refuses it)."""
+    qualities = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding:
+            qualities[coding.strip().lower()] = q
+    q = qualities.get("gzip", qualities.get("x-gzip", qualities.get("*", 0.0)))
+    return q > 0
+
+
+def area_geometry_response(area_key, zoom: int, if_none_match: str = None, accept_encoding: str = ""):
+    """
+    Pre-simplified boundary payload for one area (or all areas when area_key
+    is None) at the given zoom. Served from bytes built at startup, with a
+    content ETag per encoding so repeat map loads are a 304.
+    """
+    payload = get_geometry_service().get(area_key, zoom)
+    if payload is None:
+        raise HTTPException(status_code=404, detail=f"Unknown area: {area_key}")
+
+    gzipped = accepts_gzip(accept_encoding)
+    etag = payload.etag_gzip if gzipped else payload.etag
+    headers = {"ETag": etag, "Cache-Control": GEOMETRY_CACHE_CONTROL, "Vary": "Accept-Encoding"}
+    if if_none_match and etag in [t.strip().removeprefix("W/") for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    if gzipped:
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=payload.gzipped, media_type="application/geo+json", headers=headers)
+    return Response(content=payload.body, media_type="application/geo+json", headers=headers)
@@ -1,5 +1,6 @@
 import psycopg2
 import os
+import threading
 
 
 def init_db_connection():
@@ -24,3 +25,38 @@ def init_db_connection():
     except Exception as e:
         print("Database connection failed:", e)
         return None
+
+
+# -----------------------
+# Per-process connection
+# -----------------------
+_conn = None
+_conn_pid = None
+_conn_lock = threading.Lock()
+
+
+def get_db_connection():
+    """
+    This process's shared connection, opened on first use. A forked worker
+    gets its own instead of the parent's socket, and a closed connection is
+    reopened. None while the database is unreachable.
+    """
+    global _conn, _conn_pid
+    conn = _conn
+    if conn is None or _conn_pid != os.getpid() or conn.closed:
+        with _conn_lock:
+            if _conn is None or _conn_pid != os.getpid() or _conn.closed:
+                # The parent's connection is only dropped, never closed here:
+                # closing would end the session it is still using
+                _conn = init_db_connection()
+                _conn_pid = os.getpid()
+            conn = _conn
+    return conn
+
+
+def close_db_connection():
+    global _conn
+    with _conn_lock:
+        if _conn is not None and _conn_pid == os.getpid() and not _conn.closed:
+            _conn.close()
+        _conn = None
@@ -1,9 +1,14 @@
 from psycopg2.extras import RealDictCursor
-from database import init_db_connection
+from database import get_db_connection
+from helper.message_archive import ensure_archive_schema, archive_summary, delete_archives, MESSAGE_COLUMNS
+from typing import Optional
+import hashlib
 import json
+import os
 
 
-db = init_db_connection()
+CHAT_PAGE_SIZE = int(os.getenv("CHAT_PAGE_SIZE", "50"))
+CHAT_PAGE_MAX = int(os.getenv("CHAT_PAGE_MAX", "200"))
 
 # -----------------------
 # Postgres helper methods
@@ -11,7 +16,13 @@ db = init_db_connection()
 
 
 def pg_get_conversation(session_id: str):
-    """Return conversation metadata + list of messages in strict chronological order (no json_agg)."""
+    """
+    Return conversation metadata + list of hot messages in strict chronological
+    order (no json_agg). Older messages moved to the cold tier are only counted
+    under "archived"; see helper.message_archive.
+    """
+    db = get_db_connection()
+    ensure_archive_schema(db)
 
     with db.cursor(cursor_factory=RealDictCursor) as cur:
         try:
@@ -49,6 +60,7 @@ def pg_get_conversation(session_id: str):
 
             # Attach messages to the conversation
             convo["messages"] = messages
+            convo["archived"] = archive_summary(cur, convo["id"])
             return convo
 
         except Exception:
@@ -56,10 +68,161 @@ def pg_get_conversation(session_id: str):
             raise
 
 
+def pg_conversation_version(session_id: str):
+    """
+    Cheap validator for a conversation's history: id, greeted, the latest
+    message id and the number of archived segments. None if there is no
+    conversation.
+    """
+    db = get_db_connection()
+    ensure_archive_schema(db)
+
+    with db.cursor(cursor_factory=RealDictCursor) as cur:
+        try:
+            cur.execute(
+                """
+                SELECT c.id,
+                       c.greeted,
+                       (SELECT m.id FROM messages m
+                        WHERE m.conversation_id = c.id
+                        ORDER BY m.created_at DESC, m.id DESC
+                        LIMIT 1) AS last_message_id,
+                       (SELECT COUNT(*) FROM message_archives a
+                        WHERE a.conversation_id = c.id) AS archived_segments
+                FROM conversations c
+                WHERE c.session_id = %s
+                """,
+                (session_id,),
+            )
+            version = cur.fetchone()
+            db.commit()
+            return version
+        except Exception:
+            db.rollback()
+            raise
+
+
+def history_etag(version, **params) -> str:
+    """ETag of one view (page / segment) of a conversation's history at a given version."""
+    key = f"{version['id']}:{version['last_message_id']}:{version['archived_segments']}:{sorted(params.items())}"
+    return '"' + hashlib.sha1(key.encode("utf-8")).hexdigest()[:20] + '"'
+
+
+def pg_get_messages_page(
+    session_id: str,
+    before: Optional[int] = None,
+    after: Optional[int] = None,
+    limit: int = CHAT_PAGE_SIZE,
+):
+    """
+    One page of hot messages in chronological order, keyed by message id
+    cursors: the newest `limit` messages by default, the `limit` messages
+    just older than `before`, or just newer than `after`.
+
+    A cursor the archiver has since moved to the cold tier resolves to its
+    segment, returned as `archived.next_segment`: going back there is
+    nothing hot left, going forward the page restarts at the oldest hot
+    message. Raises LookupError for a cursor that is not in the
+    conversation at all.
+    """
+    db = get_db_connection()
+    ensure_archive_schema(db)
+    limit = max(1, min(limit, CHAT_PAGE_MAX))
+    cursor_id = before if before is not None else after
+    newest_first = before is not None or after is None
+    direction = "DESC" if newest_first else "ASC"
+
+    with db.cursor(cursor_factory=RealDictCursor) as cur:
+        try:
+            cur.execute(
+                """
+                SELECT id, session_id, greeted, user_name
+                FROM conversations
+                WHERE session_id = %s
+                """,
+                (session_id,),
+            )
+            convo = cur.fetchone()
+            if not convo:
+                db.commit()
+                return None
+
+            cursor_sql, cursor_arg, cursor_segment = "", (), None
+            if cursor_id is not None:
+                cur.execute(
+                    "SELECT created_at, id FROM messages WHERE id = %s AND conversation_id = %s",
+                    (cursor_id, convo["id"]),
+                )
+                at = cur.fetchone()
+                if at is not None:
+                    cursor_sql = "AND (created_at, id) < (%s, %s)" if newest_first else "AND (created_at, id) > (%s, %s)"
+                    cursor_arg = (at["created_at"], at["id"])
+                else:
+                    cur.execute(
+                        """
+                        SELECT segment FROM message_archives
+                        WHERE conversation_id = %s AND %s BETWEEN first_message_id AND last_message_id
+                        """,
+                        (convo["id"], cursor_id),
+                    )
+                    archived_at = cur.fetchone()
+                    if archived_at is None:
+                        raise LookupError(f"Message {cursor_id} is not in this conversation")
+                    cursor_segment = archived_at["segment"]
+
+            if cursor_segment is not None and newest_first:
+                # Archived messages are older than every hot one
+                rows, has_more = [], False
+            else:
+                # Fetch one extra row to know whether there is more in that direction
+                cur.execute(
+                    f"""
+                    SELECT {MESSAGE_COLUMNS}
+                    FROM messages
+                    WHERE conversation_id = %s {cursor_sql}
+                    ORDER BY created_at {direction}, id {direction}
+                    LIMIT %s
+                    """,
+                    (convo["id"], *cursor_arg, limit + 1),
+                )
+                rows = cur.fetchall()
+                has_more = len(rows) > limit
+                rows = rows[:limit]
+                if newest_first:
+                    rows.reverse()
+
+            archived = archive_summary(cur, convo["id"])
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+    has_more_before = has_more if newest_first else after is not None
+    has_more_after = has_more if not newest_first else before is not None
+    convo["messages"] = rows
+    convo["page"] = {
+        "limit": limit,
+        # Cursors for the neighbouring pages
+        "before": rows[0]["id"] if rows else before,
+        "after": rows[-1]["id"] if rows else after,
+        "has_more_before": has_more_before,
+        "has_more_after": has_more_after,
+    }
+    if cursor_segment is not None:
+        # The rest of the cursor's segment was never part of a hot page
+        archived["next_segment"] = cursor_segment
+    else:
+        # Once the hot tier is exhausted going back, continue with the newest archived segment
+        archived["next_segment"] = archived["segments"] - 1 if archived["segments"] and not has_more_before else None
+    convo["archived"] = archived
+    return convo
+
+
 def pg_append_messages(session_id: str, messages_list: list):
     if not messages_list:
         return
 
+    db = get_db_connection()
     try:
         with db.cursor() as cur:
             cur.execute("""
@@ -93,6 +256,8 @@ def pg_append_messages(session_id: str, messages_list: list):
 
 def pg_upsert_greeting(session_id: str, fname: str, formatted_messages: list):
     """Ensure greeting exists: overwrite user_name + mark greeted + insert fresh messages."""
+    db = get_db_connection()
+    ensure_archive_schema(db)
     with db.cursor() as cur:
         # Upsert conversation
         cur.execute(
@@ -109,6 +274,7 @@ def pg_upsert_greeting(session_id: str, fname: str, formatted_messages: list):
 
         # Clear old messages for greeting reset
         cur.execute("DELETE FROM messages WHERE conversation_id = %s", (conv_id,))
+        delete_archives(cur, conv_id)
 
         # Insert greeting messages
         for msg in formatted_messages:
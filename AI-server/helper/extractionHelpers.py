@@ -8,6 +8,9 @@ def _unwrap_tool_output(tout):
 
     # Handle LangChain ToolMessage wrapper
     if isinstance(tout, ToolMessage):
+        # Compacted tools keep the full result on the artifact
+        if tout.artifact is not None:
+            return tout.artifact
         try:
             return json.loads(tout.content)  # parse the JSON string
         except Exception:
@@ -0,0 +1,241 @@
+# message_archive.py
+"""
+Cold tier for conversation messages.
+
+    cd AI-server && python -m helper.message_archive [--dry-run]
+
+Per conversation, messages that are outside the newest MESSAGE_HOT_KEEP and
+older than MESSAGE_ARCHIVE_AGE_DAYS are moved, oldest first, into
+fixed-size segments: one zstd-compressed JSON blob per segment in
+message_archives, deleted from messages in the same transaction. Segments
+are numbered 0.. from the oldest and never rewritten; only whole segments
+are archived, leftovers stay hot until the next run.
+"""
+import os
+import json
+import time
+import argparse
+from typing import Any, Dict, List, Optional
+
+import psycopg2
+import zstandard
+from psycopg2.extras import RealDictCursor
+
+MESSAGE_HOT_KEEP = int(os.getenv("MESSAGE_HOT_KEEP", "50"))
+MESSAGE_ARCHIVE_AGE_DAYS = int(os.getenv("MESSAGE_ARCHIVE_AGE_DAYS", "30"))
+MESSAGE_ARCHIVE_SEGMENT_SIZE = int(os.getenv("MESSAGE_ARCHIVE_SEGMENT_SIZE", "100"))
+MESSAGE_ARCHIVE_ZSTD_LEVEL = int(os.getenv("MESSAGE_ARCHIVE_ZSTD_LEVEL", "10"))
+
+# Same message shape as pg_get_conversation
+MESSAGE_COLUMNS = """
+    id,
+    role,
+    content,
+    user_id,
+    to_char(created_at, 'YYYY-MM-DD"T"HH24:MI:SS.MS') || 'Z' AS created_at,
+    sources,
+    followups,
+    images
+"""
+
+_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS message_archives (
+    conversation_id  BIGINT NOT NULL,
+    segment          INTEGER NOT NULL,
+    message_count    INTEGER NOT NULL,
+    first_message_id BIGINT,
+    last_message_id  BIGINT,
+    first_created_at TEXT,
+    last_created_at  TEXT,
+    raw_bytes        INTEGER NOT NULL,
+    payload          BYTEA NOT NULL,
+    archived_at      TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (conversation_id, segment)
+)
+"""
+
+# Connections whose schema has been ensured in this process
+_schema_ready = set()
+
+
+def ensure_archive_schema(conn):
+    if id(conn) in _schema_ready:
+        return
+    with conn.cursor() as cur:
+        cur.execute(_SCHEMA_SQL)
+    conn.commit()
+    _schema_ready.add(id(conn))
+
+
+def compress_messages(messages: List[Dict[str, Any]]) -> bytes:
+    raw = json.dumps(messages, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+    return zstandard.ZstdCompressor(level=MESSAGE_ARCHIVE_ZSTD_LEVEL).compress(raw)
+
+
+def decompress_messages(payload: bytes) -> List[Dict[str, Any]]:
+    return json.loads(zstandard.ZstdDecompressor().decompress(bytes(payload)))
+
+
+# -----------------------
+# Reads
+# -----------------------
+def archive_summary(cur, conversation_id) -> Dict[str, Any]:
+    """Segment/message counts of a conversation's cold tier (cursor of the caller's transaction)."""
+    cur.execute(
+        """
+        SELECT COUNT(*) AS segments, COALESCE(SUM(message_count), 0) AS messages
+        FROM message_archives
+        WHERE conversation_id = %s
+        """,
+        (conversation_id,),
+    )
+    row = cur.fetchone()
+    segments, messages = (row["segments"], row["messages"]) if isinstance(row, dict) else row
+    return {"segments": int(segments), "messages": int(messages)}
+
+
+def load_segment(conn, conversation_id, segment: int) -> Optional[List[Dict[str, Any]]]:
+    """Messages of one archived segment in chronological order, or None if it does not exist."""
+    ensure_archive_schema(conn)
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT payload FROM message_archives WHERE conversation_id = %s AND segment = %s",
+            (conversation_id, segment),
+        )
+        row = cur.fetchone()
+    conn.commit()
+    return decompress_messages(row[0]) if row else None
+
+
+def delete_archives(cur, conversation_id):
+    cur.execute("DELETE FROM message_archives WHERE conversation_id = %s", (conversation_id,))
+
+
+# -----------------------
+# Archival job
+# -----------------------
+def _candidates(cur, hot_keep: int, age_days: int, segment_size: int) -> Dict[Any, int]:
+    """conversation_id -> number of archivable messages (at least one segment's worth)."""
+    cur.execute(
+        """
+        WITH ranked AS (
+            SELECT conversation_id, created_at,
+                   row_number() OVER (PARTITION BY conversation_id ORDER BY created_at DESC, id DESC) AS rn
+            FROM messages
+        )
+        SELECT conversation_id, COUNT(*)
+        FROM ranked
+        WHERE rn > %s AND created_at < now() - make_interval(days => %s)
+        GROUP BY conversation_id
+        HAVING COUNT(*) >= %s
+        """,
+        (hot_keep, age_days, segment_size),
+    )
+    return dict(cur.fetchall())
+
+
+def archive_conversation(conn, conversation_id, archivable: int, segment_size: int = MESSAGE_ARCHIVE_SEGMENT_SIZE) -> Dict[str, int]:
+    """Move the oldest whole segments' worth of messages into the cold tier (one transaction)."""
+    n = (archivable // segment_size) * segment_size
+    stats = {"segments": 0, "messages": 0, "raw_bytes": 0, "stored_bytes": 0}
+    if n == 0:
+        return stats
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                f"""
+                SELECT {MESSAGE_COLUMNS}
+                FROM messages
+                WHERE conversation_id = %s
+                ORDER BY created_at ASC, id ASC
+                LIMIT %s
+                """,
+                (conversation_id, n),
+            )
+            rows = cur.fetchall()
+            cur.execute(
+                "SELECT COALESCE(MAX(segment) + 1, 0) AS next FROM message_archives WHERE conversation_id = %s",
+                (conversation_id,),
+            )
+            segment = cur.fetchone()["next"]
+
+            for i in range(0, len(rows) - len(rows) % segment_size, segment_size):
+                chunk = [dict(r) for r in rows[i:i + segment_size]]
+                payload = compress_messages(chunk)
+                raw_bytes = len(json.dumps(chunk, ensure_ascii=False, default=str).encode("utf-8"))
+                cur.execute(
+                    """
+                    INSERT INTO message_archives (
+                        conversation_id, segment, message_count,
+                        first_message_id, last_message_id, first_created_at, last_created_at,
+                        raw_bytes, payload
+                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    """,
+                    (
+                        conversation_id, segment, len(chunk),
+                        chunk[0]["id"], chunk[-1]["id"], chunk[0]["created_at"], chunk[-1]["created_at"],
+                        raw_bytes, psycopg2.Binary(payload),
+                    ),
+                )
+                cur.execute("DELETE FROM messages WHERE id = ANY(%s)", ([m["id"] for m in chunk],))
+                segment += 1
+                stats["segments"] += 1
+                stats["messages"] += len(chunk)
+                stats["raw_bytes"] += raw_bytes
+                stats["stored_bytes"] += len(payload)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return stats
+
+
+def archive_old_messages(
+    conn,
+    hot_keep: int = MESSAGE_HOT_KEEP,
+    age_days: int = MESSAGE_ARCHIVE_AGE_DAYS,
+    segment_size: int = MESSAGE_ARCHIVE_SEGMENT_SIZE,
+    dry_run: bool = False,
+) -> Dict[str, Any]:
+    start = time.perf_counter()
+    ensure_archive_schema(conn)
+    with conn.cursor() as cur:
+        candidates = _candidates(cur, hot_keep, age_days, segment_size)
+    conn.commit()
+
+    totals = {"conversations": 0, "segments": 0, "messages": 0, "raw_bytes": 0, "stored_bytes": 0, "failed": 0}
+    for conversation_id, archivable in candidates.items():
+        if dry_run:
+            totals["conversations"] += 1
+            totals["messages"] += (archivable // segment_size) * segment_size
+            continue
+        try:
+            stats = archive_conversation(conn, conversation_id, archivable, segment_size)
+        except Exception as e:
+            print(f"❌ Archiving conversation {conversation_id} failed: {e}")
+            totals["failed"] += 1
+            continue
+        totals["conversations"] += 1
+        for k, v in stats.items():
+            totals[k] += v
+
+    totals["elapsed_s"] = round(time.perf_counter() - start, 2)
+    return totals
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    from database import init_db_connection
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--hot-keep", type=int, default=MESSAGE_HOT_KEEP)
+    parser.add_argument("--age-days", type=int, default=MESSAGE_ARCHIVE_AGE_DAYS)
+    parser.add_argument("--segment-size", type=int, default=MESSAGE_ARCHIVE_SEGMENT_SIZE)
+    args = parser.parse_args()
+
+    print(archive_old_messages(
+        init_db_connection(), args.hot_keep, args.age_days, args.segment_size, dry_run=args.dry_run,
+    ))
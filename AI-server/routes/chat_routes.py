@@ -1,22 +1,49 @@
-from fastapi import APIRouter, Body, Request
-from controllers.chat_controllers import fetch_chat_messages
+import os
+import hmac
+
+from fastapi import APIRouter, Body, Header, HTTPException, Query, Request
+from controllers.chat_controllers import fetch_chat_messages, insight_state, insight_payload, set_insight_principal
+from helper.conversations import CHAT_PAGE_SIZE, CHAT_PAGE_MAX
+from utils import metrics
 from utils.insights_graph import insight_graph
+from utils.llm_scheduler import request_client
 
 from pydantic import BaseModel
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Literal, Optional
 
 class InsightRequest(BaseModel):
     chart_type: str
     context: Dict[Any, Any]
-    data_summary: List[Dict[Any, Any]]
+    data_summary: List[Dict[Any, Any]] = []  # empty: built from the monthly rollups
     detail_level: str = "short"
     mode: str = "insight"
+    user_id: Optional[str] = None  # fair LLM scheduling; anonymous callers by client
+    priority: Literal["interactive", "background"] = "interactive"  # background: dashboard pre-compute
 
 router = APIRouter()
 
 @router.get("/get-chat-messages/{user_id}")
-def get_chat_messages(user_id: str):
-    return fetch_chat_messages(user_id)
+def get_chat_messages(
+    user_id: str,
+    before: Optional[int] = Query(None, description="Message id; return the page just older than it"),
+    after: Optional[int] = Query(None, description="Message id; return the page just newer than it"),
+    limit: int = Query(CHAT_PAGE_SIZE, ge=1, le=CHAT_PAGE_MAX),
+    segment: Optional[int] = Query(None, ge=0, description="Archived segment to page in (see archived.next_segment)"),
+    if_none_match: Optional[str] = Header(None),
+):
+    """Cursor-paginated history with ETag validation; unchanged pages are a 304."""
+    return fetch_chat_messages(user_id, before, after, limit, segment, if_none_match)
+
+
+@router.get("/metrics")
+def get_metrics(authorization: Optional[str] = Header(None)):
+    """In-process counters (tool latency, timeouts, ...); needs `Authorization: Bearer $METRICS_TOKEN`."""
+    token = os.getenv("METRICS_TOKEN")
+    if not token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not authorization or not hmac.compare_digest(authorization, f"Bearer {token}"):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return metrics.snapshot()
 
 
 # @router.post("/generate/insights")
@@ -79,39 +106,16 @@ from typing import List, Dict, Any
 
 
 @router.post("/generate/insights")
-async def generate_insights(request: InsightRequest):
+async def generate_insights(request: InsightRequest, http_request: Request):
     """
     Unified AI endpoint for insights, narratives, and tool-using agents.
     """
     try:
-        state = {
-            "chart_type": request.chart_type,
-            "context": request.context,
-            "data_summary": request.data_summary,
-            "detail_level": request.detail_level,
-            "mode": request.mode,
-        }
         print("===================================== request", request)
-        result = insight_graph.invoke(state)
-
-        if request.mode == "narrative":
-            return {"aiNarrative": result.get("narrative", "No narrative generated.")}
-        elif "agent_output" in result:
-            return {"agent_output": result["agent_output"]}
-        elif request.mode == "snapshot":
-            return {
-                "snapshotVerdict": result.get("snapshot_verdict", "Neutral"),
-                "snapshotReason": result.get("snapshot_reason", "")
-            }
-        elif request.mode == "investment_score":
-            return {
-                "score": result.get("score"),
-                "label": result.get("label"),
-                "drivers": result.get("drivers"),
-                "ai_explanation": result.get("ai_explanation"),
-            }
-        else:
-            return {"insight": result.get("insight", "No insight generated.")}
+        set_insight_principal(request, request_client(http_request))
+        # ainvoke: the graph's sync LLM calls wait for a scheduler slot in a worker thread, not on the event loop
+        result = await insight_graph.ainvoke(insight_state(request))
+        return insight_payload(request.mode, result)
     except Exception as e:
         print("❌ AI generation error:", e)
         return {"error": f"Failed to generate AI insight: {str(e)}"}
\ No newline at end of file
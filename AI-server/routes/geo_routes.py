@@ -0,0 +1,45 @@
+from fastapi import APIRouter, Header, Query
+from pydantic import BaseModel
+from typing import List, Optional
+
+from controllers.geo_controllers import resolve_points, resolve_area_names, area_geometry_response
+
+
+class ResolvePointsRequest(BaseModel):
+    points: List[List[float]]  # [[lon, lat], ...]
+
+
+router = APIRouter()
+
+
+@router.post("/resolve")
+def resolve(request: ResolvePointsRequest):
+    """Batched point -> area lookup against the export.geojson boundaries."""
+    return resolve_points(request.points)
+
+
+@router.get("/area-names")
+def area_names(q: str, limit: int = Query(5, ge=1, le=25)):
+    """Resolve user-typed area text ("JVC", "busines bay") to canonical ids."""
+    return resolve_area_names(q, limit)
+
+
+@router.get("/areas")
+def all_area_geometry(
+    zoom: int = Query(10, ge=0, le=22),
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(""),
+):
+    """FeatureCollection of every area boundary, simplified for the map zoom."""
+    return area_geometry_response(None, zoom, if_none_match, accept_encoding)
+
+
+@router.get("/areas/{area_key}")
+def area_geometry(
+    area_key: str,
+    zoom: int = Query(12, ge=0, le=22),
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(""),
+):
+    """One area's boundary (keyed by name slug, e.g. business-bay) at the map zoom."""
+    return area_geometry_response(area_key, zoom, if_none_match, accept_encoding)
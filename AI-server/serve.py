@@ -0,0 +1,60 @@
+"""
+Multi-worker server.
+
+    cd AI-server && python serve.py --workers 4
+
+Runs uvicorn with --workers (WEB_CONCURRENCY, default: one per core).
+Workers are separate processes that each import the app and open their own
+database pools, checkpointer and HTTP clients in the app's lifespan; caches
+meant to be shared between them go through utils.shared_store (sqlite on
+one box unless SHARED_STORE_BACKEND / REDIS_URL say otherwise). On SIGTERM
+a worker answers new chat turns with SERVER_DRAINING right away, stops
+accepting connections, waits up to --graceful-timeout for open streams,
+then drains the detached chat runs (STREAM_DRAIN_TIMEOUT_S).
+
+Chat runs (utils.stream_runs) live in the worker that started them, so a
+Last-Event-ID resume or a cancel only works when it reaches that worker.
+Workers of one uvicorn share a socket and the kernel picks which accepts
+a connection, so --workers > 1 means a reconnect can land elsewhere and
+get STREAM_EXPIRED. Where resume matters, run single-worker instances
+on separate ports (serve.py --workers 1 --port N) behind a proxy with
+sticky sessions keyed on the user, e.g. nginx `hash $arg_user_id
+consistent;` for /chat_stream, cookie affinity for /chat_ws.
+
+Fork-based servers (gunicorn with preload) are covered too: the psycopg2
+connection, SQLAlchemy pools, HTTP client and shared store are re-created
+in a forked child instead of sharing the parent's sockets.
+"""
+import os
+import argparse
+
+import uvicorn
+from dotenv import load_dotenv
+
+
+def default_workers() -> int:
+    return int(os.getenv("WEB_CONCURRENCY") or os.cpu_count() or 1)
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=default_workers())
+    parser.add_argument(
+        "--graceful-timeout", type=float, default=float(os.getenv("SHUTDOWN_GRACE_S", "30")),
+        help="seconds open connections get to finish on shutdown",
+    )
+    args = parser.parse_args()
+
+    # Workers inherit the environment; shared_store picks its default from this
+    os.environ["WEB_CONCURRENCY"] = str(args.workers)
+    uvicorn.run(
+        "app:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        proxy_headers=True,
+    )
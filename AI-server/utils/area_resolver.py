@@ -0,0 +1,315 @@
+# area_resolver.py
+import os
+import re
+import time
+import difflib
+import threading
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+LOCATIONS_DUMP_PATH = os.getenv("LOCATIONS_DUMP_PATH", os.path.join(_ROOT, "locations.sql"))
+AREA_RESOLVER_TTL_S = float(os.getenv("AREA_RESOLVER_TTL_S", "3600"))
+# Below this a fuzzy candidate is not considered a match
+AREA_MATCH_THRESHOLD = float(os.getenv("AREA_MATCH_THRESHOLD", "0.72"))
+# Longest phrase (in words) tried when scanning free text for area mentions
+MAX_MENTION_WORDS = 6
+
+# Colloquial names -> canonical name (normalized form)
+ALIASES = {
+    "jvc": "jumeirah village circle",
+    "jvt": "jumeirah village triangle",
+    "jlt": "jumeirah lake towers",
+    "jbr": "jumeirah beach residence",
+    "jge": "jumeirah golf estates",
+    "dip": "dubai investment park dip",
+    "dubai investment park": "dubai investment park dip",
+    "dso": "dubai silicon oasis",
+    "dsc": "dubai sports city",
+    "mbr city": "mohammed bin rashid city",
+    "mbr": "mohammed bin rashid city",
+    "dubailand": "dubai land",
+    "dwc": "dubai south dubai world central",
+    "dubai south": "dubai south dubai world central",
+    "downtown": "downtown dubai",
+    "marina": "dubai marina",
+    "the palm": "palm jumeirah",
+    "palm": "palm jumeirah",
+    "creek harbour": "dubai creek harbour the lagoons",
+    "dubai creek harbour": "dubai creek harbour the lagoons",
+    "hills": "dubai hills estate",
+    "dubai hills": "dubai hills estate",
+    "tecom": "barsha heights tecom",
+    "barsha heights": "barsha heights tecom",
+}
+
+_INSERT_RE = re.compile(
+    r"INSERT INTO public\.locations \(location_id, source, source_location_id, name, slug, level, parent_location_id\) "
+    r"VALUES \((\d+), '(?:[^']|'')*', (?:NULL|'(?:[^']|'')*'), '((?:[^']|'')*)', (NULL|'(?:[^']|'')*'), "
+    r"(NULL|'(?:[^']|'')*'), (NULL|\d+)\);"
+)
+
+
+def normalize(name: str) -> str:
+    name = name.lower().replace("&", " and ")
+    name = re.sub(r"[^a-z0-9]+", " ", name)
+    return re.sub(r"^the ", "", " ".join(name.split()))
+
+
+def _trigrams(s: str) -> set:
+    padded = f"  {s} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _acronym(norm: str) -> Optional[str]:
+    words = [w for w in norm.split() if w not in ("and", "of", "al")]
+    return "".join(w[0] for w in words) if len(words) >= 3 else None
+
+
+def _sql_str(v: str) -> Optional[str]:
+    return None if v == "NULL" else v[1:-1].replace("''", "'")
+
+
+class AreaResolver:
+    """
+    Canonical area lookup over dim_area (official DLD areas) and locations
+    (commercial communities/projects, linked to area_ids through
+    area_commercial_mapping).
+
+    - resolve(text): exact normalized name/slug/alias hit, else trigram
+      candidates reranked by edit-distance ratio
+    - extract(text): area mentions inside a free-text question
+    """
+
+    def __init__(self, entries: List[Dict[str, Any]]):
+        self.entries = entries
+        self._exact: Dict[str, List[int]] = defaultdict(list)
+        self._grams: Dict[str, List[int]] = defaultdict(list)
+        self._norms: List[str] = []
+        self._gram_counts: List[int] = []
+        self.location_area_ids: Dict[int, List[int]] = {
+            e["id"]: e["area_ids"] for e in entries if e["kind"] == "location"
+        }
+
+        for i, e in enumerate(entries):
+            norm = normalize(e["name"])
+            self._norms.append(norm)
+            grams = _trigrams(norm)
+            self._gram_counts.append(len(grams))
+            keys = {norm}
+            if e.get("slug"):
+                keys.add(normalize(e["slug"]))
+            acro = _acronym(norm)
+            if acro and len(acro) >= 3:
+                keys.add(acro)
+            for k in keys:
+                self._exact[k].append(i)
+            for g in grams:
+                self._grams[g].append(i)
+
+        for alias, target in ALIASES.items():
+            if target in self._exact and alias not in self._exact:
+                self._exact[alias] = list(self._exact[target])
+
+    # -----------------------
+    # Loading
+    # -----------------------
+    @classmethod
+    def from_db(cls, engine) -> "AreaResolver":
+        with engine.connect() as conn:
+            areas = conn.execute(text("SELECT area_id, area_name_en FROM dim_area")).fetchall()
+            locations = conn.execute(text(
+                "SELECT location_id, name, slug, level, parent_location_id FROM locations"
+            )).fetchall()
+            try:
+                mapping = conn.execute(text(
+                    "SELECT location_id, area_id FROM area_commercial_mapping "
+                    "WHERE location_id IS NOT NULL AND area_id IS NOT NULL"
+                )).fetchall()
+            except Exception:
+                mapping = []
+        return cls._from_rows(
+            [{"area_id": r[0], "name": r[1]} for r in areas],
+            [{"location_id": r[0], "name": r[1], "slug": r[2], "level": r[3], "parent_id": r[4]} for r in locations],
+            [(r[0], r[1]) for r in mapping],
+        )
+
+    @classmethod
+    def from_dump(cls, path: str = LOCATIONS_DUMP_PATH) -> "AreaResolver":
+        """Offline fallback: locations only, parsed from the pg_dump in the repo root."""
+        return cls._from_rows([], load_locations_dump(path), [])
+
+    @classmethod
+    def _from_rows(cls, areas, locations, mapping) -> "AreaResolver":
+        area_ids_by_name = defaultdict(list)
+        for a in areas:
+            area_ids_by_name[normalize(a["name"])].append(a["area_id"])
+        mapped = defaultdict(set)
+        for location_id, area_id in mapping:
+            mapped[location_id].add(area_id)
+
+        entries = [
+            {"kind": "area", "id": a["area_id"], "name": a["name"], "area_ids": [a["area_id"]]}
+            for a in areas
+        ]
+        for loc in locations:
+            area_ids = mapped.get(loc["location_id"]) or area_ids_by_name.get(normalize(loc["name"]), [])
+            entries.append({
+                "kind": "location",
+                "id": loc["location_id"],
+                "name": loc["name"],
+                "slug": loc.get("slug"),
+                "level": loc.get("level"),
+                "parent_id": loc.get("parent_id"),
+                "area_ids": sorted(area_ids),
+            })
+        return cls(entries)
+
+    # -----------------------
+    # Lookups
+    # -----------------------
+    def _match(self, i: int, score: float, matched: str) -> Dict[str, Any]:
+        return {**self.entries[i], "score": round(score, 3), "matched": matched}
+
+    def resolve(self, query: str, limit: int = 5) -> List[Dict[str, Any]]:
+        """Best matches for one area name, highest score first."""
+        norm = normalize(query)
+        if not norm:
+            return []
+        if norm in self._exact:
+            return [self._match(i, 1.0, norm) for i in self._exact[norm]][:limit]
+
+        grams = _trigrams(norm)
+        shared = Counter(i for g in grams for i in self._grams.get(g, ()))
+        # Trigram dice narrows to a handful; edit ratio only reranks those
+        dice = sorted(
+            ((2 * n / (len(grams) + self._gram_counts[i]), i) for i, n in shared.items()),
+            reverse=True,
+        )[: limit * 2]
+        scored = sorted(
+            ((max(d, difflib.SequenceMatcher(None, norm, self._norms[i]).ratio()), i) for d, i in dice),
+            reverse=True,
+        )
+        return [self._match(i, s, norm) for s, i in scored[:limit] if s >= AREA_MATCH_THRESHOLD]
+
+    def extract(self, question: str) -> List[Dict[str, Any]]:
+        """
+        Area mentions in free text via exact phrase hits (longest first), so
+        "villas in JVC vs Arjan" yields both areas without an LLM round trip.
+        """
+        words = normalize(question).split()
+        found, seen, i = [], set(), 0
+        while i < len(words):
+            for n in range(min(MAX_MENTION_WORDS, len(words) - i), 0, -1):
+                phrase = " ".join(words[i:i + n])
+                hits = self._exact.get(phrase)
+                if hits:
+                    for h in hits:
+                        if h not in seen:
+                            seen.add(h)
+                            found.append(self._match(h, 1.0, phrase))
+                    i += n
+                    break
+            else:
+                i += 1
+        return found
+
+    def subtree_area_ids(self, match: Dict[str, Any], hierarchy=None) -> List[int]:
+        """area_ids of a match, plus those of every location under it when a hierarchy is given."""
+        area_ids = set(match["area_ids"])
+        if match["kind"] == "location" and hierarchy is not None and match["id"] in hierarchy:
+            for loc_id in hierarchy.descendants(match["id"]):
+                area_ids.update(self.location_area_ids.get(loc_id, ()))
+        return sorted(area_ids)
+
+    def area_ids(self, query: str, hierarchy=None) -> List[int]:
+        """Canonical dim_area ids for a name (best match only)."""
+        matches = self.resolve(query, limit=1)
+        return self.subtree_area_ids(matches[0], hierarchy) if matches else []
+
+
+def load_locations_dump(path: str = LOCATIONS_DUMP_PATH) -> List[Dict[str, Any]]:
+    rows = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            m = _INSERT_RE.match(line)
+            if not m:
+                continue
+            rows.append({
+                "location_id": int(m.group(1)),
+                "name": m.group(2).replace("''", "'"),
+                "slug": _sql_str(m.group(3)),
+                "level": _sql_str(m.group(4)),
+                "parent_id": None if m.group(5) == "NULL" else int(m.group(5)),
+            })
+    return rows
+
+
+def resolved_areas_hint(resolver: "AreaResolver", question: str, hierarchy=None) -> str:
+    """
+    Prompt block pinning the areas named in a question to exact keys. With a
+    LocationHierarchy, a location also covers the area_ids of everything
+    under it ("all transactions under Dubai Land").
+    """
+    mentions = resolver.extract(question)
+    if not mentions:
+        return ""
+    lines = []
+    for m in mentions:
+        scope = ""
+        if m["kind"] == "location" and hierarchy is not None and m["id"] in hierarchy:
+            below = hierarchy.node(m["id"])["descendant_count"]
+            if below:
+                scope = f", incl. {below} sub-locations"
+        ids = ", ".join(str(a) for a in resolver.subtree_area_ids(m, hierarchy)) or "unknown"
+        lines.append(f'- "{m["matched"]}" -> {m["name"]} (area_id: {ids}{scope})')
+    return (
+        "Resolved areas (filter on these exact keys, e.g. area_id IN (...) or "
+        "area_name_en = '<name>', instead of ILIKE):\n" + "\n".join(lines)
+    )
+
+
+# -----------------------
+# Process-wide instance
+# -----------------------
+_resolver: Optional[AreaResolver] = None
+_loaded_at = 0.0
+_refreshing = False
+_resolver_lock = threading.Lock()
+
+
+def _reload(engine):
+    global _resolver, _loaded_at, _refreshing
+    try:
+        if engine is None:
+            raise RuntimeError("no engine")
+        resolver = AreaResolver.from_db(engine)
+    except Exception as e:
+        print(f"Area resolver falling back to {LOCATIONS_DUMP_PATH}: {e}")
+        resolver = _resolver or AreaResolver.from_dump()
+    _resolver, _loaded_at, _refreshing = resolver, time.monotonic(), False
+    print(f"📍 Area resolver ready: {len(resolver.entries)} names")
+
+
+def get_area_resolver(engine=None) -> AreaResolver:
+    """
+    DB-backed resolver refreshed every AREA_RESOLVER_TTL_S; the locations
+    dump if the DB is unavailable. Only the first call loads inline: an
+    expired resolver keeps serving while a background thread reloads it.
+    """
+    global _refreshing
+    if _resolver is None:
+        with _resolver_lock:
+            if _resolver is None:
+                _refreshing = True
+                _reload(engine)
+        return _resolver
+    if time.monotonic() - _loaded_at >= AREA_RESOLVER_TTL_S:
+        with _resolver_lock:
+            start = not _refreshing
+            _refreshing = True
+        if start:
+            threading.Thread(target=_reload, args=(engine,), name="area-resolver-refresh", daemon=True).start()
+    return _resolver
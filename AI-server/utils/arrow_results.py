@@ -0,0 +1,323 @@
+# arrow_results.py
+import os
+import datetime
+from decimal import Decimal
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.compute as pc
+from sqlalchemy import text
+
+from utils.cancellation import cancel_on_abort
+
+# Rows fetched per server-side cursor round trip
+STREAM_BATCH_SIZE = int(os.getenv("DB_STREAM_BATCH_SIZE", "5000"))
+# Hard cap on rows pulled into memory by a single streaming query
+STREAM_MAX_ROWS = int(os.getenv("DB_STREAM_MAX_ROWS", "200000"))
+
+
+# =========================
+# Streaming execution
+# =========================
+def _capped(part, fetched: int, max_rows: Optional[int]) -> Tuple[Any, bool]:
+    """The rows of `part` within max_rows, and whether any row was beyond it."""
+    if max_rows is not None and fetched + len(part) > max_rows:
+        return part[: max_rows - fetched], True
+    return part, False
+
+
+def iter_record_batches(
+    engine,
+    sql: str,
+    batch_size: int = STREAM_BATCH_SIZE,
+    max_rows: Optional[int] = STREAM_MAX_ROWS,
+    info: Optional[Dict[str, Any]] = None,
+) -> Iterator[pa.RecordBatch]:
+    """
+    Execute `sql` on a server-side cursor and yield Arrow RecordBatches.
+    Rows are never materialized as Python dicts; each partition is transposed
+    straight into Arrow columns. `info`, when given, receives the result's
+    "columns" and whether it was "truncated" at max_rows (a row past the cap
+    was seen, not merely max_rows returned).
+    """
+    info = {} if info is None else info
+    info["truncated"] = False
+    fetched = 0
+    with engine.connect() as conn:
+        res = conn.execution_options(
+            stream_results=True, max_row_buffer=batch_size
+        ).execute(text(sql))
+        columns = list(res.keys())
+        info["columns"] = columns
+
+        for part in res.partitions(batch_size):
+            part, over = _capped(part, fetched, max_rows)
+            if part:
+                yield _to_batch(part, columns)
+                fetched += len(part)
+            if over:
+                info["truncated"] = True
+                break
+
+
+async def aiter_record_batches(
+    async_engine,
+    sql: str,
+    batch_size: int = STREAM_BATCH_SIZE,
+    max_rows: Optional[int] = STREAM_MAX_ROWS,
+    info: Optional[Dict[str, Any]] = None,
+) -> AsyncIterator[pa.RecordBatch]:
+    """`iter_record_batches` on an AsyncEngine, streaming without blocking the loop."""
+    info = {} if info is None else info
+    info["truncated"] = False
+    fetched = 0
+    async with async_engine.connect() as conn, cancel_on_abort(conn, async_engine):
+        res = await conn.stream(
+            text(sql), execution_options={"max_row_buffer": batch_size}
+        )
+        columns = list(res.keys())
+        info["columns"] = columns
+
+        async for part in res.partitions(batch_size):
+            part, over = _capped(part, fetched, max_rows)
+            if part:
+                yield _to_batch(part, columns)
+                fetched += len(part)
+            if over:
+                info["truncated"] = True
+                break
+        await res.close()
+
+
+def _to_batch(part, columns: List[str]) -> pa.RecordBatch:
+    arrays = [pa.array(list(col)) for col in zip(*part)]
+    return pa.RecordBatch.from_arrays(arrays, names=columns)
+
+
+def query_to_arrow(
+    engine,
+    sql: str,
+    batch_size: int = STREAM_BATCH_SIZE,
+    max_rows: Optional[int] = STREAM_MAX_ROWS,
+) -> Tuple[pa.Table, bool]:
+    """Stream a query into an Arrow Table. Returns (table, truncated)."""
+    info: Dict[str, Any] = {}
+    batches = list(iter_record_batches(engine, sql, batch_size, max_rows, info))
+    return _concat(batches, info["columns"]), info["truncated"]
+
+
+async def aquery_to_arrow(
+    async_engine,
+    sql: str,
+    batch_size: int = STREAM_BATCH_SIZE,
+    max_rows: Optional[int] = STREAM_MAX_ROWS,
+) -> Tuple[pa.Table, bool]:
+    """`query_to_arrow` on an AsyncEngine."""
+    info: Dict[str, Any] = {}
+    batches = [b async for b in aiter_record_batches(async_engine, sql, batch_size, max_rows, info)]
+    return _concat(batches, info["columns"]), info["truncated"]
+
+
+def _concat(batches: List[pa.RecordBatch], columns: List[str]) -> pa.Table:
+    if not batches:
+        # No rows, so no types to infer; the column names still come through
+        return pa.Table.from_arrays([pa.nulls(0) for _ in columns], names=columns)
+
+    # Batches can infer different types (e.g. an all-NULL batch), so promote.
+    return pa.concat_tables(
+        [pa.Table.from_batches([b]) for b in batches], promote_options="default"
+    )
+
+
+def query_summary(
+    engine,
+    sql: str,
+    sample_rows: int,
+    batch_size: int = STREAM_BATCH_SIZE,
+    max_rows: Optional[int] = STREAM_MAX_ROWS,
+) -> "StreamSummary":
+    """Stream a query into a StreamSummary: full-result stats, only `sample_rows` rows kept."""
+    info: Dict[str, Any] = {}
+    summary = None
+    for batch in iter_record_batches(engine, sql, batch_size, max_rows, info):
+        summary = summary or StreamSummary(info["columns"], sample_rows)
+        summary.add(batch)
+    summary = summary or StreamSummary(info["columns"], sample_rows)
+    summary.truncated = info["truncated"]
+    return summary
+
+
+async def aquery_summary(
+    async_engine,
+    sql: str,
+    sample_rows: int,
+    batch_size: int = STREAM_BATCH_SIZE,
+    max_rows: Optional[int] = STREAM_MAX_ROWS,
+) -> "StreamSummary":
+    """`query_summary` on an AsyncEngine."""
+    info: Dict[str, Any] = {}
+    summary = None
+    async for batch in aiter_record_batches(async_engine, sql, batch_size, max_rows, info):
+        summary = summary or StreamSummary(info["columns"], sample_rows)
+        summary.add(batch)
+    summary = summary or StreamSummary(info["columns"], sample_rows)
+    summary.truncated = info["truncated"]
+    return summary
+
+
+# =========================
+# Summaries over full results
+# =========================
+def _is_numeric(dtype: pa.DataType) -> bool:
+    return (
+        pa.types.is_integer(dtype)
+        or pa.types.is_floating(dtype)
+        or pa.types.is_decimal(dtype)
+    )
+
+
+def summarize_table(table: pa.Table) -> Dict[str, Dict[str, Any]]:
+    """Per-column aggregates computed over every streamed row."""
+    stats: Dict[str, Dict[str, Any]] = {}
+    for name in table.column_names:
+        col = table.column(name)
+        entry: Dict[str, Any] = {"null_count": col.null_count}
+
+        if _is_numeric(col.type):
+            values = col.cast(pa.float64())
+            mm = pc.min_max(values).as_py()
+            entry.update({
+                "min": mm["min"],
+                "max": mm["max"],
+                "mean": pc.mean(values).as_py(),
+                "sum": pc.sum(values).as_py(),
+            })
+        elif pa.types.is_string(col.type) or pa.types.is_large_string(col.type):
+            entry["distinct"] = pc.count_distinct(col).as_py()
+        elif pa.types.is_temporal(col.type):
+            mm = pc.min_max(col).as_py()
+            entry.update({"min": _jsonable(mm["min"]), "max": _jsonable(mm["max"])})
+
+        stats[name] = entry
+    return stats
+
+
+class StreamSummary:
+    """
+    summarize_table() computed batch by batch, so a result is never held in
+    memory whole: only the first `sample_rows` rows are kept.
+    """
+
+    def __init__(self, columns: List[str], sample_rows: int):
+        self.columns = columns
+        self.sample_rows = sample_rows
+        self.rowcount = 0
+        self.truncated = False
+        self._head: List[pa.RecordBatch] = []
+        self._kinds: Dict[str, str] = {}
+        self._acc: Dict[str, Dict[str, Any]] = {c: {"null_count": 0} for c in columns}
+
+    def add(self, batch: pa.RecordBatch):
+        kept = sum(b.num_rows for b in self._head)
+        if kept < self.sample_rows:
+            self._head.append(batch.slice(0, self.sample_rows - kept))
+        self.rowcount += batch.num_rows
+
+        for name, col in zip(batch.schema.names, batch.columns):
+            acc = self._acc[name]
+            acc["null_count"] += col.null_count
+            if pa.types.is_null(col.type):
+                continue
+            kind = self._kinds.setdefault(name, _kind(col.type))
+            if kind == "numeric" and _kind(col.type) == "numeric":
+                values = col.cast(pa.float64())
+                mm = pc.min_max(values).as_py()
+                _merge_min_max(acc, mm["min"], mm["max"])
+                valid = len(values) - values.null_count
+                if valid:
+                    acc["sum"] = acc.get("sum", 0.0) + pc.sum(values).as_py()
+                    acc["count"] = acc.get("count", 0) + valid
+            elif kind == "string":
+                acc.setdefault("values", set()).update(v for v in pc.unique(col).to_pylist() if v is not None)
+            elif kind == "temporal":
+                mm = pc.min_max(col).as_py()
+                _merge_min_max(acc, mm["min"], mm["max"])
+
+    def head(self) -> pa.Table:
+        return _concat(self._head, self.columns)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Same shape as summarize_table() over the whole result."""
+        stats: Dict[str, Dict[str, Any]] = {}
+        for name in self.columns:
+            acc, kind = self._acc[name], self._kinds.get(name)
+            entry: Dict[str, Any] = {"null_count": acc["null_count"]}
+            if kind == "numeric":
+                count = acc.get("count", 0)
+                entry.update({
+                    "min": acc.get("min"),
+                    "max": acc.get("max"),
+                    "mean": acc["sum"] / count if count else None,
+                    "sum": acc.get("sum"),
+                })
+            elif kind == "string":
+                entry["distinct"] = len(acc.get("values", ()))
+            elif kind == "temporal":
+                entry.update({"min": _jsonable(acc.get("min")), "max": _jsonable(acc.get("max"))})
+            stats[name] = entry
+        return stats
+
+
+def _kind(dtype: pa.DataType) -> str:
+    if _is_numeric(dtype):
+        return "numeric"
+    if pa.types.is_string(dtype) or pa.types.is_large_string(dtype):
+        return "string"
+    if pa.types.is_temporal(dtype):
+        return "temporal"
+    return "other"
+
+
+def _merge_min_max(acc: Dict[str, Any], lo: Any, hi: Any):
+    if lo is not None and (acc.get("min") is None or lo < acc["min"]):
+        acc["min"] = lo
+    if hi is not None and (acc.get("max") is None or hi > acc["max"]):
+        acc["max"] = hi
+
+
+# =========================
+# Columnar JSON encoding
+# =========================
+def _jsonable(v: Any) -> Any:
+    if isinstance(v, Decimal):
+        return float(v)
+    if isinstance(v, (datetime.date, datetime.datetime, datetime.time)):
+        return v.isoformat()
+    return v
+
+
+def to_columnar(table: pa.Table, limit: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Encode a table as {"format": "columnar", "columns": [...], "data": [[...], ...]}
+    where data[i] holds every value of columns[i]. Column names are sent once
+    instead of once per row.
+    """
+    if limit is not None:
+        table = table.slice(0, limit)
+    return {
+        "format": "columnar",
+        "columns": table.column_names,
+        "data": [
+            [_jsonable(v) for v in table.column(name).to_pylist()]
+            for name in table.column_names
+        ],
+    }
+
+
+def rows_to_columnar(columns: List[str], rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Columnar encoding for rows that were already materialized as dicts."""
+    return {
+        "format": "columnar",
+        "columns": columns,
+        "data": [[_jsonable(r.get(c)) for r in rows] for c in columns],
+    }
@@ -0,0 +1,53 @@
+# cancellation.py
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Optional, Set
+
+from sqlalchemy import text
+
+from utils import metrics
+
+# Fire-and-forget cancel requests, referenced until they finish
+_pending: Set[asyncio.Task] = set()
+
+
+async def _cancel_backend(async_engine, pid: int):
+    try:
+        async with async_engine.connect() as conn:
+            sent = (await conn.execute(text("SELECT pg_cancel_backend(:pid)"), {"pid": pid})).scalar()
+        metrics.incr("sql_cancelled" if sent else "sql_cancel_failed")
+    except Exception as e:
+        metrics.incr("sql_cancel_failed")
+        print(f"pg_cancel_backend({pid}) failed: {e}")
+
+
+async def _backend_pid(conn) -> Optional[int]:
+    try:
+        raw = await conn.get_raw_connection()
+        return raw.driver_connection.get_server_pid()  # asyncpg
+    except Exception:
+        return None
+
+
+@asynccontextmanager
+async def cancel_on_abort(conn, async_engine):
+    """
+    Abort the statement running on `conn` server-side when the awaiting task
+    is cancelled (client gone, tool deadline). Dropping the client side alone
+    leaves Postgres executing it until it tries to send rows. The connection
+    is invalidated first so the pool cannot hand the same backend to another
+    query before the cancel lands.
+    """
+    pid = await _backend_pid(conn)
+    try:
+        yield
+    except asyncio.CancelledError:
+        if pid is not None:
+            try:
+                await conn.invalidate()
+            except Exception:
+                pass
+            task = asyncio.get_running_loop().create_task(_cancel_backend(async_engine, pid))
+            _pending.add(task)
+            task.add_done_callback(_pending.discard)
+        raise
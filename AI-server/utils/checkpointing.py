@@ -0,0 +1,317 @@
+# checkpointing.py
+"""
+Durable LangGraph checkpoints for the signed-in chat graph.
+
+    cd AI-server && python -m utils.checkpointing [--prune]   # set up tables / prune now
+
+Each signed-in turn runs on a graph compiled with a checkpointer under the
+user's thread_id. The next turn resumes from the saved messages (the
+budgeted history plus the running summary) instead of reloading the whole
+history from Postgres and summarizing it again. Backends are chosen with
+CHECKPOINT_BACKEND:
+- postgres: AsyncPostgresSaver on CHECKPOINT_DB_URI or the PGSQL_* database
+- sqlite: CHECKPOINT_SQLITE_PATH, the local stand-in
+- memory: per-process only
+Only the newest CHECKPOINT_KEEP_PER_THREAD checkpoints of a thread are
+kept, and threads idle for CHECKPOINT_TTL_DAYS are dropped.
+"""
+import os
+import time
+import asyncio
+import argparse
+from typing import Any, Dict, List, Optional
+from urllib.parse import quote
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+from utils import metrics
+from utils.graph_config import build_graph
+
+CHECKPOINT_SQLITE_PATH = os.getenv("CHECKPOINT_SQLITE_PATH", ".cache/checkpoints.sqlite")
+CHECKPOINT_KEEP_PER_THREAD = int(os.getenv("CHECKPOINT_KEEP_PER_THREAD", "4"))
+CHECKPOINT_TTL_DAYS = float(os.getenv("CHECKPOINT_TTL_DAYS", "30"))
+CHECKPOINT_PRUNE_EVERY_S = float(os.getenv("CHECKPOINT_PRUNE_EVERY_S", "3600"))
+# After a failed open, chat turns run without persistence for this long
+CHECKPOINT_RETRY_S = float(os.getenv("CHECKPOINT_RETRY_S", "60"))
+
+# 100 ns intervals between the UUID (Gregorian) epoch and the Unix epoch
+_UUID_EPOCH_OFFSET = 0x01B21DD213814000
+
+
+def checkpoint_backend() -> str:
+    # Read at call time: the app loads .env after its imports
+    return os.getenv("CHECKPOINT_BACKEND") or ("postgres" if os.getenv("PGSQL_HOST") else "sqlite")
+
+
+def _pg_conninfo() -> str:
+    uri = os.getenv("CHECKPOINT_DB_URI")
+    if uri:
+        return uri
+    return "postgresql://{}:{}@{}:{}/{}".format(
+        quote(os.getenv("PGSQL_USER", ""), safe=""),
+        quote(os.getenv("PGSQL_PASS", ""), safe=""),
+        os.getenv("PGSQL_HOST", "localhost"),
+        os.getenv("PGSQL_PORT", "5432"),
+        os.getenv("PGSQL_DB_NAME", ""),
+    )
+
+
+async def open_checkpointer(backend: Optional[str] = None):
+    """Open and set up a checkpoint saver for the backend (imports are per backend)."""
+    backend = backend or checkpoint_backend()
+    if backend == "postgres":
+        from psycopg.rows import dict_row
+        from psycopg_pool import AsyncConnectionPool
+        from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+
+        pool = AsyncConnectionPool(
+            _pg_conninfo(),
+            max_size=int(os.getenv("CHECKPOINT_POOL_SIZE", "10")),
+            kwargs={"autocommit": True, "prepare_threshold": 0, "row_factory": dict_row},
+            open=False,
+        )
+        await pool.open()
+        saver = AsyncPostgresSaver(pool)
+    elif backend == "sqlite":
+        import aiosqlite
+        from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+        os.makedirs(os.path.dirname(CHECKPOINT_SQLITE_PATH) or ".", exist_ok=True)
+        conn = await aiosqlite.connect(CHECKPOINT_SQLITE_PATH)
+        await conn.execute("PRAGMA journal_mode=WAL")
+        saver = AsyncSqliteSaver(conn)
+    elif backend == "memory":
+        from langgraph.checkpoint.memory import InMemorySaver
+
+        return InMemorySaver()
+    else:
+        raise ValueError(f"Unknown CHECKPOINT_BACKEND: {backend}")
+    await saver.setup()
+    return saver
+
+
+async def close_checkpointer(saver):
+    conn = getattr(saver, "conn", None)
+    if conn is not None:
+        await conn.close()
+
+
+# -----------------------
+# Resume
+# -----------------------
+def resumable_history(messages: List[BaseMessage]) -> List[Dict[str, Any]]:
+    """
+    Checkpointed messages as {"role", "content"} history for the context
+    builder: human/AI text and system notes (the running summary); tool calls
+    and tool results of earlier turns are left out, as in the cold path.
+    """
+    history = []
+    for m in messages:
+        content = m.content if isinstance(m.content, str) else ""
+        if not content:
+            continue
+        if isinstance(m, HumanMessage):
+            history.append({"role": "user", "content": content})
+        elif isinstance(m, AIMessage):
+            history.append({"role": "ai", "content": content})
+        elif isinstance(m, SystemMessage):
+            history.append({"role": "system", "content": content})
+    return history
+
+
+async def load_checkpointed_history(chat_graph, config) -> Optional[List[Dict[str, Any]]]:
+    """History saved by the thread's last turn, or None when there is no checkpoint."""
+    start = time.perf_counter()
+    state = await chat_graph.aget_state(config)
+    metrics.observe("checkpoint_load_ms", (time.perf_counter() - start) * 1000)
+    messages = (state.values or {}).get("messages") if state else None
+    if not messages:
+        metrics.incr("checkpoint_miss")
+        return None
+    metrics.incr("checkpoint_resume")
+    return resumable_history(messages)
+
+
+# -----------------------
+# Pruning
+# -----------------------
+def checkpoint_time(checkpoint_id: str) -> float:
+    """Unix time of a checkpoint id (LangGraph ids are time-ordered UUIDv6)."""
+    h = int(checkpoint_id.replace("-", ""), 16)
+    ticks = ((h >> 96) << 28) | (((h >> 80) & 0xFFFF) << 12) | ((h >> 64) & 0x0FFF)
+    return (ticks - _UUID_EPOCH_OFFSET) / 1e7
+
+
+def _prune_sql(backend: str, keep: int) -> List[str]:
+    writes = "checkpoint_writes" if backend == "postgres" else "writes"
+    sql = [
+        f"""
+        DELETE FROM checkpoints
+        WHERE (thread_id, checkpoint_ns, checkpoint_id) IN (
+            SELECT thread_id, checkpoint_ns, checkpoint_id FROM (
+                SELECT thread_id, checkpoint_ns, checkpoint_id,
+                       row_number() OVER (PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC) AS rn
+                FROM checkpoints
+            ) ranked
+            WHERE rn > {int(keep)}
+        )
+        """,
+        f"""
+        DELETE FROM {writes}
+        WHERE NOT EXISTS (
+            SELECT 1 FROM checkpoints c
+            WHERE c.thread_id = {writes}.thread_id
+              AND c.checkpoint_ns = {writes}.checkpoint_ns
+              AND c.checkpoint_id = {writes}.checkpoint_id
+        )
+        """,
+    ]
+    if backend == "postgres":
+        # Channel values live in versioned blobs referenced from the checkpoints
+        sql.append(
+            """
+            DELETE FROM checkpoint_blobs b
+            WHERE NOT EXISTS (
+                SELECT 1 FROM checkpoints c
+                WHERE c.thread_id = b.thread_id
+                  AND c.checkpoint_ns = b.checkpoint_ns
+                  AND c.checkpoint -> 'channel_versions' ->> b.channel = b.version
+            )
+            """
+        )
+    return sql
+
+
+async def prune_checkpoints(
+    saver,
+    backend: Optional[str] = None,
+    keep: int = CHECKPOINT_KEEP_PER_THREAD,
+    ttl_days: float = CHECKPOINT_TTL_DAYS,
+) -> Dict[str, Any]:
+    """Drop idle threads, then all but the newest `keep` checkpoints of every thread."""
+    backend = backend or checkpoint_backend()
+    if backend not in ("postgres", "sqlite"):
+        return {"skipped": backend}
+    start = time.perf_counter()
+    latest_sql = (
+        "SELECT thread_id, MAX(checkpoint_id) AS checkpoint_id FROM checkpoints "
+        "WHERE checkpoint_ns = '' GROUP BY thread_id"
+    )
+
+    if backend == "postgres":
+        async with saver.conn.connection() as conn:
+            rows = await (await conn.execute(latest_sql)).fetchall()
+            latest = [(r["thread_id"], r["checkpoint_id"]) for r in rows]
+    else:
+        async with saver.lock:
+            latest = list(await (await saver.conn.execute(latest_sql)).fetchall())
+
+    cutoff = time.time() - ttl_days * 86400
+    stale = [thread_id for thread_id, checkpoint_id in latest if checkpoint_time(checkpoint_id) < cutoff]
+    for thread_id in stale:
+        await saver.adelete_thread(thread_id)
+
+    deleted = 0
+    if backend == "postgres":
+        async with saver.conn.connection() as conn:
+            for sql in _prune_sql(backend, keep):
+                deleted += (await conn.execute(sql)).rowcount
+    else:
+        async with saver.lock:
+            for sql in _prune_sql(backend, keep):
+                deleted += (await saver.conn.execute(sql)).rowcount
+            await saver.conn.commit()
+
+    stats = {
+        "threads": len(latest),
+        "stale_threads": len(stale),
+        "deleted_rows": deleted,
+        "elapsed_s": round(time.perf_counter() - start, 2),
+    }
+    metrics.incr("checkpoint_pruned_rows", deleted)
+    return stats
+
+
+# -----------------------
+# Process-wide chat graph
+# -----------------------
+_checkpointer = None
+_chat_graph = None
+_open_failed_at = 0.0
+_last_pruned_at = 0.0
+_prune_task: Optional[asyncio.Task] = None
+_graph_lock = asyncio.Lock()
+
+
+async def _prune_in_background(saver):
+    try:
+        print(f"🧹 Checkpoints pruned: {await prune_checkpoints(saver)}")
+    except Exception as e:
+        print(f"❌ Checkpoint pruning failed: {e}")
+
+
+async def get_chat_graph():
+    """
+    The chat graph compiled with the durable checkpointer, opened on first
+    use. None while the backend is unavailable (callers fall back to the
+    stateless graph). Pruning runs in the background every
+    CHECKPOINT_PRUNE_EVERY_S.
+    """
+    global _checkpointer, _chat_graph, _open_failed_at, _last_pruned_at, _prune_task
+    if _chat_graph is None:
+        if time.time() - _open_failed_at < CHECKPOINT_RETRY_S:
+            return None
+        async with _graph_lock:
+            if _chat_graph is None:
+                try:
+                    _checkpointer = await open_checkpointer()
+                    _chat_graph = build_graph(checkpointer=_checkpointer)
+                    print(f"💾 Chat checkpoints: {checkpoint_backend()}")
+                except Exception as e:
+                    _open_failed_at = time.time()
+                    print(f"❌ Checkpointer unavailable ({e}), chat turns run without persistence")
+                    return None
+
+    if time.time() - _last_pruned_at > CHECKPOINT_PRUNE_EVERY_S and not (_prune_task and not _prune_task.done()):
+        _last_pruned_at = time.time()
+        _prune_task = asyncio.create_task(_prune_in_background(_checkpointer))
+    return _chat_graph
+
+
+async def close_chat_graph():
+    """Close this worker's checkpointer (app shutdown); reopened on the next get_chat_graph."""
+    global _checkpointer, _chat_graph
+    if _prune_task and not _prune_task.done():
+        _prune_task.cancel()
+    saver, _checkpointer, _chat_graph = _checkpointer, None, None
+    if saver is not None:
+        await close_checkpointer(saver)
+
+
+async def forget_chat_thread(thread_id: str):
+    """Drop a thread's checkpoints after its stored history changed outside a chat turn."""
+    if _checkpointer is None:
+        return
+    try:
+        await _checkpointer.adelete_thread(thread_id)
+    except Exception as e:
+        print(f"Error deleting checkpoints for {thread_id}: {e}")
+
+
+async def _main(prune: bool):
+    saver = await open_checkpointer()
+    try:
+        if prune:
+            print(await prune_checkpoints(saver))
+    finally:
+        await close_checkpointer(saver)
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prune", action="store_true", help="prune old checkpoints now")
+    args = parser.parse_args()
+    asyncio.run(_main(args.prune))
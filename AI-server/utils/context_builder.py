@@ -0,0 +1,135 @@
+# context_builder.py
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+from utils import metrics
+from utils.token_utils import count_tokens, truncate_tokens
+
+# Tokens for everything the agent sees on its first step (style prompt,
+# summary, history, new message) plus what is held back for tool results
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "8000"))
+# Held back for compacted tool results later in the turn (see tool_compaction)
+CONTEXT_TOOL_RESERVE = int(os.getenv("CONTEXT_TOOL_RESERVE", "2400"))
+# No single history message may take more than this
+CONTEXT_MESSAGE_MAX_TOKENS = int(os.getenv("CONTEXT_MESSAGE_MAX_TOKENS", "1200"))
+CONTEXT_SUMMARY_TOKENS = int(os.getenv("CONTEXT_SUMMARY_TOKENS", "400"))
+# Once a summary is needed, history is cut down to this share of the room
+# left so the next few turns fit without another summarizer call
+CONTEXT_REFILL_RATIO = float(os.getenv("CONTEXT_REFILL_RATIO", "0.7"))
+# Input cap for the summarizer call over the dropped messages
+CONTEXT_SUMMARY_INPUT_TOKENS = int(os.getenv("CONTEXT_SUMMARY_INPUT_TOKENS", "4000"))
+# Role markers / separators the chat template adds per message
+MESSAGE_OVERHEAD_TOKENS = 4
+# A truncated message shorter than this is not worth including
+MIN_PARTIAL_TOKENS = 64
+
+_ROLE_TYPES = {
+    "user": HumanMessage,
+    "human": HumanMessage,
+    "ai": AIMessage,
+    "assistant": AIMessage,
+    "system": SystemMessage,
+}
+
+
+def message_tokens(content: str) -> int:
+    return count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+
+
+async def build_chat_context(
+    history: List[Dict[str, Any]],
+    message: str,
+    system_messages: List[BaseMessage],
+    summarize: Optional[Callable[[List[Dict[str, Any]]], Awaitable[str]]] = None,
+    budget: int = CONTEXT_TOKEN_BUDGET,
+    tool_reserve: int = CONTEXT_TOOL_RESERVE,
+) -> Tuple[List[BaseMessage], Dict[str, Any]]:
+    """
+    Prompt messages for one chat turn within a token budget.
+
+    History ({"role", "content"} dicts, oldest first) is taken newest to
+    oldest; each message is capped at CONTEXT_MESSAGE_MAX_TOKENS and the
+    oldest one that only partly fits is truncated. When messages are left
+    out and `summarize` is given, they are replaced by a summary of bounded
+    size. Returns the messages and their token stats.
+    """
+    fixed = sum(message_tokens(m.content) for m in system_messages)
+    # The new message always goes in, capped at half of what is left
+    message = truncate_tokens(message, max(budget - tool_reserve - fixed, 0) // 2)
+    fixed += message_tokens(message)
+    available = budget - tool_reserve - fixed
+
+    kept: List[Tuple[str, str]] = []  # newest first
+    truncated = used = cut = 0  # history[:cut] is left out
+    history = [m for m in history if m.get("content") and m.get("role") in _ROLE_TYPES]
+    for i in range(len(history) - 1, -1, -1):
+        content = history[i]["content"]
+        if message_tokens(content) > CONTEXT_MESSAGE_MAX_TOKENS:
+            content = truncate_tokens(content, CONTEXT_MESSAGE_MAX_TOKENS - MESSAGE_OVERHEAD_TOKENS)
+            truncated += 1
+        tokens = message_tokens(content)
+        room = available - used
+        if tokens > room:
+            cut = i + 1
+            if room - MESSAGE_OVERHEAD_TOKENS >= MIN_PARTIAL_TOKENS:
+                content = truncate_tokens(content, room - MESSAGE_OVERHEAD_TOKENS)
+                kept.append((history[i]["role"], content))
+                used += message_tokens(content)
+                truncated += 1
+                cut = i
+            break
+        kept.append((history[i]["role"], content))
+        used += tokens
+    dropped = history[:cut]
+
+    prefix: List[BaseMessage] = []
+    summary_tokens = 0
+    if dropped and summarize is not None:
+        # Make room for the summary by giving up the oldest kept messages
+        target = int(available * CONTEXT_REFILL_RATIO)
+        while len(kept) > 1 and used + CONTEXT_SUMMARY_TOKENS + MESSAGE_OVERHEAD_TOKENS > target:
+            role, content = kept.pop()
+            used -= message_tokens(content)
+            dropped.append({"role": role, "content": content})
+        while kept and used + CONTEXT_SUMMARY_TOKENS + MESSAGE_OVERHEAD_TOKENS > available:
+            role, content = kept.pop()
+            used -= message_tokens(content)
+            dropped.append({"role": role, "content": content})
+        try:
+            # Newest dropped messages first, up to the summarizer's input cap
+            to_summarize, remaining = [], CONTEXT_SUMMARY_INPUT_TOKENS
+            for m in reversed(dropped):
+                if remaining - MESSAGE_OVERHEAD_TOKENS < MIN_PARTIAL_TOKENS:
+                    break
+                content = truncate_tokens(m["content"], remaining - MESSAGE_OVERHEAD_TOKENS)
+                to_summarize.insert(0, {"role": m["role"], "content": content})
+                remaining -= message_tokens(content)
+            summary = await summarize(to_summarize)
+            summary = truncate_tokens(summary, CONTEXT_SUMMARY_TOKENS - MESSAGE_OVERHEAD_TOKENS - 8)
+            prefix.append(SystemMessage(content=f"Conversation Summary: {summary}"))
+            summary_tokens = message_tokens(prefix[0].content)
+        except Exception as e:
+            print(f"Error summarizing messages: {e}")
+            # Continue without summary
+
+    messages = [
+        *prefix,
+        *(_ROLE_TYPES[role](content=content) for role, content in reversed(kept)),
+        HumanMessage(content=message),
+    ]
+    stats = {
+        "prompt_tokens": fixed + used + summary_tokens,
+        "history_messages": len(kept),
+        "dropped_messages": len(dropped),
+        "truncated_messages": truncated,
+        "summary": bool(prefix),
+        "budget": budget,
+        "tool_reserve": tool_reserve,
+    }
+    metrics.observe("prompt_tokens", stats["prompt_tokens"])
+    metrics.observe("prompt_history_messages", len(kept))
+    metrics.incr("prompt_messages_dropped", len(dropped))
+    metrics.incr("prompt_messages_truncated", truncated)
+    return messages, stats
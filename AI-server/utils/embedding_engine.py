@@ -0,0 +1,182 @@
+# embedding_engine.py
+import os
+import queue
+import threading
+import asyncio
+from concurrent.futures import Future, InvalidStateError
+from typing import List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+# "none" (fp32 torch), "int8" (torch dynamic quantization) or "onnx" (ONNX Runtime)
+EMBEDDING_QUANTIZE = os.getenv("EMBEDDING_QUANTIZE", "none").lower()
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_qint8_avx2.onnx")
+# Micro-batching: flush when this many queries are queued or after this wait
+EMBEDDING_MAX_BATCH = int(os.getenv("EMBEDDING_MAX_BATCH", "32"))
+EMBEDDING_MAX_WAIT_MS = float(os.getenv("EMBEDDING_MAX_WAIT_MS", "5"))
+# Texts per model forward pass (a merged batch or a large document list is split into these)
+EMBEDDING_MODEL_BATCH = int(os.getenv("EMBEDDING_MODEL_BATCH", "32"))
+
+
+def load_model(model_name: str = EMBEDDING_MODEL, quantize: str = EMBEDDING_QUANTIZE):
+    """Load a CPU SentenceTransformer, optionally int8-quantized or on ONNX Runtime."""
+    from sentence_transformers import SentenceTransformer
+
+    if quantize == "onnx":
+        try:
+            return SentenceTransformer(
+                model_name,
+                device="cpu",
+                backend="onnx",
+                model_kwargs={"file_name": EMBEDDING_ONNX_FILE},
+            )
+        except Exception as e:
+            # Needs optimum[onnxruntime]; fall back to dynamic int8 on torch
+            print(f"ONNX embedding backend unavailable ({e}), using torch int8")
+            quantize = "int8"
+
+    model = SentenceTransformer(model_name, device="cpu")
+    if quantize == "int8":
+        import torch
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+class MicroBatcher:
+    """
+    Single worker thread that merges concurrent encode requests into one
+    model call of at most `model_batch` texts per forward pass. Callers from
+    threads block on a Future; coroutines await it.
+
+    The thread starts on the first submit in each process: a forked worker
+    (gunicorn --preload) gets its own queue and thread instead of the
+    parent's queue, which nothing in the child would consume.
+    """
+
+    def __init__(
+        self,
+        model,
+        max_batch: int = EMBEDDING_MAX_BATCH,
+        max_wait_ms: float = EMBEDDING_MAX_WAIT_MS,
+        model_batch: int = EMBEDDING_MODEL_BATCH,
+    ):
+        self.model = model
+        self.max_batch = max_batch
+        self.model_batch = model_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue: Optional["queue.Queue[Tuple[List[str], Future]]"] = None
+        self._pid: Optional[int] = None
+        self._start_lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+
+    def _running_queue(self) -> "queue.Queue[Tuple[List[str], Future]]":
+        if self._pid != os.getpid():
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    jobs: "queue.Queue[Tuple[List[str], Future]]" = queue.Queue()
+                    threading.Thread(target=self._loop, args=(jobs,), name="embedding-batcher", daemon=True).start()
+                    self._queue, self._pid = jobs, os.getpid()
+        return self._queue
+
+    def submit(self, texts: List[str]) -> Future:
+        fut: Future = Future()
+        self._running_queue().put((texts, fut))
+        return fut
+
+    def encode(self, texts: List[str]) -> List[List[float]]:
+        return self.submit(texts).result()
+
+    async def aencode(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.wrap_future(self.submit(texts))
+
+    @staticmethod
+    def _next_job(jobs: queue.Queue, timeout: Optional[float] = None) -> Tuple[List[str], Future]:
+        """Next job whose caller is still waiting; cancelled ones (a cancelled aencode) are dropped."""
+        while True:
+            job = jobs.get(timeout=timeout)
+            if job[1].set_running_or_notify_cancel():
+                return job
+
+    def _drain(self, queued: queue.Queue) -> List[Tuple[List[str], Future]]:
+        jobs = [self._next_job(queued)]
+        size = len(jobs[0][0])
+        while size < self.max_batch:
+            try:
+                job = self._next_job(queued, timeout=self.max_wait)
+            except queue.Empty:
+                break
+            jobs.append(job)
+            size += len(job[0])
+        return jobs
+
+    @staticmethod
+    def _resolve(fut: Future, result=None, error: Optional[BaseException] = None):
+        try:
+            if error is not None:
+                fut.set_exception(error)
+            else:
+                fut.set_result(result)
+        except InvalidStateError:
+            pass
+
+    def _loop(self, queued: queue.Queue):
+        while True:
+            jobs = self._drain(queued)
+            texts = [t for job_texts, _ in jobs for t in job_texts]
+            try:
+                vectors = self.model.encode(
+                    texts,
+                    batch_size=max(min(len(texts), self.model_batch), 1),
+                    convert_to_numpy=True,
+                    normalize_embeddings=True,
+                ).tolist()
+            except Exception as e:
+                for _, fut in jobs:
+                    self._resolve(fut, error=e)
+                continue
+
+            self.batches += 1
+            self.items += len(texts)
+            offset = 0
+            for job_texts, fut in jobs:
+                self._resolve(fut, vectors[offset:offset + len(job_texts)])
+                offset += len(job_texts)
+
+
+class LocalEmbeddings(Embeddings):
+    """LangChain Embeddings backed by a local CPU model behind a MicroBatcher."""
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL, quantize: str = EMBEDDING_QUANTIZE, model=None):
+        self.model_name = model_name
+        self.batcher = MicroBatcher(model or load_model(model_name, quantize))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.batcher.encode(list(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.batcher.encode([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.batcher.aencode(list(texts))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.batcher.aencode([text]))[0]
+
+
+def build_embeddings(backend: Optional[str] = None) -> Embeddings:
+    """
+    EMBEDDING_BACKEND=remote (default) keeps the HF Inference API;
+    EMBEDDING_BACKEND=local runs the same model in-process on CPU.
+    """
+    backend = (backend or os.getenv("EMBEDDING_BACKEND", "remote")).lower()
+    if backend == "local":
+        print(f"🧠 Local embeddings: {EMBEDDING_MODEL} (quantize={EMBEDDING_QUANTIZE})")
+        return LocalEmbeddings()
+
+    from langchain_community.embeddings import HuggingFaceInferenceAPIEmbeddings
+    return HuggingFaceInferenceAPIEmbeddings(
+        api_key=os.getenv("HF_API_TOKEN"),
+        model_name=EMBEDDING_MODEL,
+    )
@@ -0,0 +1,229 @@
+# geo_index.py
+import os
+import json
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from utils.mmap_store import save_arrays, load_arrays
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+GEOJSON_PATH = os.getenv("GEOJSON_PATH", os.path.join(_ROOT, "export.geojson"))
+GEO_INDEX_PATH = os.getenv("GEO_INDEX_PATH", ".cache/geo_index.bin")
+GEO_GRID_SIZE = int(os.getenv("GEO_GRID_SIZE", "128"))
+# Points x edges evaluated per vectorized point-in-polygon step
+PIP_CHUNK = 1 << 20
+
+
+def _feature_rings(geometry: Dict[str, Any]) -> List[List[List[float]]]:
+    if geometry["type"] == "Polygon":
+        return geometry["coordinates"]
+    if geometry["type"] == "MultiPolygon":
+        return [ring for poly in geometry["coordinates"] for ring in poly]
+    return []
+
+
+def _ring_area(ring: np.ndarray) -> float:
+    x, y = ring[:, 0], ring[:, 1]
+    return 0.5 * float(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+
+class GeoIndex:
+    """
+    Area polygons from export.geojson in flat arrays:
+    - edges (E, 4) as x1, y1, x2, y2 with edge_offsets (F + 1) per feature
+    - bbox (F, 4) and area (F,) per feature
+    - a uniform grid over the overall extent; cell_offsets/cell_features list
+      which features' bounding boxes touch each cell (CSR layout)
+    A point resolves to the smallest polygon containing it, so a community
+    wins over the emirate it sits in.
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray], features: List[Dict[str, Any]], extent: List[float], grid: int):
+        self.edges = arrays["edges"]
+        self.edge_offsets = arrays["edge_offsets"]
+        self.bbox = arrays["bbox"]
+        self.area = arrays["area"]
+        self.cell_offsets = arrays["cell_offsets"]
+        self.cell_features = arrays["cell_features"]
+        self.features = features
+        self.extent = extent  # minx, miny, maxx, maxy
+        self.grid = grid
+
+    # -----------------------
+    # Build / persist
+    # -----------------------
+    @classmethod
+    def build(cls, geojson_path: str = GEOJSON_PATH, grid: int = GEO_GRID_SIZE) -> "GeoIndex":
+        with open(geojson_path, encoding="utf-8") as f:
+            data = json.load(f)
+
+        features, edges, edge_offsets, bbox, area = [], [], [0], [], []
+        for feat in data.get("features", []):
+            rings = _feature_rings(feat.get("geometry") or {})
+            if not rings:
+                continue
+            props = feat.get("properties") or {}
+            ring_arrays = [np.asarray(r, dtype=np.float64)[:, :2] for r in rings if len(r) >= 3]
+            if not ring_arrays:
+                continue
+
+            for r in ring_arrays:
+                edges.append(np.hstack([r[:-1], r[1:]]) if np.array_equal(r[0], r[-1])
+                             else np.hstack([r, np.roll(r, -1, axis=0)]))
+            edge_offsets.append(edge_offsets[-1] + sum(len(e) for e in edges[-len(ring_arrays):]))
+
+            pts = np.vstack(ring_arrays)
+            bbox.append([pts[:, 0].min(), pts[:, 1].min(), pts[:, 0].max(), pts[:, 1].max()])
+            # Approximate: outer rings minus holes when holes wind the other way
+            area.append(abs(sum(_ring_area(r) for r in ring_arrays)) or 1e-12)
+            features.append({
+                "osm_id": props.get("@id"),
+                "name": props.get("name:en") or props.get("name"),
+                "admin_level": props.get("admin_level"),
+            })
+
+        bbox = np.asarray(bbox, dtype=np.float64)
+        extent = [bbox[:, 0].min(), bbox[:, 1].min(), bbox[:, 2].max(), bbox[:, 3].max()]
+
+        # Grid buckets: every cell a feature's bbox touches
+        cw = (extent[2] - extent[0]) / grid
+        ch = (extent[3] - extent[1]) / grid
+        buckets: List[List[int]] = [[] for _ in range(grid * grid)]
+        for fi, (x0, y0, x1, y1) in enumerate(bbox):
+            cx0, cx1 = int((x0 - extent[0]) // cw), min(grid - 1, int((x1 - extent[0]) // cw))
+            cy0, cy1 = int((y0 - extent[1]) // ch), min(grid - 1, int((y1 - extent[1]) // ch))
+            for cy in range(cy0, cy1 + 1):
+                for cx in range(cx0, cx1 + 1):
+                    buckets[cy * grid + cx].append(fi)
+        cell_offsets = np.zeros(grid * grid + 1, dtype=np.int64)
+        cell_offsets[1:] = np.cumsum([len(b) for b in buckets])
+        cell_features = np.fromiter((fi for b in buckets for fi in b), dtype=np.int32, count=int(cell_offsets[-1]))
+
+        arrays = {
+            "edges": np.vstack(edges),
+            "edge_offsets": np.asarray(edge_offsets, dtype=np.int64),
+            "bbox": bbox,
+            "area": np.asarray(area, dtype=np.float64),
+            "cell_offsets": cell_offsets,
+            "cell_features": cell_features,
+        }
+        return cls(arrays, features, extent, grid)
+
+    def save(self, path: str = GEO_INDEX_PATH):
+        save_arrays(
+            path,
+            {
+                "edges": self.edges,
+                "edge_offsets": self.edge_offsets,
+                "bbox": self.bbox,
+                "area": self.area,
+                "cell_offsets": self.cell_offsets,
+                "cell_features": self.cell_features,
+            },
+            {"features": self.features, "extent": self.extent, "grid": self.grid},
+        )
+
+    @classmethod
+    def load(cls, path: str = GEO_INDEX_PATH) -> "GeoIndex":
+        arrays, meta = load_arrays(path)
+        return cls(arrays, meta["features"], meta["extent"], meta["grid"])
+
+    # -----------------------
+    # Lookups
+    # -----------------------
+    def _cells(self, lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+        minx, miny, maxx, maxy = self.extent
+        cx = np.floor((lon - minx) / ((maxx - minx) / self.grid)).astype(np.int64)
+        cy = np.floor((lat - miny) / ((maxy - miny) / self.grid)).astype(np.int64)
+        cx = np.where(lon == maxx, self.grid - 1, cx)
+        cy = np.where(lat == maxy, self.grid - 1, cy)
+        inside = (cx >= 0) & (cx < self.grid) & (cy >= 0) & (cy < self.grid)
+        return np.where(inside, cy * self.grid + cx, -1)
+
+    def _contains(self, fi: int, lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+        """Even-odd ray casting of many points against one feature's edges."""
+        e = np.asarray(self.edges[self.edge_offsets[fi]:self.edge_offsets[fi + 1]])
+        x1, y1, x2, y2 = e[:, 0], e[:, 1], e[:, 2], e[:, 3]
+        out = np.zeros(len(lon), dtype=bool)
+        step = max(1, PIP_CHUNK // max(len(e), 1))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for s in range(0, len(lon), step):
+                px, py = lon[s:s + step, None], lat[s:s + step, None]
+                straddles = (y1 > py) != (y2 > py)
+                x_cross = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+                out[s:s + step] = (np.count_nonzero(straddles & (px < x_cross), axis=1) & 1).astype(bool)
+        return out
+
+    def lookup(self, lon, lat) -> np.ndarray:
+        """
+        Feature index of the smallest polygon containing each point (-1 if none).
+        Candidate (point, feature) pairs come from the grid in one vectorized
+        expansion; each feature then tests all of its candidate points at once.
+        """
+        lon = np.asarray(lon, dtype=np.float64).ravel()
+        lat = np.asarray(lat, dtype=np.float64).ravel()
+        result = np.full(len(lon), -1, dtype=np.int64)
+        best = np.full(len(lon), np.inf)
+
+        cells = self._cells(lon, lat)
+        pts = np.nonzero(cells >= 0)[0]
+        starts, ends = self.cell_offsets[cells[pts]], self.cell_offsets[cells[pts] + 1]
+        counts = (ends - starts).astype(np.int64)
+        if counts.sum() == 0:
+            return result
+
+        pair_pts = np.repeat(pts, counts)
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        pair_feats = np.asarray(self.cell_features)[np.repeat(starts, counts) + within]
+
+        # Bounding-box prefilter, then group pairs by feature
+        b = self.bbox[pair_feats]
+        keep = (lon[pair_pts] >= b[:, 0]) & (lon[pair_pts] <= b[:, 2]) & (lat[pair_pts] >= b[:, 1]) & (lat[pair_pts] <= b[:, 3])
+        pair_pts, pair_feats = pair_pts[keep], pair_feats[keep]
+        order = np.argsort(pair_feats, kind="stable")
+        pair_pts, pair_feats = pair_pts[order], pair_feats[order]
+        bounds = np.flatnonzero(np.diff(pair_feats)) + 1
+
+        for group in np.split(np.arange(len(pair_feats)), bounds):
+            if len(group) == 0:
+                continue
+            fi = int(pair_feats[group[0]])
+            p = pair_pts[group]
+            hit = p[self._contains(fi, lon[p], lat[p])]
+            better = hit[self.area[fi] < best[hit]]
+            result[better] = fi
+            best[better] = self.area[fi]
+        return result
+
+    def resolve(self, lon, lat) -> List[Optional[Dict[str, Any]]]:
+        """Like lookup(), returning the feature properties (or None) per point."""
+        return [self.features[i] if i >= 0 else None for i in self.lookup(lon, lat).tolist()]
+
+
+# -----------------------
+# Process-wide instance
+# -----------------------
+_index: Optional[GeoIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_geo_index() -> GeoIndex:
+    """Load the persisted index, rebuilding it when export.geojson is newer."""
+    global _index
+    if _index is not None:
+        return _index
+    with _index_lock:
+        if _index is None:
+            fresh = (
+                os.path.exists(GEO_INDEX_PATH)
+                and os.path.getmtime(GEO_INDEX_PATH) >= os.path.getmtime(GEOJSON_PATH)
+            )
+            if fresh:
+                _index = GeoIndex.load(GEO_INDEX_PATH)
+            else:
+                _index = GeoIndex.build(GEOJSON_PATH)
+                _index.save(GEO_INDEX_PATH)
+                print(f"🗺️ Geo index built: {len(_index.features)} areas")
+    return _index
@@ -0,0 +1,203 @@
+# geometry_service.py
+import os
+import re
+import gzip
+import json
+import math
+import hashlib
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.geo_index import GEOJSON_PATH
+
+# Zoom levels precomputed; requests snap down to the nearest one
+GEOMETRY_ZOOMS = [int(z) for z in os.getenv("GEOMETRY_ZOOMS", "8,10,12,14").split(",")]
+# Allowed simplification error, in screen pixels at the target zoom
+GEOMETRY_PIXEL_TOLERANCE = float(os.getenv("GEOMETRY_PIXEL_TOLERANCE", "1.0"))
+
+
+def zoom_tolerance(zoom: int, pixels: float = GEOMETRY_PIXEL_TOLERANCE) -> float:
+    """Degrees covered by `pixels` screen pixels at a web-mercator zoom level."""
+    return pixels * 360.0 / (256 * 2 ** zoom)
+
+
+# =========================
+# Douglas–Peucker
+# =========================
+def _dp_keep(points: np.ndarray, tol: float) -> np.ndarray:
+    """Boolean mask of vertices kept by Douglas–Peucker on an open polyline."""
+    n = len(points)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        s, e = stack.pop()
+        if e - s < 2:
+            continue
+        a, b = points[s], points[e]
+        seg = b - a
+        inner = points[s + 1:e]
+        seg_len = math.hypot(seg[0], seg[1])
+        if seg_len == 0:
+            d = np.hypot(inner[:, 0] - a[0], inner[:, 1] - a[1])
+        else:
+            d = np.abs(seg[0] * (inner[:, 1] - a[1]) - seg[1] * (inner[:, 0] - a[0])) / seg_len
+        i = int(np.argmax(d))
+        if d[i] > tol:
+            k = s + 1 + i
+            keep[k] = True
+            stack.append((s, k))
+            stack.append((k, e))
+    return keep
+
+
+def simplify_ring(ring: np.ndarray, tol: float) -> Optional[np.ndarray]:
+    """Simplify a closed ring; None if it collapses below a triangle."""
+    if np.array_equal(ring[0], ring[-1]):
+        ring = ring[:-1]
+    if len(ring) < 3:
+        return None
+    # Split at the vertex farthest from the first so both halves are open polylines
+    far = int(np.argmax(np.hypot(ring[:, 0] - ring[0, 0], ring[:, 1] - ring[0, 1])))
+    if far == 0:
+        return None
+    first = ring[: far + 1]
+    second = np.vstack([ring[far:], ring[:1]])
+    kept = np.vstack([first[_dp_keep(first, tol)], second[_dp_keep(second, tol)][1:]])
+    if len(kept) < 4:  # closed triangle = 4 points
+        return None
+    return kept
+
+
+def _slugify(name: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-")
+
+
+# =========================
+# Precomputed payloads
+# =========================
+class Payload:
+    __slots__ = ("body", "gzipped", "etag", "etag_gzip")
+
+    def __init__(self, obj):
+        self.body = json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        self.gzipped = gzip.compress(self.body, compresslevel=9)
+        # Strong ETags identify the bytes sent, so each encoding gets its own
+        digest = hashlib.sha1(self.body).hexdigest()[:20]
+        self.etag = f'"{digest}"'
+        self.etag_gzip = f'"{digest}-gz"'
+
+
+class GeometryService:
+    """
+    Area boundaries from export.geojson, simplified per zoom level and
+    serialized once. Coordinates are rounded to the precision the tolerance
+    can show, which is where most of the byte savings come from.
+    """
+
+    def __init__(self, geojson_path: str = GEOJSON_PATH, zooms: List[int] = GEOMETRY_ZOOMS):
+        self.zooms = sorted(zooms)
+        self.areas: Dict[str, Dict] = {}
+        self._payloads: Dict[Tuple[Optional[str], int], Payload] = {}
+        self._build(geojson_path)
+
+    def _build(self, path: str):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+
+        raw = []
+        for feat in data.get("features", []):
+            geom = feat.get("geometry") or {}
+            if geom.get("type") not in ("Polygon", "MultiPolygon"):
+                continue
+            props = feat.get("properties") or {}
+            name = props.get("name:en") or props.get("name")
+            if not name:
+                continue
+            polys = [geom["coordinates"]] if geom["type"] == "Polygon" else geom["coordinates"]
+            raw.append((name, props, polys))
+
+        names = [_slugify(n) for n, _, _ in raw]
+        for (name, props, polys), slug in zip(raw, names):
+            osm_id = props.get("@id", "")
+            key = slug if names.count(slug) == 1 else f"{slug}-{osm_id.split('/')[-1]}"
+            self.areas[key] = {
+                "key": key,
+                "name": name,
+                "osm_id": osm_id,
+                "admin_level": props.get("admin_level"),
+                "polygons": [[np.asarray(r, dtype=np.float64)[:, :2] for r in poly] for poly in polys],
+            }
+
+        collections: Dict[int, List[Dict]] = {zoom: [] for zoom in self.zooms}
+        for key, area in self.areas.items():
+            # An area that is sub-pixel at a coarse zoom is left out of that
+            # zoom's collection; requested on its own it gets the geometry
+            # of the nearest finer zoom (or none at all)
+            finer = None
+            for zoom in reversed(self.zooms):
+                feature = self._simplified_feature(area, zoom)
+                if feature is not None:
+                    collections[zoom].append(feature)
+                    finer = feature
+                self._payloads[(key, zoom)] = Payload(feature or finer or self._feature(area, zoom, None))
+        for zoom, features in collections.items():
+            self._payloads[(None, zoom)] = Payload({"type": "FeatureCollection", "features": features})
+
+    def _simplified_feature(self, area: Dict, zoom: int) -> Optional[Dict]:
+        tol = zoom_tolerance(zoom)
+        decimals = max(0, math.ceil(-math.log10(tol)) + 1)
+        polys = []
+        for poly in area["polygons"]:
+            outer = simplify_ring(poly[0], tol)
+            if outer is None:
+                continue  # sub-pixel polygon at this zoom
+            rings = [outer] + [h for h in (simplify_ring(r, tol) for r in poly[1:]) if h is not None]
+            polys.append([np.round(r, decimals).tolist() for r in rings])
+        if not polys:
+            return None
+        geometry = (
+            {"type": "Polygon", "coordinates": polys[0]} if len(polys) == 1
+            else {"type": "MultiPolygon", "coordinates": polys}
+        )
+        return self._feature(area, zoom, geometry)
+
+    @staticmethod
+    def _feature(area: Dict, zoom: int, geometry: Optional[Dict]) -> Dict:
+        return {
+            "type": "Feature",
+            "id": area["key"],
+            "properties": {
+                "key": area["key"],
+                "name": area["name"],
+                "osm_id": area["osm_id"],
+                "admin_level": area["admin_level"],
+                "zoom": zoom,
+            },
+            "geometry": geometry,
+        }
+
+    def snap_zoom(self, zoom: int) -> int:
+        """Highest precomputed zoom <= requested (or the lowest available)."""
+        eligible = [z for z in self.zooms if z <= zoom]
+        return eligible[-1] if eligible else self.zooms[0]
+
+    def get(self, area_key: Optional[str], zoom: int) -> Optional[Payload]:
+        """area_key=None returns the FeatureCollection of every area."""
+        return self._payloads.get((area_key, self.snap_zoom(zoom)))
+
+
+_service: Optional[GeometryService] = None
+_service_lock = threading.Lock()
+
+
+def get_geometry_service() -> GeometryService:
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = GeometryService()
+                print(f"🗺️ Geometry service ready: {len(_service.areas)} areas x zooms {_service.zooms}")
+    return _service
@@ -1,17 +1,23 @@
 import os
+import asyncio
 from typing import Any, List, TypedDict, Annotated
 from operator import add
 from langgraph.graph import StateGraph, END
+from langgraph.graph.message import add_messages
 from langgraph.prebuilt import create_react_agent
 from langchain_openai import ChatOpenAI
 from langchain.prompts import PromptTemplate
 from langchain_core.messages import SystemMessage
 
-from utils.tools import rag_tool, web_search, pgsql_query_structured, image_search
+from utils.tools import ALL_TOOLS
+from utils.latency_budget import budgeted
+from utils.tool_compaction import compact_tool_output
+from utils.llm_scheduler import scheduled_http_clients
 
 # ========== STATE TYPE ==========
 class GraphState(TypedDict, total=False):
-    messages: list
+    # Reducer so a checkpointed thread can be updated with just the new turn
+    messages: Annotated[list, add_messages]
     tool_input: Any
     tool_output: Any
     followups: Annotated[List[str], add]
@@ -21,6 +27,19 @@ llm = ChatOpenAI(
     model="openai/gpt-oss-120b",
     api_key=os.getenv("GROQ_API_KEY"),
     base_url="https://api.groq.com/openai/v1",
+    **scheduled_http_clients(),
+)
+
+# Follow-ups run between the answer and the end of the turn: one short
+# attempt, no retries, so a busy provider costs them and not the turn
+FOLLOWUP_TIMEOUT_S = float(os.getenv("FOLLOWUP_TIMEOUT_S", "5"))
+followup_llm = ChatOpenAI(
+    model="openai/gpt-oss-120b",
+    api_key=os.getenv("GROQ_API_KEY"),
+    base_url="https://api.groq.com/openai/v1",
+    timeout=FOLLOWUP_TIMEOUT_S,
+    max_retries=0,
+    **scheduled_http_clients(),
 )
 
 # ========== FOLLOWUP PROMPT ==========
@@ -55,8 +74,10 @@ STYLE_PROMPT = """""
 
 # ========== ASYNC HELPER ==========
 async def _generate_followups(answer: str) -> list[str]:
-    chain = followup_prompt | llm
-    result = await chain.ainvoke({"answer": answer})
+    chain = followup_prompt | followup_llm
+    # Bounds the wait for a scheduler slot as well as the request itself
+    async with asyncio.timeout(FOLLOWUP_TIMEOUT_S):
+        result = await chain.ainvoke({"answer": answer})
     raw_text = result.content.strip()
     return [
         line.strip(" -0123456789.").strip()
@@ -67,19 +88,28 @@ async def _generate_followups(answer: str) -> list[str]:
 
 style_message = SystemMessage(content=STYLE_PROMPT)
 # ========== GRAPH ==========
-def build_graph():
+def build_graph(checkpointer=None):
     workflow = StateGraph(GraphState)
 
-    # Single ReAct agent handles reasoning, tool usage, and synthesis
+    # Single ReAct agent handles reasoning, tool usage, and synthesis.
+    # Tools run under the request's latency budget (config["configurable"]),
+    # and their results are compacted before the agent's next step; the full
+    # result stays on the ToolMessage artifact for the SSE events.
+    # The style prompt is prepended per LLM call rather than kept in the
+    # state, and the agent's inner steps are not checkpointed: only the
+    # outer thread state is needed to resume the next turn.
     agent = create_react_agent(
         llm,
-        tools=[rag_tool, web_search, pgsql_query_structured, image_search],
+        tools=[budgeted(t, compact=compact_tool_output) for t in ALL_TOOLS],
+        prompt=style_message,
+        checkpointer=False,
     )
 
     workflow.add_node("agent", agent)
     workflow.set_entry_point("agent")
     workflow.add_edge("agent", END)
 
-    return workflow.compile()
+    # With a checkpointer (utils.checkpointing) turns resume per thread_id
+    return workflow.compile(checkpointer=checkpointer)
 
 graph = build_graph()
@@ -0,0 +1,322 @@
+# ingestion.py
+"""
+Streaming bulk ingestion for the RAG knowledge base.
+
+    cd AI-server && python -m utils.ingestion data/area_reports --kind area_report
+    cd AI-server && python -m utils.ingestion data/ --workers 8 --batch-size 64
+
+Supports PDF (developer brochures), Markdown/text (area reports) and
+JSON/JSONL FAQs ({"question": ..., "answer": ...}). Chunk ids are derived
+from an xxhash of the chunk content, so re-running only embeds and upserts
+chunks that changed; chunks that disappeared from a file, and the chunks of
+deleted files under the given paths, are deleted. A run that changed the
+collection bumps its version marker (utils.retrieval_cache), which is how
+the servers notice.
+
+Sources (and so chunk ids) are paths relative to --root (INGEST_ROOT,
+default: the common parent of the given paths); keep it the same between
+runs over the same knowledge base.
+"""
+import os
+import json
+import uuid
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import xxhash
+from pypdf import PdfReader
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from qdrant_client.models import (
+    Distance,
+    FieldCondition,
+    Filter,
+    HasIdCondition,
+    MatchAny,
+    MatchValue,
+    PointStruct,
+    VectorParams,
+)
+
+from utils.retrieval_cache import bump_collection_version
+
+CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "1000"))
+CHUNK_OVERLAP = int(os.getenv("INGEST_CHUNK_OVERLAP", "150"))
+TEXT_EXTENSIONS = {".md", ".txt"}
+FAQ_EXTENSIONS = {".json", ".jsonl"}
+INGEST_ROOT = os.getenv("INGEST_ROOT")
+
+# Chunk = (point id, text, metadata)
+Chunk = Tuple[str, str, Dict]
+
+
+# =========================
+# Readers (one unit at a time)
+# =========================
+def _iter_files(paths: List[str]) -> Iterator[str]:
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def _read_units(path: str) -> Iterator[Tuple[str, Dict]]:
+    """Yield (text, extra metadata) units: PDF pages, whole text files, FAQ entries."""
+    ext = os.path.splitext(path)[1].lower()
+
+    if ext == ".pdf":
+        reader = PdfReader(path)
+        for page_no, page in enumerate(reader.pages, start=1):
+            text = page.extract_text() or ""
+            if text.strip():
+                yield text, {"page": page_no}
+
+    elif ext in TEXT_EXTENSIONS:
+        with open(path, encoding="utf-8") as f:
+            yield f.read(), {}
+
+    elif ext in FAQ_EXTENSIONS:
+        with open(path, encoding="utf-8") as f:
+            if ext == ".jsonl":
+                entries = (json.loads(line) for line in f if line.strip())
+            else:
+                entries = iter(json.load(f))
+            for i, entry in enumerate(entries):
+                q, a = entry.get("question", ""), entry.get("answer", "")
+                yield f"{q}\nAnswer:\n{a}", {"faq_index": i}
+
+
+def _chunk_id(source: str, text: str) -> str:
+    # Deterministic UUID (Qdrant ids must be ints or UUIDs) from the content hash
+    return str(uuid.UUID(hex=xxhash.xxh3_128_hexdigest(f"{source}|{text}".encode("utf-8"))))
+
+
+def default_root(paths: List[str]) -> str:
+    dirs = [p if os.path.isdir(p) else os.path.dirname(p) for p in map(os.path.abspath, paths)]
+    return os.path.commonpath(dirs)
+
+
+def source_name(path: str, root: str) -> str:
+    """Path of a file relative to the ingestion root, independent of the working directory."""
+    return os.path.relpath(os.path.abspath(path), os.path.abspath(root))
+
+
+def iter_chunks(path: str, kind: Optional[str], splitter, root: str) -> Iterator[Chunk]:
+    source = source_name(path, root)
+    kind = kind or os.path.basename(os.path.dirname(path)) or "document"
+    for text, extra in _read_units(path):
+        for piece in splitter.split_text(text):
+            meta = {"source": source, "kind": kind, **extra}
+            yield _chunk_id(source, piece), piece, meta
+
+
+def _batched(chunks: Iterator[Chunk], size: int) -> Iterator[List[Chunk]]:
+    batch: List[Chunk] = []
+    for c in chunks:
+        batch.append(c)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# =========================
+# Pipeline
+# =========================
+class _FileState:
+    """Batches of one file still in flight; stale chunks are deleted once all succeeded."""
+
+    def __init__(self, source: str):
+        self.source = source
+        self.ids: List[str] = []
+        self.pending = 0
+        self.read = False
+        self.failed = False
+        self.done = False
+
+
+class IngestionPipeline:
+    def __init__(self, client, collection_name: str, embeddings, workers: int = 4, batch_size: int = 64):
+        self.client = client
+        self.collection_name = collection_name
+        self.embeddings = embeddings
+        self.workers = workers
+        self.batch_size = batch_size
+        self.splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+        self.stats = {
+            "files": 0, "chunks": 0, "skipped": 0, "upserted": 0,
+            "deleted_stale": 0, "deleted_files": 0, "failed_batches": 0,
+        }
+
+    def _ensure_collection(self):
+        """Create the collection before any batch runs (workers racing to create it would fail)."""
+        if not self.client.collection_exists(self.collection_name):
+            dim = len(self.embeddings.embed_documents(["dimension probe"])[0])
+            self.client.create_collection(
+                self.collection_name,
+                vectors_config=VectorParams(size=dim, distance=Distance.COSINE),
+            )
+
+    def _existing_ids(self, ids: List[str]) -> set:
+        try:
+            points = self.client.retrieve(self.collection_name, ids=ids, with_payload=False, with_vectors=False)
+        except Exception:
+            return set()  # collection not created yet
+        return {str(p.id) for p in points}
+
+    def _process_batch(self, batch: List[Chunk]) -> Tuple[int, int]:
+        """Embed + upsert the chunks of a batch that are not already stored. Returns (upserted, skipped)."""
+        existing = self._existing_ids([cid for cid, _, _ in batch])
+        fresh = [c for c in batch if c[0] not in existing]
+        if not fresh:
+            return 0, len(batch)
+
+        vectors = self.embeddings.embed_documents([text for _, text, _ in fresh])
+        self.client.upsert(
+            self.collection_name,
+            points=[
+                # Same payload layout as langchain's Qdrant vectorstore
+                PointStruct(id=cid, vector=vec, payload={"page_content": text, "metadata": meta})
+                for (cid, text, meta), vec in zip(fresh, vectors)
+            ],
+        )
+        return len(fresh), len(batch) - len(fresh)
+
+    def _collect(self, fut: Future, state: _FileState):
+        try:
+            upserted, skipped = fut.result()
+        except Exception as e:
+            # One bad batch (embedding/upsert error) fails its file, not the run
+            print(f"❌ Batch of {state.source} failed: {e}")
+            self.stats["failed_batches"] += 1
+            state.failed = True
+        else:
+            self.stats["upserted"] += upserted
+            self.stats["skipped"] += skipped
+        state.pending -= 1
+        self._finish(state)
+
+    def _finish(self, state: _FileState):
+        if state.done or not state.read or state.pending:
+            return
+        state.done = True
+        # A file with failed batches keeps its old chunks until a clean re-run
+        if not state.failed:
+            self._delete_stale(state.source, state.ids)
+
+    def _delete_stale(self, source: str, keep_ids: List[str]):
+        """Remove chunks of `source` that are no longer produced by the file."""
+        stale_filter = Filter(
+            must=[FieldCondition(key="metadata.source", match=MatchValue(value=source))],
+            must_not=[HasIdCondition(has_id=keep_ids)],
+        )
+        try:
+            stale = self.client.count(self.collection_name, count_filter=stale_filter).count
+            if stale:
+                self.client.delete(self.collection_name, points_selector=stale_filter)
+                self.stats["deleted_stale"] += stale
+        except Exception as e:
+            print(f"Stale chunk cleanup failed for {source}: {e}")
+
+    def _delete_removed_files(self, paths: List[str], root: str, seen: set):
+        """Remove chunks of files under `paths` that no longer exist (or are no longer ingested)."""
+        scopes = [os.path.abspath(p) for p in paths]
+
+        def in_scope(source: str) -> bool:
+            full = os.path.join(root, source)
+            return any(full == s or full.startswith(s.rstrip(os.sep) + os.sep) for s in scopes)
+
+        stored, offset = set(), None
+        try:
+            while True:
+                points, offset = self.client.scroll(
+                    self.collection_name,
+                    with_payload=["metadata.source"],
+                    with_vectors=False,
+                    limit=1024,
+                    offset=offset,
+                )
+                for p in points:
+                    source = ((p.payload or {}).get("metadata") or {}).get("source")
+                    if source:
+                        stored.add(source)
+                if offset is None:
+                    break
+
+            gone = sorted(s for s in stored - seen if in_scope(s))
+            if not gone:
+                return
+            removed_filter = Filter(must=[FieldCondition(key="metadata.source", match=MatchAny(any=gone))])
+            removed = self.client.count(self.collection_name, count_filter=removed_filter).count
+            self.client.delete(self.collection_name, points_selector=removed_filter)
+            self.stats["deleted_files"] += len(gone)
+            self.stats["deleted_stale"] += removed
+            print(f"🗑️ Removed {removed} chunks of {len(gone)} deleted files")
+        except Exception as e:
+            print(f"Deleted-file cleanup failed: {e}")
+
+    def run(self, paths: List[str], kind: Optional[str] = None, root: Optional[str] = None) -> Dict[str, int]:
+        start = time.perf_counter()
+        max_inflight = self.workers * 2  # bounds memory: batches are pulled lazily
+        root = os.path.abspath(root or INGEST_ROOT or default_root(paths))
+        self._ensure_collection()
+        seen: set = set()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            inflight: List[Tuple[Future, _FileState]] = []
+            for path in _iter_files(paths):
+                ext = os.path.splitext(path)[1].lower()
+                if ext not in TEXT_EXTENSIONS | FAQ_EXTENSIONS | {".pdf"}:
+                    continue
+                self.stats["files"] += 1
+                state = _FileState(source_name(path, root))
+                seen.add(state.source)
+
+                try:
+                    for batch in _batched(iter_chunks(path, kind, self.splitter, root), self.batch_size):
+                        self.stats["chunks"] += len(batch)
+                        state.ids.extend(cid for cid, _, _ in batch)
+                        state.pending += 1
+                        inflight.append((pool.submit(self._process_batch, batch), state))
+                        while len(inflight) >= max_inflight:
+                            self._collect(*inflight.pop(0))
+                except Exception as e:
+                    print(f"❌ Failed to read {path}: {e}")
+                    state.failed = True
+
+                state.read = True
+                self._finish(state)
+                print(f"📄 {path}: {len(state.ids)} chunks")
+
+            for fut, state in inflight:
+                self._collect(fut, state)
+
+        self._delete_removed_files(paths, root, seen)
+        if self.stats["upserted"] or self.stats["deleted_stale"]:
+            # Tells the servers' retrieval caches and local indexes to catch up
+            bump_collection_version(self.collection_name)
+        self.stats["elapsed_s"] = round(time.perf_counter() - start, 2)
+        return self.stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest files into the RAG knowledge base")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--kind", help="area_report | developer_brochure | market_faq (default: parent folder name)")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--root", help="directory sources are relative to (default: INGEST_ROOT or the paths' common parent)")
+    args = parser.parse_args()
+
+    from RAG_config import qdrant_client, vectorstore, embedding
+
+    pipeline = IngestionPipeline(
+        qdrant_client, vectorstore.collection_name, embedding,
+        workers=args.workers, batch_size=args.batch_size,
+    )
+    print(pipeline.run(args.paths, kind=args.kind, root=args.root))
@@ -94,7 +94,12 @@ from langchain_openai import ChatOpenAI
 from langchain_core.messages import SystemMessage, HumanMessage
 from langgraph.graph import StateGraph, START, END
 from langgraph.prebuilt import create_react_agent
-from utils.tools import ALL_TOOLS
+from utils.tools import ALL_TOOLS, engine
+from utils.area_resolver import get_area_resolver
+from utils.location_hierarchy import get_location_hierarchy
+from utils.market_metrics import get_market_metrics
+from utils.monthly_rollups import get_monthly_rollups
+from utils.llm_scheduler import scheduled_http_clients
 import json
 
 load_dotenv()
@@ -105,14 +110,54 @@ llm = ChatOpenAI(
     api_key=os.getenv("GROQ_API_KEY"),
     base_url="https://api.groq.com/openai/v1",
     temperature=0.2,
+    **scheduled_http_clients(),
 )
 
 
+def _location_context(context) -> str:
+    """Where the locations named in the chart context sit in the locations tree."""
+    try:
+        hierarchy = get_location_hierarchy(engine)
+        mentions = get_area_resolver(engine).extract(str(context))
+        lines = [hierarchy.describe(m["id"]) for m in mentions if m["kind"] == "location" and m["id"] in hierarchy]
+    except Exception as e:
+        print("Location context unavailable:", e)
+        return ""
+    return f"- Location hierarchy: {' | '.join(lines[:3])}" if lines else ""
+
+
+def _data_summary(state):
+    """
+    The caller's data_summary, or the area's series from the monthly rollups
+    when none was sent (context: area, propertyType, bedrooms, viewType).
+    """
+    if state.get("data_summary"):
+        return state["data_summary"]
+    context = state.get("context") or {}
+    if not isinstance(context, dict) or not context.get("area"):
+        return []
+    try:
+        rollups = get_monthly_rollups(engine)
+        if rollups is None:
+            print("Monthly rollups still building, no data summary for this request")
+            return []
+        area_ids = get_area_resolver(engine).area_ids(context["area"], get_location_hierarchy(engine))
+        return rollups.series(
+            area_ids,
+            context.get("propertyType"),
+            context.get("bedrooms"),
+            period="year" if context.get("viewType") == "yearly" else "month",
+        )
+    except Exception as e:
+        print("Monthly rollups unavailable:", e)
+        return []
+
+
 # ---------- Node: Insight Generation ----------
 def generate_insight(state):
     chart_type = state["chart_type"]
     context = state["context"]
-    data_summary = state["data_summary"]
+    data_summary = _data_summary(state)
     detail_level = state.get("detail_level", "short")
 
     prompt = f"""
@@ -122,6 +167,7 @@ def generate_insight(state):
     - Chart type: {chart_type}
     - Context: {context}
     - Aggregated data summary (array of objects): {data_summary}
+    {_location_context(context)}
 
     Write a { "one-line quantitative insight" if detail_level == "short" else "detailed investor insight (3–5 sentences)" }.
     Focus on patterns, trends, or anomalies. Do NOT repeat raw numbers exactly.
@@ -139,7 +185,7 @@ def generate_insight(state):
 def generate_narrative(state):
     chart_type = state["chart_type"]
     context = state["context"]
-    data_summary = state.get("data_summary", [])
+    data_summary = _data_summary(state)
     detail_level = state.get("detail_level", "detailed")
 
     prompt = f"""
@@ -149,6 +195,7 @@ def generate_narrative(state):
     - Chart type: {chart_type}
     - Context: {context}
     - Data Summary: {data_summary}
+    {_location_context(context)}
 
     Write a narrative for investors in {detail_level} detail.
     Be fluent, engaging, and insight-driven.
@@ -166,7 +213,7 @@ def generate_narrative(state):
 def generate_opportunity_snapshot(state):
     chart_type = state["chart_type"]
     context = state["context"]
-    data_summary = state["data_summary"]
+    data_summary = _data_summary(state)
 
     prompt = f"""
     You are a Dubai property investment advisor.
@@ -222,8 +269,29 @@ DEFAULT_WEIGHTS = {
 def _safe(v):
     return None if v is None else float(v)
 
+def _engine_metrics(state):
+    """Score inputs from the market-metrics engine for the state's area, if any."""
+    context = state.get("context") or {}
+    area = state.get("area") or (context.get("area") if isinstance(context, dict) else None)
+    if not area:
+        return {}
+    try:
+        area_ids = get_area_resolver(engine).area_ids(area, get_location_hierarchy(engine))
+        if not area_ids:
+            return {}
+        inputs = get_market_metrics(engine).investment_inputs(
+            area_ids,
+            state.get("property_type") or (context.get("propertyType") if isinstance(context, dict) else None),
+            state.get("bedrooms") or (context.get("bedrooms") if isinstance(context, dict) else None),
+        )
+    except Exception as e:
+        print("Market metrics unavailable:", e)
+        return {}
+    return {k: v for k, v in inputs.items() if v is not None}
+
 def generate_investment_score(state):
-    metrics = state.get("metrics", {})
+    # Caller-supplied metrics win; the engine fills whatever is missing
+    metrics = {**_engine_metrics(state), **(state.get("metrics") or {})}
     weights = state.get("weights", DEFAULT_WEIGHTS)
 
     # Extract metrics with safe defaults
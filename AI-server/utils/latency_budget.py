@@ -0,0 +1,191 @@
+# latency_budget.py
+import os
+import time
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Dict, List, Optional
+
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import BaseTool, StructuredTool
+
+from utils import metrics
+
+# Whole /chat_stream turn, seconds
+CHAT_LATENCY_BUDGET_S = float(os.getenv("CHAT_LATENCY_BUDGET_S", "45"))
+# No single tool call may take longer than this, even with budget to spare
+TOOL_TIMEOUT_MAX_S = float(os.getenv("TOOL_TIMEOUT_MAX_S", "20"))
+# Budget held back for the agent to write its answer after the last tool
+ANSWER_RESERVE_S = float(os.getenv("ANSWER_RESERVE_S", "8"))
+# Threads for tools invoked synchronously (a timed-out call keeps its thread until it returns)
+SYNC_TOOL_THREADS = int(os.getenv("SYNC_TOOL_THREADS", "8"))
+
+
+class LatencyBudget:
+    """Deadline for one request, carried in config["configurable"]["latency_budget"]."""
+
+    def __init__(self, seconds: float = CHAT_LATENCY_BUDGET_S):
+        self.seconds = seconds
+        self.deadline = time.monotonic() + seconds
+        self.tool_calls: List[Dict[str, Any]] = []
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - time.monotonic())
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.deadline
+
+    def tool_timeout(self) -> float:
+        """Deadline for the next tool call, leaving room for the final answer."""
+        return max(0.0, min(TOOL_TIMEOUT_MAX_S, self.remaining() - ANSWER_RESERVE_S))
+
+    def record(self, tool: str, elapsed_ms: int, timed_out: bool):
+        self.tool_calls.append({
+            "tool": tool,
+            "elapsed_ms": elapsed_ms,
+            "timed_out": timed_out,
+        })
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "budget_s": self.seconds,
+            "remaining_s": round(self.remaining(), 2),
+            "tool_calls": self.tool_calls,
+        }
+
+
+def get_budget(config: Optional[RunnableConfig]) -> Optional[LatencyBudget]:
+    if not config:
+        return None
+    return (config.get("configurable") or {}).get("latency_budget")
+
+
+async def until_deadline(events: AsyncIterable, budget: LatencyBudget) -> AsyncIterator:
+    """
+    Iterate `events` while the budget lasts. The step pending at the
+    deadline is cancelled and TimeoutError raised, so a model or tool that
+    never produces another event cannot hold the turn past its budget.
+    """
+    it = events.__aiter__()
+    while True:
+        try:
+            async with asyncio.timeout(budget.remaining()):
+                event = await it.__anext__()
+        except StopAsyncIteration:
+            return
+        yield event
+
+
+_sync_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _reset_after_fork():
+    global _sync_pool
+    _sync_pool = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _sync_executor() -> ThreadPoolExecutor:
+    global _sync_pool
+    if _sync_pool is None:
+        _sync_pool = ThreadPoolExecutor(max_workers=SYNC_TOOL_THREADS, thread_name_prefix="tool")
+    return _sync_pool
+
+
+def timed_out_result(tool: str, timeout_s: float) -> Dict[str, Any]:
+    return {
+        "error": "timeout",
+        "timed_out": True,
+        "tool": tool,
+        "message": (
+            f"The {tool} tool did not finish within {timeout_s:.1f}s and was cancelled. "
+            "Answer with the information you already have and mention that this "
+            "source was unavailable."
+        ),
+    }
+
+
+def budgeted(tool: BaseTool, compact: Optional[Callable[[str, Any], str]] = None) -> BaseTool:
+    """
+    Wrap a tool so each call runs under the request's latency budget.
+    The call is abandoned at its deadline and the agent receives a timeout
+    result naming the tool instead of an exception.
+
+    With `compact`, the agent sees compact(name, result) as the ToolMessage
+    content while the full result rides along as the message artifact.
+    """
+    name = tool.name
+
+    def _respond(result):
+        if compact is None:
+            return result
+        return compact(name, result), result
+
+    def _timed_out(budget, start: float, timeout: float):
+        elapsed_ms = int((time.perf_counter() - start) * 1000)
+        print(f"⏱️ Tool {name} timed out after {elapsed_ms}ms (deadline {timeout:.1f}s)")
+        metrics.incr("tool_timeouts", label=name)
+        if budget:
+            budget.record(name, elapsed_ms, True)
+        return _respond(timed_out_result(name, timeout))
+
+    def _finished(budget, start: float, result):
+        elapsed_ms = int((time.perf_counter() - start) * 1000)
+        metrics.observe("tool_latency_ms", elapsed_ms, label=name)
+        if budget:
+            budget.record(name, elapsed_ms, False)
+        return _respond(result)
+
+    # Call the wrapped bodies directly: going through tool.ainvoke would start
+    # a nested tool run and emit duplicate on_tool_start/on_tool_end events.
+    def _run(config: RunnableConfig, **kwargs):
+        budget = get_budget(config)
+        timeout = budget.tool_timeout() if budget else TOOL_TIMEOUT_MAX_S
+
+        start = time.perf_counter()
+        if timeout <= 0:
+            return _timed_out(budget, start, timeout)
+        # A thread cannot be cancelled: at the deadline the caller moves on
+        # and the call finishes (or fails) in the background
+        future = _sync_executor().submit(contextvars.copy_context().run, tool.func, **kwargs)
+        try:
+            result = future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            return _timed_out(budget, start, timeout)
+        return _finished(budget, start, result)
+
+    async def _call(**kwargs):
+        if getattr(tool, "coroutine", None):
+            return await tool.coroutine(**kwargs)
+        return await asyncio.to_thread(tool.func, **kwargs)
+
+    async def _arun(config: RunnableConfig, **kwargs):
+        budget = get_budget(config)
+        timeout = budget.tool_timeout() if budget else TOOL_TIMEOUT_MAX_S
+
+        start = time.perf_counter()
+        try:
+            if timeout <= 0:
+                raise asyncio.TimeoutError()
+            result = await asyncio.wait_for(_call(**kwargs), timeout)
+        except asyncio.TimeoutError:
+            return _timed_out(budget, start, timeout)
+        except asyncio.CancelledError:
+            # The turn itself was cancelled (abandoned stream): the tool's own
+            # cleanup aborts its request/statement, this only accounts for it
+            metrics.incr("tool_cancelled", label=name)
+            metrics.observe("tool_cancelled_after_ms", int((time.perf_counter() - start) * 1000), label=name)
+            raise
+        return _finished(budget, start, result)
+
+    return StructuredTool.from_function(
+        func=_run,
+        coroutine=_arun,
+        name=name,
+        description=tool.description,
+        args_schema=tool.args_schema,
+        response_format="content_and_artifact" if compact else "content",
+    )
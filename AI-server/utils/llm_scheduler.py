@@ -0,0 +1,414 @@
+# llm_scheduler.py
+"""
+Per-user fair scheduling of LLM provider calls.
+
+Every ChatOpenAI client is built with scheduled_http_clients(), so each
+request to the provider first takes a slot from the process-wide
+scheduler:
+- at most LLM_MAX_CONCURRENCY requests in flight, and LLM_USER_MAX_CONCURRENCY
+  per user, so one user's agent chain cannot hold the whole quota
+- waiting requests are served by weighted fair queueing on their user key
+  (cost = prompt size, weight LLM_WEIGHT_SIGNED_IN / LLM_WEIGHT_ANONYMOUS)
+  instead of FIFO
+- interactive requests always go before background ones; background work
+  (follow-up suggestions, pre-computed insights) holds at most
+  LLM_BACKGROUND_MAX slots and gives up after LLM_BACKGROUND_WAIT_S;
+  interactive requests give up at their turn's deadline (set_llm_deadline,
+  else after LLM_INTERACTIVE_WAIT_S), so no caller queues past its budget
+
+Who is calling comes from a context variable set by the entry points
+(set_llm_principal); it follows asyncio tasks and executor threads. Calls
+made outside any request share the "system" key. Limits are per worker
+process: size LLM_MAX_CONCURRENCY as provider quota / workers.
+"""
+import os
+import time
+import asyncio
+import threading
+import weakref
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Optional, Tuple
+
+import httpx
+
+from utils import metrics
+from utils.latency_budget import CHAT_LATENCY_BUDGET_S
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_USER_MAX_CONCURRENCY = int(os.getenv("LLM_USER_MAX_CONCURRENCY", "3"))
+LLM_BACKGROUND_MAX = int(os.getenv("LLM_BACKGROUND_MAX", "4"))
+LLM_BACKGROUND_WAIT_S = float(os.getenv("LLM_BACKGROUND_WAIT_S", "10"))
+# Longest wait for interactive calls made outside a turn with a deadline
+LLM_INTERACTIVE_WAIT_S = float(os.getenv("LLM_INTERACTIVE_WAIT_S", str(CHAT_LATENCY_BUDGET_S)))
+LLM_WEIGHT_SIGNED_IN = float(os.getenv("LLM_WEIGHT_SIGNED_IN", "2"))
+LLM_WEIGHT_ANONYMOUS = float(os.getenv("LLM_WEIGHT_ANONYMOUS", "1"))
+# Request bytes per cost unit (roughly one prompt token)
+LLM_COST_BYTES = 4
+
+INTERACTIVE, BACKGROUND = 0, 1
+PRIORITY_NAMES = ("interactive", "background")
+
+# (key, weight, priority)
+_principal: ContextVar[Tuple[str, float, int]] = ContextVar(
+    "llm_principal", default=("system", LLM_WEIGHT_SIGNED_IN, INTERACTIVE)
+)
+# time.monotonic() deadline of the current turn, if any
+_deadline: ContextVar[Optional[float]] = ContextVar("llm_deadline", default=None)
+
+
+def request_client(conn) -> str:
+    """
+    Client address of a Starlette Request/WebSocket. Behind a proxy this is
+    the forwarded address only when uvicorn trusts the proxy (proxy_headers
+    with FORWARDED_ALLOW_IPS); a raw X-Forwarded-For is client-controlled.
+    """
+    return conn.client.host if conn.client else "unknown"
+
+
+def set_llm_principal(user_id: Optional[str], client: Optional[str] = None, priority: int = INTERACTIVE):
+    """Attribute the current task's LLM calls to a user (anonymous users by client)."""
+    if user_id and str(user_id).strip():
+        _principal.set((f"user:{user_id}", LLM_WEIGHT_SIGNED_IN, priority))
+    else:
+        _principal.set((f"anon:{client or 'unknown'}", LLM_WEIGHT_ANONYMOUS, priority))
+
+
+def set_llm_deadline(deadline: Optional[float]):
+    """Interactive LLM calls of the current task stop waiting for a slot at `deadline` (time.monotonic())."""
+    _deadline.set(deadline)
+
+
+def _wait_timeout(priority: int) -> float:
+    if priority == BACKGROUND:
+        return LLM_BACKGROUND_WAIT_S
+    deadline = _deadline.get()
+    if deadline is None:
+        return LLM_INTERACTIVE_WAIT_S
+    return max(deadline - time.monotonic(), 0.0)
+
+
+@contextmanager
+def llm_priority(priority: int):
+    """Run the block's LLM calls at `priority`, for the same user."""
+    key, weight, _ = _principal.get()
+    token = _principal.set((key, weight, priority))
+    try:
+        yield
+    finally:
+        _principal.reset(token)
+
+
+class _Waiter:
+    __slots__ = ("key", "priority", "start", "finish", "seq", "enqueued_at", "loop", "future", "event", "granted")
+
+    def __init__(self, key: str, priority: int):
+        self.key = key
+        self.priority = priority
+        self.enqueued_at = time.perf_counter()
+        self.loop = None
+        self.future = None
+        self.event = None
+        self.granted = False
+
+    def wake(self):
+        if self.future is not None:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+        else:
+            self.event.set()
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class FairScheduler:
+    """Slots for async and threaded callers; see the module docstring for the policy."""
+
+    def __init__(
+        self,
+        capacity: int = LLM_MAX_CONCURRENCY,
+        per_user: int = LLM_USER_MAX_CONCURRENCY,
+        background_max: int = LLM_BACKGROUND_MAX,
+    ):
+        self.capacity = capacity
+        self.per_user = per_user
+        self.background_max = background_max
+        self._lock = threading.Lock()
+        self._queues: Tuple[Dict[str, Deque[_Waiter]], ...] = ({}, {})  # per priority, per key
+        self._vtime = [0.0, 0.0]
+        self._last_finish: Tuple[Dict[str, float], ...] = ({}, {})
+        self._active_by_key: Dict[str, int] = {}
+        self._active = 0
+        self._active_background = 0
+        self._seq = 0
+
+    # -----------------------
+    # Queueing (under _lock)
+    # -----------------------
+    def _enqueue(self, waiter: _Waiter, cost: float, weight: float):
+        p, key = waiter.priority, waiter.key
+        waiter.start = max(self._vtime[p], self._last_finish[p].get(key, 0.0))
+        waiter.finish = waiter.start + cost / weight
+        self._last_finish[p][key] = waiter.finish
+        self._seq += 1
+        waiter.seq = self._seq
+        self._queues[p].setdefault(key, deque()).append(waiter)
+
+    def _remove(self, waiter: _Waiter):
+        queue = self._queues[waiter.priority].get(waiter.key)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self._queues[waiter.priority][waiter.key]
+
+    def _next(self) -> Optional[_Waiter]:
+        for p in (INTERACTIVE, BACKGROUND):
+            if p == BACKGROUND and self._active_background >= self.background_max:
+                break
+            best = None
+            for key, queue in self._queues[p].items():
+                if self._active_by_key.get(key, 0) >= self.per_user:
+                    continue
+                head = queue[0]
+                if best is None or (head.finish, head.seq) < (best.finish, best.seq):
+                    best = head
+            if best is not None:
+                return best
+        return None
+
+    def _dispatch(self):
+        while self._active < self.capacity:
+            waiter = self._next()
+            if waiter is None:
+                break
+            self._remove(waiter)
+            self._grant(waiter)
+            waiter.wake()
+        if len(self._last_finish[INTERACTIVE]) + len(self._last_finish[BACKGROUND]) > 4096:
+            # Keys whose tags the virtual clock passed carry no credit any more
+            for p in (INTERACTIVE, BACKGROUND):
+                for key in [k for k, f in self._last_finish[p].items() if f <= self._vtime[p]]:
+                    del self._last_finish[p][key]
+
+    def _grant(self, waiter: _Waiter):
+        waiter.granted = True
+        self._vtime[waiter.priority] = max(self._vtime[waiter.priority], waiter.start)
+        self._active += 1
+        self._active_by_key[waiter.key] = self._active_by_key.get(waiter.key, 0) + 1
+        if waiter.priority == BACKGROUND:
+            self._active_background += 1
+
+    def release(self, waiter: _Waiter):
+        with self._lock:
+            self._active -= 1
+            left = self._active_by_key.get(waiter.key, 1) - 1
+            if left > 0:
+                self._active_by_key[waiter.key] = left
+            else:
+                self._active_by_key.pop(waiter.key, None)
+            if waiter.priority == BACKGROUND:
+                self._active_background -= 1
+            self._dispatch()
+
+    def _submit(self, waiter: _Waiter, cost: float, weight: float):
+        with self._lock:
+            self._enqueue(waiter, cost, weight)
+            self._dispatch()
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """Drop a waiter that stopped waiting; False if it was granted meanwhile."""
+        with self._lock:
+            if waiter.granted:
+                return False
+            self._remove(waiter)
+            self._dispatch()
+            return True
+
+    def _timed_out(self, waiter: _Waiter):
+        metrics.incr("llm_wait_timeouts", label=PRIORITY_NAMES[waiter.priority])
+
+    def _record(self, waiter: _Waiter):
+        name = PRIORITY_NAMES[waiter.priority]
+        metrics.incr("llm_calls", label=name)
+        metrics.observe("llm_queue_wait_ms", (time.perf_counter() - waiter.enqueued_at) * 1000, label=name)
+
+    # -----------------------
+    # Acquire
+    # -----------------------
+    async def acquire(self, cost: float) -> _Waiter:
+        key, weight, priority = _principal.get()
+        waiter = _Waiter(key, priority)
+        waiter.loop = asyncio.get_running_loop()
+        waiter.future = waiter.loop.create_future()
+        self._submit(waiter, cost, weight)
+        if not waiter.granted:
+            timeout = _wait_timeout(priority)
+            try:
+                await asyncio.wait_for(waiter.future, timeout)
+            except asyncio.TimeoutError:
+                if self._abandon(waiter):
+                    self._timed_out(waiter)
+                    raise
+            except BaseException:
+                if not self._abandon(waiter):
+                    self.release(waiter)
+                raise
+        self._record(waiter)
+        return waiter
+
+    def acquire_sync(self, cost: float) -> _Waiter:
+        key, weight, priority = _principal.get()
+        waiter = _Waiter(key, priority)
+        waiter.event = threading.Event()
+        self._submit(waiter, cost, weight)
+        # Bounded for every priority: a thread stuck here cannot be cancelled
+        timeout = _wait_timeout(priority)
+        if not waiter.granted and not waiter.event.wait(timeout) and self._abandon(waiter):
+            self._timed_out(waiter)
+            raise TimeoutError(f"No LLM slot within {timeout:.1f}s for {PRIORITY_NAMES[priority]} work")
+        self._record(waiter)
+        return waiter
+
+
+# -----------------------
+# httpx transports
+# -----------------------
+class _ReleasingAsyncStream(httpx.AsyncByteStream):
+    """Response body that gives the slot back once it is read or closed (streamed completions)."""
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
+
+
+class _ReleasingSyncStream(httpx.SyncByteStream):
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._release()
+
+
+def _once(scheduler: FairScheduler, waiter: _Waiter):
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            scheduler.release(waiter)
+    return release
+
+
+def _cost(request: httpx.Request) -> float:
+    return max(len(request.content) // LLM_COST_BYTES, 1)
+
+
+class ScheduledAsyncTransport(httpx.AsyncBaseTransport):
+    def __init__(self):
+        self._inner = httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        scheduler = get_llm_scheduler()
+        release = _once(scheduler, await scheduler.acquire(_cost(request)))
+        try:
+            response = await self._inner.handle_async_request(request)
+        except BaseException:
+            release()
+            raise
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_ReleasingAsyncStream(response.stream, release),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self):
+        await self._inner.aclose()
+
+
+class ScheduledTransport(httpx.BaseTransport):
+    def __init__(self):
+        self._inner = httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        scheduler = get_llm_scheduler()
+        release = _once(scheduler, scheduler.acquire_sync(_cost(request)))
+        try:
+            response = self._inner.handle_request(request)
+        except BaseException:
+            release()
+            raise
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_ReleasingSyncStream(response.stream, release),
+            extensions=response.extensions,
+        )
+
+    def close(self):
+        self._inner.close()
+
+
+_transports: "weakref.WeakSet" = weakref.WeakSet()
+
+
+def scheduled_http_clients() -> Dict[str, Any]:
+    """http_client / http_async_client kwargs for ChatOpenAI with scheduled transports."""
+    sync_transport, async_transport = ScheduledTransport(), ScheduledAsyncTransport()
+    _transports.add(sync_transport)
+    _transports.add(async_transport)
+    return {
+        "http_client": httpx.Client(transport=sync_transport, timeout=httpx.Timeout(600, connect=10)),
+        "http_async_client": httpx.AsyncClient(transport=async_transport, timeout=httpx.Timeout(600, connect=10)),
+    }
+
+
+# -----------------------
+# Process-wide scheduler
+# -----------------------
+_scheduler: Optional[FairScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_llm_scheduler() -> FairScheduler:
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = FairScheduler()
+    return _scheduler
+
+
+def _reset_after_fork():
+    # A forked worker starts with empty queues and its own connection pools
+    global _scheduler, _scheduler_lock
+    _scheduler, _scheduler_lock = None, threading.Lock()
+    for transport in list(_transports):
+        if isinstance(transport, ScheduledAsyncTransport):
+            transport._inner = httpx.AsyncHTTPTransport()
+        else:
+            transport._inner = httpx.HTTPTransport()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,243 @@
+# location_hierarchy.py
+import os
+import time
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+from sqlalchemy import text
+
+from utils.mmap_store import save_arrays, load_arrays
+from utils.area_resolver import load_locations_dump
+
+LOCATION_HIERARCHY_PATH = os.getenv("LOCATION_HIERARCHY_PATH", ".cache/location_hierarchy.bin")
+LOCATION_HIERARCHY_TTL_S = float(os.getenv("LOCATION_HIERARCHY_TTL_S", "3600"))
+
+
+class LocationHierarchy:
+    """
+    The locations parent/child tree as an Euler-tour interval index.
+
+    Nodes are laid out in DFS pre-order, so the subtree of node i is the
+    contiguous slice order[tin[i]:tout[i]]:
+    - is_ancestor(a, d): tin[a] <= tin[d] < tout[a], O(1)
+    - descendants(id): one slice, O(size of the answer)
+    - rollup(values): subtree totals for every node from one prefix sum
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray], nodes: List[Dict[str, Any]]):
+        self.ids = np.asarray(arrays["ids"])          # (N,) location_id per node index
+        self.parent = np.asarray(arrays["parent"])    # (N,) parent node index, -1 for roots
+        self.depth = np.asarray(arrays["depth"])
+        self.tin = np.asarray(arrays["tin"])
+        self.tout = np.asarray(arrays["tout"])
+        self.order = np.asarray(arrays["order"])      # node index at each Euler position
+        self.nodes = nodes                            # name/slug/level per node index
+        self._index = {int(loc_id): i for i, loc_id in enumerate(self.ids.tolist())}
+
+    # -----------------------
+    # Build / persist
+    # -----------------------
+    @classmethod
+    def build(cls, rows: Iterable[Dict[str, Any]]) -> "LocationHierarchy":
+        rows = sorted(rows, key=lambda r: r["location_id"])
+        index = {r["location_id"]: i for i, r in enumerate(rows)}
+        n = len(rows)
+        parent = np.full(n, -1, dtype=np.int64)
+        children: List[List[int]] = [[] for _ in range(n)]
+        for i, r in enumerate(rows):
+            p = index.get(r.get("parent_id"))
+            if p is not None and p != i:
+                parent[i] = p
+                children[p].append(i)
+
+        tin = np.zeros(n, dtype=np.int64)
+        tout = np.zeros(n, dtype=np.int64)
+        depth = np.zeros(n, dtype=np.int64)
+        order = np.zeros(n, dtype=np.int64)
+        visited = np.zeros(n, dtype=bool)
+        pos = 0
+        # Iterative DFS; roots include nodes whose parent chain is a cycle
+        for root in [i for i in range(n) if parent[i] < 0] + list(range(n)):
+            if visited[root]:
+                continue
+            stack = [(root, False)]
+            while stack:
+                i, done = stack.pop()
+                if done:
+                    tout[i] = pos
+                    continue
+                if visited[i]:
+                    continue
+                visited[i] = True
+                tin[i] = pos
+                order[pos] = i
+                pos += 1
+                depth[i] = depth[parent[i]] + 1 if parent[i] >= 0 and visited[parent[i]] else 0
+                stack.append((i, True))
+                stack.extend((c, False) for c in reversed(children[i]))
+
+        arrays = {
+            "ids": np.asarray([r["location_id"] for r in rows], dtype=np.int64),
+            "parent": parent,
+            "depth": depth,
+            "tin": tin,
+            "tout": tout,
+            "order": order,
+        }
+        nodes = [{"name": r["name"], "slug": r.get("slug"), "level": r.get("level")} for r in rows]
+        return cls(arrays, nodes)
+
+    @classmethod
+    def from_db(cls, engine) -> "LocationHierarchy":
+        with engine.connect() as conn:
+            rows = conn.execute(text(
+                "SELECT location_id, name, slug, level, parent_location_id FROM locations"
+            )).fetchall()
+        return cls.build(
+            {"location_id": r[0], "name": r[1], "slug": r[2], "level": r[3], "parent_id": r[4]} for r in rows
+        )
+
+    def save(self, path: str = LOCATION_HIERARCHY_PATH):
+        save_arrays(
+            path,
+            {"ids": self.ids, "parent": self.parent, "depth": self.depth,
+             "tin": self.tin, "tout": self.tout, "order": self.order},
+            {"nodes": self.nodes},
+        )
+
+    @classmethod
+    def load(cls, path: str = LOCATION_HIERARCHY_PATH) -> "LocationHierarchy":
+        arrays, meta = load_arrays(path)
+        return cls(arrays, meta["nodes"])
+
+    # -----------------------
+    # Queries
+    # -----------------------
+    def __contains__(self, location_id: int) -> bool:
+        return location_id in self._index
+
+    def node(self, location_id: int) -> Dict[str, Any]:
+        i = self._index[location_id]
+        parent = int(self.parent[i])
+        return {
+            "location_id": location_id,
+            **self.nodes[i],
+            "depth": int(self.depth[i]),
+            "parent_id": int(self.ids[parent]) if parent >= 0 else None,
+            "descendant_count": int(self.tout[i] - self.tin[i] - 1),
+        }
+
+    def is_ancestor(self, ancestor_id: int, location_id: int) -> bool:
+        a, d = self._index[ancestor_id], self._index[location_id]
+        return bool(self.tin[a] <= self.tin[d] < self.tout[a])
+
+    def descendants(self, location_id: int, include_self: bool = True) -> List[int]:
+        i = self._index[location_id]
+        start = self.tin[i] if include_self else self.tin[i] + 1
+        return self.ids[self.order[start:self.tout[i]]].tolist()
+
+    def children(self, location_id: int) -> List[int]:
+        i = self._index[location_id]
+        sub = self.order[self.tin[i] + 1:self.tout[i]]
+        return self.ids[sub[self.parent[sub] == i]].tolist()
+
+    def ancestors(self, location_id: int) -> List[int]:
+        """
+        Root-first path above the node (O(depth), at most a few hops). Only
+        parents that enclose the node in the Euler tour are followed, so a
+        parent_location_id cycle stops where build() broke it.
+        """
+        path, i = [], self._index[location_id]
+        p = int(self.parent[i])
+        while p >= 0 and self.tin[p] < self.tin[i] < self.tout[p]:
+            path.append(int(self.ids[p]))
+            i, p = p, int(self.parent[p])
+        return path[::-1]
+
+    def rollup(self, values: Dict[int, float]) -> Dict[int, float]:
+        """
+        Subtree totals for every node, e.g. transaction counts per location
+        rolled up to communities, from a single prefix sum in Euler order.
+        """
+        by_position = np.zeros(len(self.ids) + 1, dtype=np.float64)
+        for loc_id, v in values.items():
+            i = self._index.get(int(loc_id))
+            if i is not None and v is not None:
+                by_position[self.tin[i] + 1] += float(v)
+        prefix = np.cumsum(by_position)
+        totals = prefix[self.tout] - prefix[self.tin]
+        return dict(zip(self.ids.tolist(), totals.tolist()))
+
+    def describe(self, location_id: int, max_children: int = 8) -> str:
+        """One-line placement of a location for prompts."""
+        path = " > ".join(self.nodes[self._index[a]]["name"] for a in self.ancestors(location_id))
+        node = self.node(location_id)
+        kids = [self.nodes[self._index[c]]["name"] for c in self.children(location_id)]
+        parts = [f"{node['name']} ({node['level']})"]
+        if path:
+            parts.append(f"within {path}")
+        if kids:
+            more = f" and {len(kids) - max_children} more" if len(kids) > max_children else ""
+            parts.append(f"contains {', '.join(kids[:max_children])}{more}")
+        if node["descendant_count"] > len(kids):
+            parts.append(f"{node['descendant_count']} sub-locations in total")
+        return "; ".join(parts)
+
+
+# -----------------------
+# Process-wide instance
+# -----------------------
+_hierarchy: Optional[LocationHierarchy] = None
+_loaded_at = 0.0
+_refreshing = False
+_hierarchy_lock = threading.Lock()
+
+
+def _reload(engine):
+    global _hierarchy, _loaded_at, _refreshing
+    snapshot_fresh = (
+        os.path.exists(LOCATION_HIERARCHY_PATH)
+        and time.time() - os.path.getmtime(LOCATION_HIERARCHY_PATH) < LOCATION_HIERARCHY_TTL_S
+    )
+    hierarchy = _hierarchy
+    try:
+        if snapshot_fresh:
+            hierarchy = LocationHierarchy.load(LOCATION_HIERARCHY_PATH)
+        else:
+            if engine is None:
+                raise RuntimeError("no engine")
+            hierarchy = LocationHierarchy.from_db(engine)
+            hierarchy.save(LOCATION_HIERARCHY_PATH)
+    except Exception as e:
+        print(f"Location hierarchy rebuild failed, using fallback: {e}")
+        if hierarchy is None:
+            if os.path.exists(LOCATION_HIERARCHY_PATH):
+                hierarchy = LocationHierarchy.load(LOCATION_HIERARCHY_PATH)
+            else:
+                hierarchy = LocationHierarchy.build(load_locations_dump())
+    _hierarchy, _loaded_at, _refreshing = hierarchy, time.monotonic(), False
+    print(f"🌳 Location hierarchy ready: {len(hierarchy.ids)} locations")
+
+
+def get_location_hierarchy(engine=None) -> LocationHierarchy:
+    """
+    Snapshot if younger than LOCATION_HIERARCHY_TTL_S, else rebuilt from the
+    DB (and re-saved). Falls back to a stale snapshot, then the locations.sql
+    dump. Only the first call loads inline: an expired hierarchy keeps
+    serving while a background thread rebuilds it.
+    """
+    global _refreshing
+    if _hierarchy is None:
+        with _hierarchy_lock:
+            if _hierarchy is None:
+                _refreshing = True
+                _reload(engine)
+        return _hierarchy
+    if time.monotonic() - _loaded_at >= LOCATION_HIERARCHY_TTL_S:
+        with _hierarchy_lock:
+            start = not _refreshing
+            _refreshing = True
+        if start:
+            threading.Thread(target=_reload, args=(engine,), name="location-hierarchy-refresh", daemon=True).start()
+    return _hierarchy
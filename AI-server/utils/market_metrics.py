@@ -0,0 +1,284 @@
+# market_metrics.py
+import os
+import time
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pyarrow as pa
+
+from utils.arrow_results import query_to_arrow
+
+MARKET_METRICS_TTL_S = float(os.getenv("MARKET_METRICS_TTL_S", "3600"))
+MARKET_METRICS_YEARS = int(os.getenv("MARKET_METRICS_YEARS", "5"))
+
+# Monthly sales and rents per area x property type x bedrooms, as sums and
+# counts so groups can be merged and windowed without re-reading rows. Same
+# sources and bedroom parsing as the dashboard's rent-to-price chart.
+MONTHLY_SERIES_SQL = """
+WITH sales AS (
+    SELECT DATE_TRUNC('month', instance_date)::DATE AS month, area_id, area_name_en,
+           'apartment'::TEXT AS property_type,
+           NULLIF(REGEXP_REPLACE(COALESCE(num_rooms_en,''), '[^0-9]', '', 'g'), '')::INT AS num_bedrooms,
+           COUNT(*) AS sales_count, SUM(actual_worth::float8) AS sales_sum
+    FROM transactions.appartements
+    WHERE instance_date >= DATE_TRUNC('month', CURRENT_DATE) - INTERVAL '{years} years'
+      AND actual_worth ~ '^[0-9]+(\\.[0-9]+)?$'
+    GROUP BY 1, 2, 3, 5
+    UNION ALL
+    SELECT DATE_TRUNC('month', instance_date)::DATE, area_id, area_name_en, 'villa'::TEXT,
+           NULLIF(REGEXP_REPLACE(COALESCE(num_rooms_en,''), '[^0-9]', '', 'g'), '')::INT,
+           COUNT(*), SUM(actual_worth::float8)
+    FROM transactions.villa
+    WHERE instance_date >= DATE_TRUNC('month', CURRENT_DATE) - INTERVAL '{years} years'
+      AND actual_worth ~ '^[0-9]+(\\.[0-9]+)?$'
+    GROUP BY 1, 2, 3, 5
+),
+rents AS (
+    SELECT DATE_TRUNC('month', contract_start_date)::DATE AS month, area_id,
+           'apartment'::TEXT AS property_type,
+           NULLIF(REGEXP_REPLACE(COALESCE(ejari_property_sub_type_en,''), '[^0-9]', '', 'g'), '')::INT AS num_bedrooms,
+           COUNT(*) AS rent_count, SUM(annual_amount::float8) AS rent_sum
+    FROM transactions.rents_apartements
+    WHERE contract_start_date >= DATE_TRUNC('month', CURRENT_DATE) - INTERVAL '{years} years'
+      AND annual_amount > 0
+      AND LOWER(COALESCE(ejari_property_sub_type_en,'')) NOT LIKE 'studio%'
+    GROUP BY 1, 2, 4
+    UNION ALL
+    SELECT DATE_TRUNC('month', contract_start_date)::DATE, area_id, 'villa'::TEXT,
+           NULLIF(REGEXP_REPLACE(COALESCE(ejari_property_sub_type_en,''), '[^0-9]', '', 'g'), '')::INT,
+           COUNT(*), SUM(annual_amount::float8)
+    FROM transactions.rents_villa
+    WHERE contract_start_date >= DATE_TRUNC('month', CURRENT_DATE) - INTERVAL '{years} years'
+      AND annual_amount > 0
+    GROUP BY 1, 2, 4
+)
+SELECT s.month, s.area_id, s.area_name_en, s.property_type, s.num_bedrooms,
+       s.sales_count, s.sales_sum, COALESCE(r.rent_count, 0) AS rent_count, COALESCE(r.rent_sum, 0) AS rent_sum
+FROM sales s
+LEFT JOIN rents r
+  ON r.month = s.month AND r.area_id = s.area_id AND r.property_type = s.property_type
+ AND COALESCE(r.num_bedrooms, -1) = COALESCE(s.num_bedrooms, -1)
+"""
+
+
+def bedroom_label(n: Optional[int]) -> str:
+    if n is None:
+        return "Unknown"
+    if n == 0:
+        return "Studio"
+    return f"{n}BR"
+
+
+def _round(v, digits: int = 2):
+    return None if v is None or not np.isfinite(v) else round(float(v), digits)
+
+
+# =========================
+# Engine
+# =========================
+class MarketMetrics:
+    """
+    Per (area, property type, bedrooms) market metrics from monthly series,
+    computed for every group at once with segment reductions over arrays
+    sorted by (group, month):
+
+    - rent-to-price summary: avg/min/max price-to-rent ratio, change %, trend
+    - gross_yield_pct: trailing-12-month rent / price
+    - yoy_change: trailing 12 months avg price vs the 12 before (fraction)
+    - volatility: std of monthly log price returns
+    - txn_volume: sales in the trailing 12 months
+    """
+
+    def __init__(self, series: pa.Table):
+        self.series = series
+        self.groups: List[Dict[str, Any]] = self._compute(series)
+        self._by_area: Dict[int, List[int]] = {}
+        for i, g in enumerate(self.groups):
+            self._by_area.setdefault(g["area_id"], []).append(i)
+
+    @staticmethod
+    def _compute(series: pa.Table) -> List[Dict[str, Any]]:
+        if series.num_rows == 0:
+            return []
+        cols = series.to_pydict()
+        months = np.array([m.year * 12 + m.month - 1 for m in cols["month"]], dtype=np.int64)
+        area = np.asarray(cols["area_id"], dtype=np.int64)
+        ptype = np.asarray(cols["property_type"], dtype=object)
+        beds = np.array([-1 if b is None else b for b in cols["num_bedrooms"]], dtype=np.int64)
+        sales_n = np.asarray(cols["sales_count"], dtype=np.float64)
+        sales_sum = np.asarray(cols["sales_sum"], dtype=np.float64)
+        rent_n = np.asarray(cols["rent_count"], dtype=np.float64)
+        rent_sum = np.asarray(cols["rent_sum"], dtype=np.float64)
+
+        # Group ids over (area, type, beds), rows sorted by (group, month)
+        _, ptype_code = np.unique(ptype.astype(str), return_inverse=True)
+        keys = np.stack([area, ptype_code, beds], axis=1)
+        _, gid = np.unique(keys, axis=0, return_inverse=True)
+        gid = gid.ravel()
+        order = np.lexsort((months, gid))
+        gid, months = gid[order], months[order]
+        sales_n, sales_sum, rent_n, rent_sum = sales_n[order], sales_sum[order], rent_n[order], rent_sum[order]
+        starts = np.flatnonzero(np.r_[True, gid[1:] != gid[:-1]])
+        ends = np.r_[starts[1:], len(gid)]
+        count = ends - starts
+
+        def seg_sum(x):
+            return np.add.reduceat(x, starts)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            price = sales_sum / sales_n
+            rent = np.where(rent_n > 0, rent_sum / rent_n, np.nan)
+            ratio = np.round(price / rent, 2)  # SQL rounds per month before summarizing
+
+            # Ratio summary (mirrors summarizeRentToPriceRatio)
+            valid = np.isfinite(ratio)
+            n_valid = seg_sum(valid.astype(np.float64))
+            avg_ratio = seg_sum(np.where(valid, ratio, 0)) / n_valid
+            min_ratio = np.minimum.reduceat(np.where(valid, ratio, np.inf), starts)
+            max_ratio = np.maximum.reduceat(np.where(valid, ratio, -np.inf), starts)
+            # First/last over months with rents: the backend inner-joins rents,
+            # so its series (and period) only has those months
+            pos = np.arange(len(ratio))
+            has_ratio = n_valid > 0
+            first_at = np.where(has_ratio, np.minimum.reduceat(np.where(valid, pos, len(ratio)), starts), starts)
+            last_at = np.where(has_ratio, np.maximum.reduceat(np.where(valid, pos, -1), starts), ends - 1)
+            first = np.where(has_ratio, ratio[first_at], np.nan)
+            last = np.where(has_ratio, ratio[last_at], np.nan)
+            change_pct = (last - first) / first * 100
+
+            # Trailing windows relative to each group's latest month
+            last_month = np.repeat(months[ends - 1], count)
+            recent = months > last_month - 12
+            prior = (months <= last_month - 12) & (months > last_month - 24)
+            recent_price = seg_sum(np.where(recent, sales_sum, 0)) / seg_sum(np.where(recent, sales_n, 0))
+            prior_price = seg_sum(np.where(prior, sales_sum, 0)) / seg_sum(np.where(prior, sales_n, 0))
+            yoy = recent_price / prior_price - 1
+            recent_rent = seg_sum(np.where(recent, rent_sum, 0)) / seg_sum(np.where(recent, rent_n, 0))
+            gross_yield = recent_rent / recent_price * 100
+            txn_volume = seg_sum(np.where(recent, sales_n, 0))
+
+            # Volatility: consecutive-month log returns within a group
+            step = np.r_[False, (gid[1:] == gid[:-1]) & (months[1:] == months[:-1] + 1)]
+            ret = np.zeros_like(price)
+            ret[1:] = np.log(price[1:] / price[:-1])
+            step &= np.isfinite(ret)
+            ret = np.where(step, ret, 0)
+            n_ret = seg_sum(step.astype(np.float64))
+            mean_ret = seg_sum(ret) / n_ret
+            var = seg_sum(ret ** 2) / n_ret - mean_ret ** 2
+            volatility = np.where(n_ret >= 2, np.sqrt(np.maximum(var, 0)), np.nan)
+
+        rep = order[starts]  # a source row per group for its labels
+        out = []
+        for g in range(len(starts)):
+            src = rep[g]
+            b = cols["num_bedrooms"][src]
+            f, l = first[g], last[g]
+            trend = None
+            if np.isfinite(f) and np.isfinite(l):
+                trend = "up" if l > f else "down" if l < f else "flat"
+            out.append({
+                "area_id": cols["area_id"][src],
+                "area": cols["area_name_en"][src],
+                "property_type": cols["property_type"][src],
+                "bedroom_label": bedroom_label(b),
+                "months": int(count[g]),
+                "period": f"{_month_label(months[first_at[g]])} → {_month_label(months[last_at[g]])}",
+                "avg_ratio": _round(avg_ratio[g]),
+                "min_ratio": _round(min_ratio[g]),
+                "max_ratio": _round(max_ratio[g]),
+                "change_pct": _round(change_pct[g]),
+                "trend": trend,
+                "gross_yield_pct": _round(gross_yield[g]),
+                "yoy_change": _round(yoy[g], 4),
+                "volatility": _round(volatility[g], 4),
+                "txn_volume": int(txn_volume[g]),
+                "avg_price_12m": _round(recent_price[g], 0),
+                "avg_rent_12m": _round(recent_rent[g], 0),
+            })
+        return out
+
+    # -----------------------
+    # Lookups
+    # -----------------------
+    def query(
+        self,
+        area_ids: Optional[List[int]] = None,
+        property_type: Optional[str] = None,
+        bedrooms: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        idx = (
+            [i for a in area_ids for i in self._by_area.get(a, ())] if area_ids is not None
+            else range(len(self.groups))
+        )
+        rows = [self.groups[i] for i in idx]
+        # "all" is how the dashboard spells no filter
+        property_type = None if str(property_type).lower() == "all" else property_type
+        bedrooms = None if str(bedrooms).lower() == "all" else bedrooms
+        if property_type:
+            rows = [g for g in rows if g["property_type"] == property_type.lower()]
+        if bedrooms:
+            rows = [g for g in rows if g["bedroom_label"].lower() == _normalize_bedrooms(bedrooms)]
+        return rows
+
+    def investment_inputs(self, area_ids: List[int], property_type: Optional[str] = None,
+                          bedrooms: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Metrics in the shape generate_investment_score reads (yield and
+        yoy_change as fractions), volume-weighted across matching groups.
+        """
+        rows = [g for g in self.query(area_ids, property_type, bedrooms) if g["txn_volume"]]
+        if not rows:
+            return {}
+        w = np.array([g["txn_volume"] for g in rows], dtype=np.float64)
+
+        def wavg(key, scale=1.0):
+            v = np.array([np.nan if g[key] is None else g[key] for g in rows], dtype=np.float64)
+            ok = np.isfinite(v)
+            return float(np.average(v[ok], weights=w[ok]) * scale) if ok.any() else None
+
+        return {
+            "yield": wavg("gross_yield_pct", 0.01),
+            "yoy_change": wavg("yoy_change"),
+            "volatility": wavg("volatility"),
+            "txn_volume": float(w.sum()),
+        }
+
+
+def _month_label(m: int) -> str:
+    return f"{m // 12:04d}-{m % 12 + 1:02d}"
+
+
+def _normalize_bedrooms(bedrooms: str) -> str:
+    b = str(bedrooms).strip().lower().replace(" ", "").replace("b/r", "br")
+    if b.isdigit():
+        return bedroom_label(int(b)).lower()
+    return b
+
+
+def load_monthly_series(engine) -> pa.Table:
+    table, _ = query_to_arrow(engine, MONTHLY_SERIES_SQL.format(years=MARKET_METRICS_YEARS), max_rows=None)
+    return table
+
+
+# -----------------------
+# Process-wide instance
+# -----------------------
+_metrics: Optional[MarketMetrics] = None
+_loaded_at = 0.0
+_metrics_lock = threading.Lock()
+
+
+def get_market_metrics(engine, loader: Callable[[Any], pa.Table] = load_monthly_series) -> MarketMetrics:
+    """Metrics for every group, recomputed from fresh series every MARKET_METRICS_TTL_S."""
+    global _metrics, _loaded_at
+    if _metrics is not None and time.monotonic() - _loaded_at < MARKET_METRICS_TTL_S:
+        return _metrics
+    with _metrics_lock:
+        if _metrics is None or time.monotonic() - _loaded_at >= MARKET_METRICS_TTL_S:
+            start = time.perf_counter()
+            _metrics = MarketMetrics(loader(engine))
+            _loaded_at = time.monotonic()
+            print(f"📈 Market metrics: {len(_metrics.groups)} groups in {time.perf_counter() - start:.2f}s")
+    return _metrics
@@ -0,0 +1,43 @@
+# metrics.py
+import threading
+from collections import defaultdict
+from typing import Any, Dict
+
+# In-process counters/summaries, exposed through GET /api/ai/metrics.
+# Keys are "<metric>|<label>" so one metric can be broken down per tool/user/etc.
+_lock = threading.Lock()
+_counters: Dict[str, float] = defaultdict(float)
+_summaries: Dict[str, Dict[str, float]] = {}
+
+
+def _key(name: str, label: str = "") -> str:
+    return f"{name}|{label}" if label else name
+
+
+def incr(name: str, value: float = 1, label: str = ""):
+    with _lock:
+        _counters[_key(name, label)] += value
+
+
+def observe(name: str, value: float, label: str = ""):
+    """Track count/sum/min/max of a value (latency, token counts, ...)."""
+    k = _key(name, label)
+    with _lock:
+        s = _summaries.get(k)
+        if s is None:
+            _summaries[k] = {"count": 1, "sum": value, "min": value, "max": value}
+        else:
+            s["count"] += 1
+            s["sum"] += value
+            s["min"] = min(s["min"], value)
+            s["max"] = max(s["max"], value)
+
+
+def snapshot() -> Dict[str, Any]:
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "summaries": {
+                k: {**v, "avg": v["sum"] / v["count"]} for k, v in _summaries.items()
+            },
+        }
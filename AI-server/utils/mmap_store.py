@@ -0,0 +1,80 @@
+# mmap_store.py
+import os
+import json
+import fcntl
+import struct
+from contextlib import contextmanager
+from typing import Any, Dict, Tuple
+
+import numpy as np
+
+# File layout: MAGIC | u64 header length | JSON header | padding | arrays...
+# Each array starts on a 64-byte boundary so it can be memory-mapped in place.
+MAGIC = b"AIRMMAP1"
+ALIGN = 64
+
+
+def _align(n: int) -> int:
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+@contextmanager
+def file_lock(path: str):
+    """
+    Exclusive lock on `path`.lock across processes (and threads), for files
+    that every worker of a deployment maintains in a shared cache directory.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(f"{path}.lock", "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def save_arrays(path: str, arrays: Dict[str, np.ndarray], meta: Dict[str, Any] = None):
+    """Write named arrays + JSON metadata into one memory-mappable file (atomic)."""
+    arrays = {k: np.ascontiguousarray(v) for k, v in arrays.items()}
+
+    # Header size depends on the offsets it contains; offsets are relative to
+    # the data section so one pass is enough.
+    layout, offset = {}, 0
+    for name, arr in arrays.items():
+        layout[name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset}
+        offset = _align(offset + arr.nbytes)
+    header = json.dumps({"arrays": layout, "meta": meta or {}}).encode("utf-8")
+    data_start = _align(len(MAGIC) + 8 + len(header))
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for name, arr in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(arr.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp, path)
+
+
+def load_arrays(path: str) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    """Memory-map every array in a file written by save_arrays (read-only)."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an mmap_store file")
+        (header_len,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_len))
+    data_start = _align(len(MAGIC) + 8 + header_len)
+
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        shape = tuple(spec["shape"])
+        if int(np.prod(shape)) == 0:
+            arrays[name] = np.zeros(shape, dtype=spec["dtype"])
+            continue
+        arrays[name] = np.memmap(
+            path, dtype=spec["dtype"], mode="r", offset=data_start + spec["offset"], shape=shape
+        )
+    return arrays, header["meta"]
@@ -0,0 +1,298 @@
+# monthly_rollups.py
+import os
+import bisect
+import datetime
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from utils.mmap_store import save_arrays, load_arrays, file_lock
+from utils.tx_snapshot import TransactionsSnapshot, get_tx_snapshot
+from utils.tx_analytics import property_type_label
+
+MONTHLY_ROLLUPS_PATH = os.getenv("MONTHLY_ROLLUPS_PATH", ".cache/monthly_rollups.bin")
+
+# Additive per-cell values; means/stddevs are derived at read time
+VALUE_FIELDS = ("count", "worth_sum", "psm_count", "psm_sum", "psm_sumsq", "rent_count", "rent_sum")
+Key = Tuple[int, str, str]  # (area_id, property_type, rooms)
+
+
+def _month_index(d: datetime.date) -> int:
+    return d.year * 12 + d.month - 1
+
+
+def _month_label(m: int) -> str:
+    return f"{m // 12:04d}-{m % 12 + 1:02d}"
+
+
+class MonthlyRollups:
+    """
+    Monthly aggregates per area x property type x rooms, maintained
+    incrementally from the transactions snapshot.
+
+    Snapshot refreshes re-read the watermark day, so the contribution of the
+    rows on that day is kept aside (the "tail") and subtracted before the
+    next fold: folding stays exact without ever re-aggregating history.
+    """
+
+    def __init__(self):
+        # key -> sorted month indexes, and (key, month) -> value vector
+        self.months: Dict[Key, List[int]] = {}
+        self.cells: Dict[Tuple[Key, int], np.ndarray] = {}
+        self.by_area: Dict[int, List[Key]] = {}
+        self.tail: List[Tuple[Key, int, List[float]]] = []
+        self.watermark: Optional[datetime.date] = None
+        self.source_refreshed_at = 0.0
+
+    # -----------------------
+    # Folding
+    # -----------------------
+    def _add(self, key: Key, month: int, values: np.ndarray):
+        cell = self.cells.get((key, month))
+        if cell is None:
+            if key not in self.months:
+                self.months[key] = []
+                self.by_area.setdefault(key[0], []).append(key)
+            bisect.insort(self.months[key], month)
+            self.cells[(key, month)] = values.astype(np.float64).copy()
+        else:
+            cell += values
+
+    @staticmethod
+    def _aggregate(t: pa.Table) -> List[Tuple[Key, int, np.ndarray]]:
+        """One hash-aggregate pass over labelled rows -> (key, month, values)."""
+        if t.num_rows == 0:
+            return []
+        d = t["instance_date"]
+        psm = t["meter_sale_price"]
+        keyed = pa.table({
+            "area_id": pc.fill_null(t["area_id"], -1),
+            "property_type": pc.fill_null(t["property_type"], ""),
+            "rooms": pc.fill_null(t["rooms"], ""),
+            "month": pc.add(pc.multiply(pc.year(d), 12), pc.subtract(pc.month(d), 1)),
+            "actual_worth": t["actual_worth"],
+            "psm": psm,
+            "psm_sq": pc.multiply(psm, psm),
+            "rent": t["rent_value"],
+        })
+        agg = keyed.group_by(["area_id", "property_type", "rooms", "month"]).aggregate([
+            ([], "count_all"),
+            ("actual_worth", "sum"),
+            ("psm", "count"),
+            ("psm", "sum"),
+            ("psm_sq", "sum"),
+            ("rent", "count"),
+            ("rent", "sum"),
+        ])
+        values = np.column_stack([
+            pc.fill_null(agg[c], 0).to_numpy().astype(np.float64)
+            for c in ("count_all", "actual_worth_sum", "psm_count", "psm_sum", "psm_sq_sum", "rent_count", "rent_sum")
+        ])
+        keys = zip(agg["area_id"].to_pylist(), agg["property_type"].to_pylist(),
+                   agg["rooms"].to_pylist(), agg["month"].to_pylist())
+        return [((a, p, r), m, values[i]) for i, (a, p, r, m) in enumerate(keys)]
+
+    def fold(self, rows: pa.Table):
+        """
+        Fold labelled rows with instance_date >= watermark (instance_date,
+        area_id, property_type, rooms, actual_worth, meter_sale_price, rent_value).
+        """
+        for key, month, values in self.tail:
+            self._add(key, month, -np.asarray(values))
+        self.tail = []
+        if rows.num_rows == 0:
+            return
+
+        for key, month, values in self._aggregate(rows):
+            self._add(key, month, values)
+
+        latest = pc.max(rows["instance_date"]).as_py()
+        last_day = rows.filter(pc.equal(rows["instance_date"], pa.scalar(latest, pa.date32())))
+        self.tail = [(k, m, v.tolist()) for k, m, v in self._aggregate(last_day)]
+        self.watermark = latest
+
+    def catch_up(self, snapshot: TransactionsSnapshot) -> int:
+        """Fold snapshot rows since the watermark if the snapshot changed. Returns rows folded."""
+        refreshed_at = snapshot.manifest.get("refreshed_at", 0)
+        if snapshot.is_empty or refreshed_at <= self.source_refreshed_at:
+            return 0
+        fact = snapshot.fact
+        if self.watermark is not None:
+            fact = fact.filter(pc.greater_equal(fact["instance_date"], pa.scalar(self.watermark, pa.date32())))
+        rows = fact.select(["instance_date", "area_id", "actual_worth", "meter_sale_price", "rent_value"])
+        rows = rows.append_column("property_type", property_type_label(snapshot, fact))
+        rows = rows.append_column("rooms", fact["num_rooms_en"])
+        self.fold(rows)
+        self.source_refreshed_at = refreshed_at
+        return rows.num_rows
+
+    def copy(self) -> "MonthlyRollups":
+        """Independent copy to fold into while this one keeps serving reads."""
+        r = MonthlyRollups()
+        r.months = {k: list(v) for k, v in self.months.items()}
+        r.cells = {k: v.copy() for k, v in self.cells.items()}
+        r.by_area = {k: list(v) for k, v in self.by_area.items()}
+        r.tail = list(self.tail)
+        r.watermark, r.source_refreshed_at = self.watermark, self.source_refreshed_at
+        return r
+
+    # -----------------------
+    # Reads
+    # -----------------------
+    def _keys(self, area_ids: Iterable[int], property_type: Optional[str], rooms: Optional[str]) -> List[Key]:
+        keys = [k for a in area_ids for k in self.by_area.get(a, ())]
+        if property_type and property_type.lower() != "all":
+            keys = [k for k in keys if k[1].lower() == property_type.lower()]
+        if rooms and rooms.lower() != "all":
+            keys = [k for k in keys if k[2].lower() == rooms.lower()]
+        return keys
+
+    def series(
+        self,
+        area_ids: Iterable[int],
+        property_type: Optional[str] = None,
+        rooms: Optional[str] = None,
+        period: str = "month",
+    ) -> List[Dict[str, Any]]:
+        """
+        Summed series over the matching keys, one row per month (or year),
+        in O(total series length); no database access.
+        """
+        totals: Dict[int, np.ndarray] = {}
+        for key in self._keys(area_ids, property_type, rooms):
+            for m in self.months[key]:
+                bucket = m // 12 if period == "year" else m
+                v = self.cells[(key, m)]
+                if bucket in totals:
+                    totals[bucket] = totals[bucket] + v
+                else:
+                    totals[bucket] = v.copy()
+
+        out = []
+        for bucket in sorted(totals):
+            count, worth, psm_n, psm_sum, psm_sq, rent_n, rent_sum = totals[bucket]
+            if count <= 0:
+                continue
+            mean_psm = psm_sum / psm_n if psm_n else None
+            std_psm = float(np.sqrt(max(psm_sq / psm_n - mean_psm ** 2, 0))) if psm_n else None
+            out.append({
+                "period": str(bucket) if period == "year" else _month_label(bucket),
+                "transactions": int(count),
+                "sales_volume": round(float(worth), 2),
+                "avg_price": round(float(worth / count), 2),
+                "avg_meter_sale_price": round(float(mean_psm), 2) if mean_psm is not None else None,
+                "std_meter_sale_price": round(std_psm, 2) if std_psm is not None else None,
+                "avg_rent": round(float(rent_sum / rent_n), 2) if rent_n else None,
+            })
+        return out
+
+    # -----------------------
+    # Persist
+    # -----------------------
+    def save(self, path: str = MONTHLY_ROLLUPS_PATH):
+        keys = list(self.months)
+        types = sorted({k[1] for k in keys})
+        rooms = sorted({k[2] for k in keys})
+        type_code = {t: i for i, t in enumerate(types)}
+        room_code = {r: i for i, r in enumerate(rooms)}
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(self.months[k]) for k in keys])
+        months = np.fromiter((m for k in keys for m in self.months[k]), dtype=np.int64, count=int(offsets[-1]))
+        values = (
+            np.vstack([self.cells[(k, m)] for k in keys for m in self.months[k]])
+            if keys else np.zeros((0, len(VALUE_FIELDS)))
+        )
+        save_arrays(
+            path,
+            {
+                "key_area": np.asarray([k[0] for k in keys], dtype=np.int64),
+                "key_type": np.asarray([type_code[k[1]] for k in keys], dtype=np.int32),
+                "key_rooms": np.asarray([room_code[k[2]] for k in keys], dtype=np.int32),
+                "offsets": offsets,
+                "months": months,
+                "values": values,
+            },
+            {
+                "types": types,
+                "rooms": rooms,
+                "fields": list(VALUE_FIELDS),
+                "tail": [[list(k), m, v] for k, m, v in self.tail],
+                "watermark": self.watermark.isoformat() if self.watermark else None,
+                "source_refreshed_at": self.source_refreshed_at,
+            },
+        )
+
+    @classmethod
+    def load(cls, path: str = MONTHLY_ROLLUPS_PATH) -> "MonthlyRollups":
+        arrays, meta = load_arrays(path)
+        r = cls()
+        offsets, months, values = arrays["offsets"], np.asarray(arrays["months"]), np.asarray(arrays["values"])
+        for i, (a, t, rm) in enumerate(zip(arrays["key_area"].tolist(), arrays["key_type"].tolist(), arrays["key_rooms"].tolist())):
+            key = (a, meta["types"][t], meta["rooms"][rm])
+            lo, hi = int(offsets[i]), int(offsets[i + 1])
+            r.months[key] = months[lo:hi].tolist()
+            r.by_area.setdefault(a, []).append(key)
+            for j in range(lo, hi):
+                r.cells[(key, int(months[j]))] = values[j].astype(np.float64)
+        r.tail = [((k[0], k[1], k[2]), m, v) for k, m, v in meta["tail"]]
+        r.watermark = datetime.date.fromisoformat(meta["watermark"]) if meta["watermark"] else None
+        r.source_refreshed_at = meta["source_refreshed_at"]
+        return r
+
+
+# -----------------------
+# Process-wide instance
+# -----------------------
+_rollups: Optional[MonthlyRollups] = None
+_refreshing = False
+_rollups_lock = threading.Lock()
+
+
+def _catch_up(snapshot: TransactionsSnapshot):
+    """
+    Fold the snapshot into the rollups and save them, under a file lock
+    shared by the workers; starts from the saved file when another worker
+    already folded further than this one.
+    """
+    global _rollups, _refreshing
+    try:
+        with file_lock(MONTHLY_ROLLUPS_PATH):
+            rollups = _rollups
+            if os.path.exists(MONTHLY_ROLLUPS_PATH):
+                _, meta = load_arrays(MONTHLY_ROLLUPS_PATH)
+                if rollups is None or meta["source_refreshed_at"] > rollups.source_refreshed_at:
+                    rollups = MonthlyRollups.load(MONTHLY_ROLLUPS_PATH)
+            if rollups is None:
+                rollups = MonthlyRollups()
+            elif rollups is _rollups:
+                rollups = rollups.copy()
+            folded = rollups.catch_up(snapshot)
+            if folded:
+                rollups.save(MONTHLY_ROLLUPS_PATH)
+                print(f"🧮 Monthly rollups: folded {folded} rows, watermark {rollups.watermark}")
+        _rollups = rollups
+    except Exception as e:
+        print(f"❌ Monthly rollups catch-up failed: {e}")
+    finally:
+        _refreshing = False
+
+
+def get_monthly_rollups(engine=None) -> Optional[MonthlyRollups]:
+    """
+    Persisted rollups, caught up with the transactions snapshot in a
+    background thread. None until the first load (or cold build from the
+    whole history) is done; callers answer from the request's own data.
+    """
+    global _refreshing
+    snapshot = get_tx_snapshot(engine)
+    with _rollups_lock:
+        behind = _rollups is None or _rollups.source_refreshed_at < snapshot.manifest.get("refreshed_at", 0)
+        start = behind and not _refreshing
+        if start:
+            _refreshing = True
+    if start:
+        threading.Thread(target=_catch_up, args=(snapshot,), name="monthly-rollups-catch-up", daemon=True).start()
+    return _rollups
@@ -0,0 +1,294 @@
+# retrieval_cache.py
+import os
+import time
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import uuid
+from array import array
+from collections import OrderedDict
+from typing import Any, List, Optional
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+from utils.shared_store import SqliteStore, get_shared_store
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", ".cache/embeddings.sqlite")
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "5000"))
+# Rows kept in the SQLite store; the oldest are trimmed every EMBEDDING_CACHE_TRIM_EVERY writes
+EMBEDDING_CACHE_MAX_ROWS = int(os.getenv("EMBEDDING_CACHE_MAX_ROWS", "100000"))
+EMBEDDING_CACHE_TRIM_EVERY = int(os.getenv("EMBEDDING_CACHE_TRIM_EVERY", "500"))
+RETRIEVAL_CACHE_TTL = int(os.getenv("RETRIEVAL_CACHE_TTL", "900"))  # seconds
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "2000"))
+# How often to check whether the collection changed under us (point count + version marker)
+COLLECTION_CHECK_INTERVAL = int(os.getenv("RAG_COLLECTION_CHECK_S", "60"))
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+_local_version_store: Optional[SqliteStore] = None
+_VERSION_TTL_S = 10 * 365 * 24 * 3600
+
+
+def _version_store():
+    # The ingestion CLI runs in its own process, so the marker needs a store
+    # even where the server keeps its caches in memory: sqlite is the stand-in
+    global _local_version_store
+    store = get_shared_store()
+    if store is not None:
+        return store
+    if _local_version_store is None:
+        _local_version_store = SqliteStore()
+    return _local_version_store
+
+
+def bump_collection_version(collection_name: str):
+    """Record a write to the collection (ingestion, add_documents) for every worker's caches."""
+    try:
+        _version_store().set(f"collection_version:{collection_name}", uuid.uuid4().hex, _VERSION_TTL_S)
+    except Exception as e:
+        print(f"Collection version bump failed: {e}")
+
+
+def collection_version(client, collection_name: str) -> str:
+    """
+    Cheap change signal for a collection: its point count plus the marker
+    writers bump, so an edit that keeps the count is still seen. Two small
+    reads, whatever the size of the corpus.
+    """
+    entry = _version_store().get(f"collection_version:{collection_name}")
+    count = client.get_collection(collection_name).points_count
+    return f"{count}:{entry[1] if entry else ''}"
+
+
+# =========================
+# Level 1: query embeddings
+# =========================
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an Embeddings backend with an in-memory LRU in front of a SQLite
+    store, keyed by model name + normalized text. Only queries are cached;
+    documents are embedded once at ingestion anyway.
+    """
+
+    def __init__(self, underlying: Embeddings, model_name: str, path: Optional[str] = EMBEDDING_CACHE_PATH, size: int = EMBEDDING_CACHE_SIZE):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.size = size
+        self._lru: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._writes = 0
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vec BLOB)")
+            self._db.commit()
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha1(f"{self.model_name}|{_normalize(text)}".encode("utf-8")).hexdigest()
+
+    def _get_memory(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            vec = self._lru.get(key)
+            if vec is not None:
+                self._lru.move_to_end(key)
+            return vec
+
+    def _get_stored(self, key: str) -> Optional[List[float]]:
+        if self._db is None:
+            return None
+        with self._lock:
+            row = self._db.execute("SELECT vec FROM embeddings WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        vec = array("f", row[0]).tolist()
+        self._remember(key, vec)
+        return vec
+
+    def _get(self, key: str) -> Optional[List[float]]:
+        vec = self._get_memory(key)
+        return vec if vec is not None else self._get_stored(key)
+
+    def _remember(self, key: str, vec: List[float]):
+        with self._lock:
+            self._lru[key] = vec
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.size:
+                self._lru.popitem(last=False)
+
+    def _write(self, key: str, vec: List[float]):
+        if self._db is None:
+            return
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO embeddings (key, vec) VALUES (?, ?)",
+                (key, array("f", vec).tobytes()),
+            )
+            self._writes += 1
+            if self._writes % EMBEDDING_CACHE_TRIM_EVERY == 0:
+                # Rowids grow with each insert/replace: drop the oldest rows
+                self._db.execute(
+                    "DELETE FROM embeddings WHERE rowid <= (SELECT MAX(rowid) FROM embeddings) - ?",
+                    (EMBEDDING_CACHE_MAX_ROWS,),
+                )
+            self._db.commit()
+
+    def _put(self, key: str, vec: List[float]):
+        self._remember(key, vec)
+        self._write(key, vec)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.underlying.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.underlying.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        vec = self._get(key)
+        if vec is None:
+            vec = self.underlying.embed_query(text)
+            self._put(key, vec)
+        return vec
+
+    async def aembed_query(self, text: str) -> List[float]:
+        # LRU hits stay on the loop; SQLite reads and writes go to a thread
+        key = self._key(text)
+        vec = self._get_memory(key)
+        if vec is None:
+            vec = await asyncio.to_thread(self._get_stored, key)
+        if vec is None:
+            vec = await self.underlying.aembed_query(text)
+            self._remember(key, vec)
+            await asyncio.to_thread(self._write, key, vec)
+        return vec
+
+
+# =========================
+# Level 2: retrieval results
+# =========================
+class CachedRetriever(BaseRetriever):
+    """
+    Drop-in for vectorstore.as_retriever(search_type="similarity_score_threshold").
+    Results are cached by a hash of the query embedding for RETRIEVAL_CACHE_TTL
+    and dropped whenever the collection's version changes.
+    """
+
+    vectorstore: Any
+    embeddings: Any
+    k: int = 3
+    score_threshold: float = 0.5
+    ttl: int = RETRIEVAL_CACHE_TTL
+    max_entries: int = RETRIEVAL_CACHE_SIZE
+
+    _cache: "OrderedDict[str, tuple]"
+    _lock: Any
+    _version: Optional[str]
+    _checked_at: float
+
+    def model_post_init(self, __context: Any) -> None:
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0.0
+
+    # -----------------------
+    # Invalidation
+    # -----------------------
+    def invalidate(self):
+        with self._lock:
+            self._cache.clear()
+        print("🧹 Retrieval cache invalidated")
+
+    def add_documents(self, documents: List[Document], **kwargs) -> List[str]:
+        ids = self.vectorstore.add_documents(documents, **kwargs)
+        bump_collection_version(self.vectorstore.collection_name)
+        self.invalidate()
+        return ids
+
+    def _check_due(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked_at < COLLECTION_CHECK_INTERVAL:
+                return False
+            self._checked_at = now
+            return True
+
+    def _check_collection(self):
+        """Catch writes made by other processes (e.g. the ingestion CLI)."""
+        try:
+            # A local index (utils.vector_index) may lag Qdrant: track what it serves
+            version = getattr(self.vectorstore, "version", None) or collection_version(
+                self.vectorstore.client, self.vectorstore.collection_name
+            )
+        except Exception as e:
+            print(f"Collection check failed: {e}")
+            return
+        if self._version is not None and version != self._version:
+            self.invalidate()
+        self._version = version
+
+    # -----------------------
+    # Cache lookups
+    # -----------------------
+    def _key(self, vec: List[float]) -> str:
+        raw = array("f", vec).tobytes() + f"|{self.k}|{self.score_threshold}".encode()
+        return hashlib.sha1(raw).hexdigest()
+
+    def _lookup(self, key: str) -> Optional[List[Document]]:
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            expires_at, docs = entry
+            if expires_at <= time.monotonic():
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return docs
+
+    def _store(self, key: str, docs: List[Document]):
+        with self._lock:
+            self._cache[key] = (time.monotonic() + self.ttl, docs)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        if self._check_due():
+            # Off the request path, like the async variant
+            threading.Thread(target=self._check_collection, name="retrieval-cache-check", daemon=True).start()
+        vec = self.embeddings.embed_query(query)
+        key = self._key(vec)
+        docs = self._lookup(key)
+        if docs is None:
+            hits = self.vectorstore.similarity_search_with_score_by_vector(
+                vec, k=self.k, score_threshold=self.score_threshold
+            )
+            docs = [doc for doc, _ in hits]
+            self._store(key, docs)
+        return docs
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        if self._check_due():
+            # Sync client call: runs in a thread while this query is served
+            asyncio.get_running_loop().run_in_executor(None, self._check_collection)
+        vec = await self.embeddings.aembed_query(query)
+        key = self._key(vec)
+        docs = self._lookup(key)
+        if docs is None:
+            hits = await self.vectorstore.asimilarity_search_with_score_by_vector(
+                vec, k=self.k, score_threshold=self.score_threshold
+            )
+            docs = [doc for doc, _ in hits]
+            self._store(key, docs)
+        return docs
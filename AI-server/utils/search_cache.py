@@ -0,0 +1,271 @@
+# search_cache.py
+import os
+import json
+import time
+import hashlib
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from utils import metrics
+from utils.shared_store import get_shared_store
+
+SEARCH_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH", ".cache/search_cache.json")
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", str(6 * 60 * 60)))  # seconds
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "2000"))
+# Writes within this window are persisted together, off the request path
+SEARCH_CACHE_PERSIST_DELAY_S = float(os.getenv("SEARCH_CACHE_PERSIST_DELAY_S", "5"))
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(str(query).lower().split())
+
+
+def make_key(kind: str, query: str, depth: str, max_results: int) -> str:
+    raw = f"{kind}|{normalize_query(query)}|{depth}|{max_results}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class SearchCache:
+    """
+    TTL cache for web/image search responses, persisted to a JSON file so it
+    survives restarts. Concurrent lookups for the same key share a single
+    upstream call instead of each hitting Tavily.
+
+    With a shared `store` (utils.shared_store) the in-memory entries sit in
+    front of it: workers see each other's results, and the store replaces
+    the JSON file, which concurrent workers would overwrite.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = SEARCH_CACHE_PATH,
+        max_entries: int = SEARCH_CACHE_MAX_ENTRIES,
+        store=None,
+    ):
+        self.store = store
+        self.path = path if store is None else None
+        self.max_entries = max_entries
+        self._entries: Dict[str, Tuple[float, Any]] = {}
+        self._inflight: Dict[str, Future] = {}
+        self._ainflight: Dict[str, asyncio.Task] = {}
+        self._awaiters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._persist_lock = threading.Lock()
+        self._persist_timer: Optional[threading.Timer] = None
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    # -----------------------
+    # Persistence
+    # -----------------------
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+            now = time.time()
+            self._entries = {
+                k: (exp, val) for k, (exp, val) in raw.items() if exp > now
+            }
+            print(f"🗄️ Search cache loaded {len(self._entries)} entries from {self.path}")
+        except Exception as e:
+            print(f"Search cache load failed: {e}")
+            self._entries = {}
+
+    def _persist(self, entries: Dict[str, Tuple[float, Any]]):
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(entries, f)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            print(f"Search cache persist failed: {e}")
+
+    def _schedule_persist(self):
+        """Write the file once per SEARCH_CACHE_PERSIST_DELAY_S from a timer thread."""
+        if not self.path:
+            return
+        with self._lock:
+            if self._persist_timer is not None:
+                return
+            timer = threading.Timer(SEARCH_CACHE_PERSIST_DELAY_S, self.flush)
+            timer.daemon = True
+            self._persist_timer = timer
+        timer.start()
+
+    def flush(self):
+        """Persist pending writes now (also called on shutdown)."""
+        if not self.path:
+            return
+        with self._lock:
+            if self._persist_timer is not None:
+                self._persist_timer.cancel()
+                self._persist_timer = None
+            entries = dict(self._entries)
+        with self._persist_lock:
+            self._persist(entries)
+
+    # -----------------------
+    # Lookup / store
+    # -----------------------
+    def _get_memory(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.time():
+                    return value
+                del self._entries[key]
+        return None
+
+    def _get_stored(self, key: str) -> Optional[Any]:
+        if self.store is None:
+            return None
+        try:
+            entry = self.store.get(f"search:{key}")
+        except Exception as e:
+            print(f"Shared search cache read failed: {e}")
+            return None
+        if entry is None:
+            return None
+        metrics.incr("search_cache_shared_hits")
+        self._remember(key, *entry)
+        return entry[1]
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self._get_memory(key)
+        return value if value is not None else self._get_stored(key)
+
+    async def aget(self, key: str) -> Optional[Any]:
+        # Memory hits stay on the loop; the shared store (sqlite/redis) is blocking I/O
+        value = self._get_memory(key)
+        if value is None and self.store is not None:
+            value = await asyncio.to_thread(self._get_stored, key)
+        return value
+
+    def _remember(self, key: str, expires_at: float, value: Any):
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            if len(self._entries) > self.max_entries:
+                # Drop the entries closest to expiry first
+                overflow = len(self._entries) - self.max_entries
+                for k, _ in sorted(self._entries.items(), key=lambda kv: kv[1][0])[:overflow]:
+                    del self._entries[k]
+
+    def _write(self, key: str, value: Any, ttl: int):
+        if self.store is None:
+            return
+        try:
+            self.store.set(f"search:{key}", value, ttl)
+        except Exception as e:
+            print(f"Shared search cache write failed: {e}")
+
+    def set(self, key: str, value: Any, ttl: int = SEARCH_CACHE_TTL):
+        self._write(key, value, ttl)
+        self._remember(key, time.time() + ttl, value)
+        self._schedule_persist()
+
+    async def aset(self, key: str, value: Any, ttl: int = SEARCH_CACHE_TTL):
+        self._remember(key, time.time() + ttl, value)
+        self._schedule_persist()
+        if self.store is not None:
+            await asyncio.to_thread(self._write, key, value, ttl)
+
+    def get_or_fetch(self, key: str, fetch: Callable[[], Any], ttl: int = SEARCH_CACHE_TTL) -> Any:
+        """
+        Return the cached value, or call `fetch` once for all concurrent
+        callers of the same key. Exceptions are propagated and not cached.
+        """
+        cached = self.get(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        with self._lock:
+            pending = self._inflight.get(key)
+            owner = pending is None
+            if owner:
+                pending = Future()
+                self._inflight[key] = pending
+
+        if not owner:
+            self.hits += 1
+            return pending.result()
+
+        self.misses += 1
+        try:
+            value = fetch()
+        except BaseException as e:
+            pending.set_exception(e)
+            raise
+        else:
+            self.set(key, value, ttl)
+            pending.set_result(value)
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    async def aget_or_fetch(
+        self, key: str, fetch: Callable[[], Awaitable[Any]], ttl: int = SEARCH_CACHE_TTL
+    ) -> Any:
+        """Async counterpart of get_or_fetch; concurrent awaiters share one task."""
+        cached = await self.aget(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        task = self._ainflight.get(key)
+        if task is not None:
+            self.hits += 1
+            return await self._await_shared(key, task)
+
+        self.misses += 1
+
+        async def _run():
+            try:
+                value = await fetch()
+                await self.aset(key, value, ttl)
+                return value
+            finally:
+                self._ainflight.pop(key, None)
+
+        task = asyncio.ensure_future(_run())
+        # If every awaiter is cancelled nobody reads the outcome
+        task.add_done_callback(_consume_result)
+        self._ainflight[key] = task
+        return await self._await_shared(key, task)
+
+    async def _await_shared(self, key: str, task: asyncio.Task) -> Any:
+        """
+        Await the shared fetch without letting one cancelled awaiter cancel it
+        for the others; once the last awaiter is gone the upstream call is
+        cancelled too (closing its HTTP request) instead of running on.
+        """
+        self._awaiters[key] = self._awaiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._awaiters.get(key, 0) <= 1 and not task.done():
+                task.cancel()
+                metrics.incr("search_fetch_cancelled")
+            raise
+        finally:
+            left = self._awaiters.get(key, 1) - 1
+            if left > 0:
+                self._awaiters[key] = left
+            else:
+                self._awaiters.pop(key, None)
+
+
+def _consume_result(task: asyncio.Task):
+    if not task.cancelled():
+        task.exception()
+
+
+search_cache = SearchCache(store=get_shared_store())
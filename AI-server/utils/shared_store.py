@@ -0,0 +1,127 @@
+# shared_store.py
+"""
+Key/value store shared by the worker processes of a deployment, for caches
+that should be filled once rather than once per worker. Chosen with
+SHARED_STORE_BACKEND:
+- redis: REDIS_URL, shared across boxes
+- sqlite: SHARED_STORE_SQLITE_PATH, shared by the workers of one box (the
+  local stand-in for redis)
+- memory: no shared store, each process keeps its own caches
+The default is redis with REDIS_URL set, sqlite when WEB_CONCURRENCY > 1,
+memory otherwise; without the redis package, redis falls back to sqlite. Values are JSON; every entry has an expiry.
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Any, Optional, Tuple
+
+SHARED_STORE_SQLITE_PATH = os.getenv("SHARED_STORE_SQLITE_PATH", ".cache/shared_store.sqlite")
+# Expired rows are purged every this many writes (sqlite)
+SHARED_STORE_PURGE_EVERY = int(os.getenv("SHARED_STORE_PURGE_EVERY", "500"))
+
+
+def shared_store_backend() -> str:
+    backend = os.getenv("SHARED_STORE_BACKEND")
+    if backend:
+        return backend
+    if os.getenv("REDIS_URL"):
+        return "redis"
+    return "sqlite" if int(os.getenv("WEB_CONCURRENCY", "1")) > 1 else "memory"
+
+
+class SqliteStore:
+    """One WAL database file; each process (and fork) opens its own connection."""
+
+    def __init__(self, path: str = SHARED_STORE_SQLITE_PATH):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, expires_at REAL NOT NULL, value TEXT NOT NULL)"
+            )
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def get(self, key: str) -> Optional[Tuple[float, Any]]:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT expires_at, value FROM kv WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def set(self, key: str, value: Any, ttl: float):
+        payload = json.dumps(value)
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (key, expires_at, value) VALUES (?, ?, ?)",
+                (key, time.time() + ttl, payload),
+            )
+            self._writes += 1
+            if self._writes % SHARED_STORE_PURGE_EVERY == 0:
+                conn.execute("DELETE FROM kv WHERE expires_at <= ?", (time.time(),))
+
+    def delete(self, key: str):
+        with self._lock:
+            self._connection().execute("DELETE FROM kv WHERE key = ?", (key,))
+
+
+class RedisStore:
+    def __init__(self, url: str):
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Optional[Tuple[float, Any]]:
+        with self._redis.pipeline() as pipe:
+            value, ttl_ms = pipe.get(key).pttl(key).execute()
+        if value is None or ttl_ms <= 0:
+            return None
+        return time.time() + ttl_ms / 1000, json.loads(value)
+
+    def set(self, key: str, value: Any, ttl: float):
+        self._redis.set(key, json.dumps(value), px=max(int(ttl * 1000), 1))
+
+    def delete(self, key: str):
+        self._redis.delete(key)
+
+
+# -----------------------
+# Process-wide store
+# -----------------------
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_shared_store():
+    """The configured store, or None for the memory backend. Connections open lazily per process."""
+    global _store
+    backend = shared_store_backend()
+    if backend == "memory":
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if backend == "redis":
+                    try:
+                        _store = RedisStore(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+                    except ImportError as e:
+                        # Still shared by this box's workers, just not across boxes
+                        print(f"Redis client unavailable ({e}), shared store falls back to sqlite")
+                        _store = SqliteStore()
+                elif backend == "sqlite":
+                    _store = SqliteStore()
+                else:
+                    raise ValueError(f"Unknown SHARED_STORE_BACKEND: {backend}")
+    return _store
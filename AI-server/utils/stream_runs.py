@@ -0,0 +1,279 @@
+# stream_runs.py
+"""
+Resumable chat streams.
+
+A chat turn runs as a detached task that publishes its SSE frames into a
+bounded per-stream ring buffer; HTTP responses only follow the buffer.
+Every frame carries `id: <stream_id>:<seq>`, so a client that drops
+mid-answer reconnects with Last-Event-ID, gets the frames it missed and
+then the live tail, while the agent run itself is never restarted.
+Runs are per process and kept STREAM_RUN_TTL_S after they finish; with
+several workers, resume and cancel need sticky sessions (see serve.py).
+
+A run nobody follows for STREAM_ABANDON_GRACE_S is cancelled: the
+cancellation reaches the in-flight model request, SQL statement
+(utils.cancellation) and search call, so a closed tab stops costing
+tokens and database time once reconnecting is no longer likely.
+"""
+import os
+import json
+import time
+import uuid
+import signal
+import asyncio
+from collections import deque
+from contextvars import ContextVar
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+from utils import metrics
+from utils.latency_budget import CHAT_LATENCY_BUDGET_S
+
+STREAM_BUFFER_EVENTS = int(os.getenv("STREAM_BUFFER_EVENTS", "4096"))
+STREAM_RUN_TTL_S = float(os.getenv("STREAM_RUN_TTL_S", "120"))
+# How long a run keeps going with no follower before it is cancelled
+STREAM_ABANDON_GRACE_S = float(os.getenv("STREAM_ABANDON_GRACE_S", "15"))
+# On shutdown, how long running turns get to finish before they are cancelled
+STREAM_DRAIN_TIMEOUT_S = float(os.getenv("STREAM_DRAIN_TIMEOUT_S", "30"))
+
+
+def sse_frame(payload: dict) -> str:
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+def split_sse_frame(frame: str) -> Tuple[Optional[str], str]:
+    """(event id or None, JSON data) of one SSE frame, for transports other than SSE."""
+    event_id, data = None, []
+    for line in frame.splitlines():
+        if line.startswith("id: "):
+            event_id = line[4:]
+        elif line.startswith("data: "):
+            data.append(line[6:])
+    return event_id, "\n".join(data)
+
+
+class StreamRun:
+    def __init__(self, owner: Optional[str], maxlen: int = STREAM_BUFFER_EVENTS):
+        self.stream_id = uuid.uuid4().hex
+        self.owner = owner
+        self.events: deque = deque(maxlen=maxlen)  # (seq, frame), seqs contiguous
+        self.seq = 0
+        self.done = False
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self.subscribers = 0
+        self.started_at = time.monotonic()
+        self.detached_at: Optional[float] = None
+        self.abandoned = False
+        self._abandon_timer: Optional[asyncio.TimerHandle] = None
+        self._changed = asyncio.Event()
+
+    def _wake(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def publish(self, frame: str):
+        self.seq += 1
+        self.events.append((self.seq, f"id: {self.stream_id}:{self.seq}\n{frame}"))
+        self._wake()
+
+    def finish(self):
+        self.done = True
+        self.finished_at = time.time()
+        if self._abandon_timer is not None:
+            self._abandon_timer.cancel()
+            self._abandon_timer = None
+        if self.detached_at is not None and not self.abandoned:
+            # Finished with nobody following: wasted unless a client resumes
+            metrics.incr("stream_finished_detached")
+            metrics.observe("stream_detached_ms", (time.monotonic() - self.detached_at) * 1000)
+        self._wake()
+
+    def cancel(self) -> bool:
+        """Stop the run on the client's request (not a disconnect: no grace period)."""
+        if self.task is None or self.task.done():
+            return False
+        self.task.cancel()
+        metrics.incr("stream_cancelled_by_client")
+        return True
+
+    def attached(self) -> bool:
+        return self.subscribers > 0 or self.detached_at is None
+
+    def _attach(self):
+        self.subscribers += 1
+        self.detached_at = None
+        if self._abandon_timer is not None:
+            self._abandon_timer.cancel()
+            self._abandon_timer = None
+
+    def _detach(self):
+        self.subscribers -= 1
+        if self.done or self.subscribers > 0:
+            return
+        metrics.incr("stream_detached")
+        self.detached_at = time.monotonic()
+        self._abandon_timer = asyncio.get_running_loop().call_later(STREAM_ABANDON_GRACE_S, self._abandon)
+
+    def _abandon(self):
+        self._abandon_timer = None
+        if self.done or self.subscribers > 0 or self.task is None or self.task.done():
+            return
+        self.abandoned = True
+        self.task.cancel()
+        metrics.incr("stream_abandoned")
+        # Wasted: run time nobody was following; reclaimed: budget it no longer spends
+        metrics.observe("stream_wasted_ms", (time.monotonic() - self.detached_at) * 1000)
+        metrics.observe(
+            "stream_reclaimed_s", max(CHAT_LATENCY_BUDGET_S - (time.monotonic() - self.started_at), 0.0)
+        )
+        print(f"🛑 Stream run {self.stream_id} abandoned, cancelled after {STREAM_ABANDON_GRACE_S:.0f}s detached")
+
+    async def follow(self, after: int = 0) -> AsyncIterator[str]:
+        """Frames with seq > after: the buffered ones first, then the live tail until the run ends."""
+        self._attach()
+        try:
+            while True:
+                while self.events and after < self.seq:
+                    # The buffer may have rotated while we were yielding:
+                    # locate the next frame from the current head every time
+                    first = self.events[0][0]
+                    if after + 1 < first:
+                        # Older than the ring buffer holds
+                        metrics.incr("stream_replay_gap_events", first - after - 1)
+                        yield sse_frame({"type": "replay_gap", "missed": first - after - 1})
+                        after = first - 1
+                        continue
+                    # Index arithmetic: deque access near the right end is O(1)
+                    seq, frame = self.events[after + 1 - first]
+                    after = seq
+                    yield frame
+                if self.done and after >= self.seq:
+                    return
+                changed = self._changed
+                if after >= self.seq:
+                    await changed.wait()
+        finally:
+            self._detach()
+
+
+# -----------------------
+# Process-wide registry
+# -----------------------
+_runs: Dict[str, StreamRun] = {}
+_draining = False
+_current_run: ContextVar[Optional[StreamRun]] = ContextVar("current_stream_run", default=None)
+
+
+def client_attached() -> bool:
+    """False inside a run that currently has no follower (optional work can be skipped)."""
+    run = _current_run.get()
+    return run is None or run.attached()
+
+
+async def _produce(run: StreamRun, source: AsyncIterator[str]):
+    _current_run.set(run)
+    try:
+        async for frame in source:
+            run.publish(frame)
+    except Exception as e:
+        print(f"❌ Stream run {run.stream_id} failed: {e}")
+    finally:
+        run.finish()
+
+
+def _reap():
+    now = time.time()
+    for stream_id in [k for k, r in _runs.items() if r.done and now - r.finished_at > STREAM_RUN_TTL_S]:
+        del _runs[stream_id]
+
+
+def start_run(source: AsyncIterator[str], owner: Optional[str]) -> StreamRun:
+    """Run `source` (an SSE frame generator) to completion in the background."""
+    _reap()
+    run = StreamRun(owner)
+    run.publish(sse_frame({"type": "stream", "stream_id": run.stream_id}))
+    run.task = asyncio.create_task(_produce(run, source), name=f"chat-stream-{run.stream_id}")
+    _runs[run.stream_id] = run
+    metrics.incr("stream_started")
+    return run
+
+
+def parse_last_event_id(last_event_id: str) -> Tuple[Optional[str], int]:
+    stream_id, _, seq = (last_event_id or "").strip().partition(":")
+    try:
+        return stream_id or None, int(seq or 0)
+    except ValueError:
+        return stream_id or None, 0
+
+
+def find_run(last_event_id: str, owner: Optional[str]) -> Optional[StreamRun]:
+    """The run a Last-Event-ID points to, if it is still here and the caller's."""
+    _reap()
+    stream_id, _ = parse_last_event_id(last_event_id)
+    run = _runs.get(stream_id) if stream_id else None
+    return run if run is not None and run.owner == owner else None
+
+
+def resume_run(last_event_id: str, owner: Optional[str]) -> Optional[AsyncIterator[str]]:
+    """Follower replaying after Last-Event-ID, or None when the stream is unknown here (or not the caller's)."""
+    run = find_run(last_event_id, owner)
+    if run is None:
+        metrics.incr("stream_resume_miss")
+        return None
+    _, seq = parse_last_event_id(last_event_id)
+    metrics.incr("stream_resumed")
+    metrics.incr("stream_replayed_events", max(run.seq - seq, 0))
+    return run.follow(seq)
+
+
+def draining() -> bool:
+    """True once shutdown started: new turns should go to another worker."""
+    return _draining
+
+
+def start_draining():
+    global _draining
+    _draining = True
+
+
+def drain_on_signals(*signums: int):
+    """
+    Mark the worker draining as soon as a shutdown signal arrives, then hand
+    the signal to the handler it replaces (uvicorn's). During the server's
+    graceful shutdown, open keep-alive and chat_ws connections can still ask
+    for new turns; those get SERVER_DRAINING instead of a run that would be
+    cut off. Call from the main thread once the server's handlers are set.
+    """
+    for signum in signums:
+        previous = signal.getsignal(signum)
+
+        def handler(sig, frame, previous=previous):
+            start_draining()
+            if callable(previous):
+                previous(sig, frame)
+            else:
+                signal.signal(sig, previous if previous is not None else signal.SIG_DFL)
+                signal.raise_signal(sig)
+
+        try:
+            signal.signal(signum, handler)
+        except ValueError as e:  # not the main thread (e.g. a test client)
+            print(f"Drain signal handler not installed: {e}")
+
+
+async def drain_runs(timeout: float = STREAM_DRAIN_TIMEOUT_S) -> Dict[str, int]:
+    """
+    Stop taking new runs and give the running ones `timeout` seconds to
+    finish (and save their answer); whatever is left is cancelled.
+    """
+    start_draining()
+    active = [r.task for r in _runs.values() if r.task is not None and not r.task.done()]
+    pending = set()
+    if active:
+        _, pending = await asyncio.wait(active, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    metrics.incr("stream_drained", len(active) - len(pending))
+    metrics.incr("stream_drain_cancelled", len(pending))
+    return {"finished": len(active) - len(pending), "cancelled": len(pending)}
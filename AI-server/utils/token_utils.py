@@ -0,0 +1,40 @@
+# token_utils.py
+import os
+from functools import lru_cache
+
+# gpt-oss models use the o200k family of encodings
+TOKEN_ENCODING = os.getenv("TOKEN_ENCODING", "o200k_base")
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(TOKEN_ENCODING)
+    except Exception as e:
+        # Encoding files are downloaded on first use; fall back to ~4 chars/token
+        print(f"tiktoken unavailable ({e}), using character estimate")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    enc = _encoding()
+    if enc is None:
+        return (len(text) + 3) // 4
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int, suffix: str = "…") -> str:
+    """Cut `text` to at most `max_tokens` tokens, marking the cut with `suffix`."""
+    if not text or max_tokens <= 0:
+        return ""
+    enc = _encoding()
+    if enc is None:
+        limit = max_tokens * 4
+        return text if len(text) <= limit else text[:limit].rstrip() + suffix
+    tokens = enc.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return enc.decode(tokens[:max_tokens]).rstrip() + suffix
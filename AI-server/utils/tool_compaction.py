@@ -0,0 +1,177 @@
+# tool_compaction.py
+import os
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+from utils.token_utils import count_tokens, truncate_tokens
+from utils import metrics
+
+# Tokens of tool output the agent sees per call (full payload still goes to SSE)
+TOOL_TOKEN_BUDGETS = {
+    "pgsql_query_structured": int(os.getenv("SQL_TOOL_TOKEN_BUDGET", "800")),
+    "transactions_analytics": int(os.getenv("SQL_TOOL_TOKEN_BUDGET", "800")),
+    "web_search": int(os.getenv("WEB_TOOL_TOKEN_BUDGET", "600")),
+    "image_search": int(os.getenv("IMAGE_TOOL_TOKEN_BUDGET", "300")),
+    "rag_tool": int(os.getenv("RAG_TOOL_TOKEN_BUDGET", "500")),
+    "market_metrics": int(os.getenv("METRICS_TOOL_TOKEN_BUDGET", "700")),
+}
+DEFAULT_TOKEN_BUDGET = 600
+# Two snippets sharing this fraction of word shingles are treated as duplicates
+DUPLICATE_SIMILARITY = 0.6
+
+
+def _dumps(obj: Any) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+# -----------------------
+# Near-duplicate detection
+# -----------------------
+def _shingles(text: str, n: int = 3) -> set:
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < n:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + n]) for i in range(len(words) - n + 1)}
+
+
+def _is_duplicate(sh: set, seen: List[set]) -> bool:
+    if not sh:
+        return False
+    for other in seen:
+        if not other:
+            continue
+        overlap = len(sh & other) / min(len(sh), len(other))
+        if overlap >= DUPLICATE_SIMILARITY:
+            return True
+    return False
+
+
+def _normalize_url(url: str) -> str:
+    url = re.sub(r"^https?://(www\.)?", "", url.strip().lower())
+    return url.split("#")[0].split("?")[0].rstrip("/")
+
+
+def _dedupe_snippets(items: List[Dict[str, Any]], text_key: str = "snippet") -> List[Dict[str, Any]]:
+    kept, seen_urls, seen_text = [], set(), []
+    for item in items:
+        url = item.get("url")
+        if url:
+            norm = _normalize_url(url)
+            if norm in seen_urls:
+                continue
+            seen_urls.add(norm)
+        sh = _shingles(item.get(text_key) or "")
+        if _is_duplicate(sh, seen_text):
+            continue
+        seen_text.append(sh)
+        kept.append(item)
+    return kept
+
+
+def _fit_snippets(items: List[Dict[str, Any]], budget: int, text_key: str = "snippet") -> List[Dict[str, Any]]:
+    """Share the budget evenly between snippets, truncating each to its slice."""
+    if not items:
+        return items
+    overhead = count_tokens(_dumps([{k: v for k, v in i.items() if k != text_key} for i in items]))
+    per_item = max(20, (budget - overhead) // len(items))
+    return [{**i, text_key: truncate_tokens(i.get(text_key) or "", per_item)} for i in items]
+
+
+# -----------------------
+# Per-tool compaction
+# -----------------------
+def _compact_sql(out: Dict[str, Any], budget: int) -> Dict[str, Any]:
+    if out.get("error"):
+        return {"error": out["error"], "rowcount": 0}
+
+    rows = out.get("rows") or []
+    columns = list(out.get("columns") or [])
+
+    # Project away columns that carry no information for the model:
+    # all-NULL columns are dropped, constant columns are stated once.
+    constants: Dict[str, Any] = {}
+    keep: List[str] = []
+    for c in columns:
+        values = [r.get(c) for r in rows]
+        if rows and all(v is None for v in values):
+            continue
+        if len(rows) > 1 and all(v == values[0] for v in values):
+            constants[c] = values[0]
+            continue
+        keep.append(c)
+
+    compact: Dict[str, Any] = {"rowcount": out.get("rowcount"), "columns": keep}
+    if constants:
+        compact["constant_columns"] = constants
+    if out.get("stats"):
+        compact["stats"] = {c: s for c, s in out["stats"].items() if c not in constants}
+    if out.get("truncated"):
+        compact["truncated"] = True
+
+    # Row-major lists without per-row keys; drop trailing rows to fit the budget
+    compact["rows"] = [[r.get(c) for c in keep] for r in rows]
+    while compact["rows"] and count_tokens(_dumps(compact)) > budget:
+        compact["rows"].pop()
+    if len(compact["rows"]) < len(rows):
+        compact["rows_shown"] = len(compact["rows"])
+    return compact
+
+
+def _compact_web(out: Dict[str, Any], budget: int) -> Dict[str, Any]:
+    results = _dedupe_snippets(out.get("results") or [])
+    return {"query": out.get("query"), "results": _fit_snippets(results, budget)}
+
+
+def _compact_images(out: Dict[str, Any], budget: int) -> Dict[str, Any]:
+    images = [{"url": i.get("url")} for i in out.get("images") or [] if i.get("url")]
+    context = _dedupe_snippets(out.get("context") or [])
+    remaining = budget - count_tokens(_dumps(images))
+    return {"query": out.get("query"), "images": images, "context": _fit_snippets(context, remaining)}
+
+
+def _compact_rag(out: str, budget: int) -> str:
+    chunks, seen = [], []
+    for chunk in out.split("\n\n"):
+        chunk = " ".join(chunk.split())
+        sh = _shingles(chunk)
+        if not chunk or _is_duplicate(sh, seen):
+            continue
+        seen.append(sh)
+        chunks.append(chunk)
+    return truncate_tokens("\n\n".join(chunks), budget)
+
+
+_COMPACTORS = {
+    "pgsql_query_structured": _compact_sql,
+    "transactions_analytics": _compact_sql,
+    "web_search": _compact_web,
+    "image_search": _compact_images,
+}
+
+
+def compact_tool_output(tool_name: str, output: Any, budget: Optional[int] = None) -> str:
+    """
+    Shrink a tool result to what the agent needs for its next step, within the
+    tool's token budget. Returns the string used as ToolMessage content.
+    """
+    budget = budget or TOOL_TOKEN_BUDGETS.get(tool_name, DEFAULT_TOKEN_BUDGET)
+
+    if isinstance(output, dict) and output.get("timed_out"):
+        return _dumps(output)
+
+    try:
+        if isinstance(output, str):
+            compact = _compact_rag(output, budget) if tool_name == "rag_tool" else truncate_tokens(output, budget)
+        elif isinstance(output, dict) and tool_name in _COMPACTORS:
+            compact = _dumps(_COMPACTORS[tool_name](output, budget))
+        else:
+            compact = truncate_tokens(_dumps(output), budget)
+    except Exception as e:
+        print(f"Tool output compaction failed for {tool_name}: {e}")
+        compact = truncate_tokens(_dumps(output), budget)
+
+    full = output if isinstance(output, str) else _dumps(output)
+    metrics.observe("tool_output_tokens_full", count_tokens(full), label=tool_name)
+    metrics.observe("tool_output_tokens_compact", count_tokens(compact), label=tool_name)
+    return compact
@@ -1,14 +1,24 @@
 # tools.py
-import os, time
-from typing import Dict, Any, List
-from langchain_core.tools import tool
+import os, time, asyncio
+from typing import Dict, Any, List, Optional
+from langchain_core.tools import StructuredTool
 from langchain_community.tools.tavily_search import TavilySearchResults
 from langchain_community.utilities import SQLDatabase
-from sqlalchemy import text
-import os, requests
+from sqlalchemy import text, make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+import os, requests, httpx
 from langchain_core.tools import BaseTool
 
 from RAG_config import retriever
+from utils.arrow_results import query_summary, aquery_summary
+from utils.cancellation import cancel_on_abort
+from utils.llm_scheduler import scheduled_http_clients
+from utils.search_cache import search_cache, make_key
+from utils.area_resolver import get_area_resolver, resolved_areas_hint
+from utils.location_hierarchy import get_location_hierarchy
+from utils.tx_snapshot import get_tx_snapshot
+from utils.tx_analytics import transactions_summary
+from utils.market_metrics import get_market_metrics
 from langchain_openai import ChatOpenAI
 
 # =========================
@@ -30,40 +40,101 @@ SCHEMA_INFO = target_db.get_table_info()
 engine = target_db._engine
 _tavily = TavilySearchResults()
 
+
+# libpq URI parameters with an asyncpg connect() equivalent that takes a string
+_ASYNCPG_PARAMS = {
+    "host": "host",  # socket directory or host list, read by SQLAlchemy itself
+    "sslmode": "ssl",
+    "ssl": "ssl",
+    "target_session_attrs": "target_session_attrs",
+    "prepared_statement_cache_size": "prepared_statement_cache_size",
+}
+
+
+def _async_db_uri(uri: str):
+    """
+    Same database, asyncpg driver. Query parameters are passed to
+    asyncpg.connect() as keyword arguments, so libpq ones are renamed where
+    asyncpg has an equivalent and dropped otherwise (channel_binding,
+    options, ...), which asyncpg would reject.
+    """
+    url = make_url(uri).set(drivername="postgresql+asyncpg")
+    query, dropped = {}, []
+    for name, value in url.query.items():
+        if name in _ASYNCPG_PARAMS:
+            query[_ASYNCPG_PARAMS[name]] = value
+        else:
+            dropped.append(name)
+    if dropped:
+        print(f"asyncpg: ignoring unsupported connection parameters {', '.join(dropped)}")
+    return url.set(query=query)
+
+
+# Non-blocking engine used by the coroutine tool variants
+async_engine = create_async_engine(_async_db_uri(TARGET_DB_URI), pool_pre_ping=True)
+
+# Shared HTTP client for direct Tavily calls from coroutine tools
+_http = httpx.AsyncClient(timeout=15)
+
+
+def _reset_after_fork():
+    # A forked worker must not reuse the parent's pooled connections; the
+    # pools are dropped without closing them (the parent still owns them)
+    global _http
+    engine.dispose(close=False)
+    async_engine.sync_engine.dispose(close=False)
+    _http = httpx.AsyncClient(timeout=15)
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+async def close_tool_clients():
+    """Close this worker's database pools and HTTP client (app shutdown)."""
+    search_cache.flush()
+    await _http.aclose()
+    await async_engine.dispose()
+    engine.dispose()
+
 # Use same LLM as graph.py
 llm = ChatOpenAI(
     model="openai/gpt-oss-20b",
     api_key=os.getenv("GROQ_API_KEY"),
     base_url="https://api.groq.com/openai/v1",
+    **scheduled_http_clients(),
 )
 
 
-@tool("rag_tool")
-def rag_tool(query: str) -> str:
-    """Search the knowledge base (Qdrant retriever) for relevant info."""
-    docs = retriever.invoke(query)
+# =========================
+# rag_tool
+# =========================
+def _format_docs(docs) -> str:
     if not docs:
         return "I'm not sure."
     return "\n\n".join([doc.page_content for doc in docs])
 
 
-@tool("web_search")
-def web_search(query: str, max_results: int = 5) -> Dict[str, Any]:
-    """
-    Tavily web search. Returns:
-    {
-      "engine": "tavily",
-      "query": "...",
-      "results": [{"url","title","snippet"}]
-    }
-    """
+def _rag_tool(query: str) -> str:
+    """Search the knowledge base (Qdrant retriever) for relevant info."""
+    return _format_docs(retriever.invoke(query))
+
+
+async def _arag_tool(query: str) -> str:
+    return _format_docs(await retriever.ainvoke(query))
+
+
+# =========================
+# web_search
+# =========================
+def _coerce_query(query) -> str:
     if isinstance(query, dict):
-        query = query.get("query", "")
-    elif not isinstance(query, str):
-        query = str(query)
+        return query.get("query", "")
+    if not isinstance(query, str):
+        return str(query)
+    return query
 
-    raw = _tavily.invoke({"query": query, "max_results": max_results}) or []
 
+def _format_web_results(raw, query: str, max_results: int) -> Dict[str, Any]:
     print("====================== tavily result ====================", raw)
     results: List[Dict[str, str]] = []
     for r in raw if isinstance(raw, list) else []:
@@ -77,8 +148,116 @@ def web_search(query: str, max_results: int = 5) -> Dict[str, Any]:
     return {"engine": "tavily", "query": query, "results": results[:max_results]}
 
 
-@tool("pgsql_query_structured")
-def pgsql_query_structured(user_query: str, sample_rows: int = 10) -> Dict[str, Any]:
+def _web_search(query: str, max_results: int = 5) -> Dict[str, Any]:
+    """
+    Tavily web search. Returns:
+    {
+      "engine": "tavily",
+      "query": "...",
+      "results": [{"url","title","snippet"}]
+    }
+    """
+    query = _coerce_query(query)
+    key = make_key("web", query, _tavily.search_depth, max_results)
+
+    # The wrapper raises on failure; the tool's invoke() would return the
+    # error as a string, which the cache would then keep for hours
+    def _fetch():
+        return _tavily.api_wrapper.raw_results(
+            query, max_results=max_results, search_depth=_tavily.search_depth
+        ).get("results") or []
+
+    try:
+        raw = search_cache.get_or_fetch(key, _fetch)
+    except Exception as e:
+        print("Tavily request failed:", e)
+        raw = []
+    return _format_web_results(raw, query, max_results)
+
+
+async def _aweb_search(query: str, max_results: int = 5) -> Dict[str, Any]:
+    query = _coerce_query(query)
+    key = make_key("web", query, _tavily.search_depth, max_results)
+
+    async def _fetch():
+        return (await _tavily.api_wrapper.raw_results_async(
+            query, max_results=max_results, search_depth=_tavily.search_depth
+        )).get("results") or []
+
+    try:
+        raw = await search_cache.aget_or_fetch(key, _fetch)
+    except Exception as e:
+        print("Tavily request failed:", e)
+        raw = []
+    return _format_web_results(raw, query, max_results)
+
+
+# =========================
+# pgsql_query_structured
+# =========================
+def _sql_prompt(user_query: str) -> str:
+    areas = resolved_areas_hint(get_area_resolver(engine), user_query, get_location_hierarchy(engine))
+    return f"""
+    User request: {user_query}
+
+    Database schema:
+    {SCHEMA_INFO}
+
+    {areas}
+
+    Write a valid PostgreSQL query following the rules.
+    Return ONLY the SQL query, nothing else.
+    """
+
+
+def _clean_sql(sql: str) -> str:
+    sql = sql.strip()
+    if sql.startswith("```"):
+        sql = sql.strip("`").replace("sql", "", 1).strip()
+    print("🟢 Running SQL:", sql)
+    return sql
+
+
+def _sql_error(sql: str, e: Exception, start: float) -> Dict[str, Any]:
+    print("❌ SQL Execution Error:", sql, str(e))
+    return {
+        "dialect": "postgresql",
+        "columns": [],
+        "rows": [],
+        "rowcount": 0,
+        "elapsed_ms": int((time.perf_counter() - start) * 1000),
+        "error": str(e),
+    }
+
+
+def _streamed_result(summary, start: float) -> Dict[str, Any]:
+    return {
+        "dialect": "postgresql",
+        "columns": summary.columns,
+        "rows": summary.head().to_pylist(),
+        "rowcount": summary.rowcount,
+        "elapsed_ms": int((time.perf_counter() - start) * 1000),
+        "stats": summary.stats(),
+        "truncated": summary.truncated,
+    }
+
+
+def _sampled_result(res, sample_rows: int) -> Dict[str, Any]:
+    rows = [dict(r._mapping) for r in res.fetchmany(sample_rows)]
+    columns = list(rows[0].keys()) if rows else list(res.keys())
+    try:
+        rowcount = res.rowcount if res.rowcount != -1 else None
+    except Exception:
+        rowcount = None
+    return {
+        "dialect": "postgresql",
+        "columns": columns,
+        "rows": rows,
+        "rowcount": rowcount if rowcount is not None else len(rows),
+    }
+
+
+def _pgsql_query_structured(user_query: str, sample_rows: int = 10, stream: bool = False) -> Dict[str, Any]:
     """
     Generate and execute a SQL query against the Postgres database.
 
@@ -87,12 +266,17 @@ def pgsql_query_structured(user_query: str, sample_rows: int = 10) -> Dict[str,
     - Generate a valid PostgreSQL SELECT query to answer the user's request.
     - Never return placeholders (like SELECT 0).
     - If the info is not available in schema, respond with "Not available in database".
-    - Use ILIKE for partial matches.
+    - Filter areas on the exact keys listed under "Resolved areas"; use
+      ILIKE only for names that were not resolved.
     - Only return SQL (no explanations, no markdown).
 
     Input:
     - user_query: the user's natural language request
     - sample_rows: max number of rows to fetch (default = 10)
+    - stream: set to true for large analytical results. The full result is
+      streamed through a server-side cursor and per-column stats
+      (min/max/mean/sum/distinct) are computed over every row, while only
+      `sample_rows` rows are returned.
 
     Output:
     {
@@ -101,85 +285,74 @@ def pgsql_query_structured(user_query: str, sample_rows: int = 10) -> Dict[str,
       "rows": [...],
       "rowcount": <int>,
       "elapsed_ms": <int>,
+      "stats": <only when stream=true>,
+      "truncated": <only when stream=true>,
       "error": <optional error string>
     }
     """
+    sql = _clean_sql(llm.invoke(_sql_prompt(user_query)).content)
 
-    sql_prompt = f"""
-    User request: {user_query}
+    start = time.perf_counter()
 
-    Database schema:
-    {SCHEMA_INFO}
+    if stream:
+        try:
+            summary = query_summary(engine, sql, sample_rows)
+        except Exception as e:
+            return _sql_error(sql, e, start)
+        return _streamed_result(summary, start)
 
-    Write a valid PostgreSQL query following the rules.
-    Return ONLY the SQL query, nothing else.
-    """
+    try:
+        with engine.begin() as conn:
+            result = _sampled_result(conn.execute(text(sql)), sample_rows)
+    except Exception as e:
+        return _sql_error(sql, e, start)
 
-    sql = llm.invoke(sql_prompt).content.strip()
+    result["elapsed_ms"] = int((time.perf_counter() - start) * 1000)
+    return result
 
-    if sql.startswith("```"):
-        sql = sql.strip("`").replace("sql", "", 1).strip()
 
-    print("🟢 Running SQL:", sql)
+async def _apgsql_query_structured(user_query: str, sample_rows: int = 10, stream: bool = False) -> Dict[str, Any]:
+    # The first call loads the area resolver / hierarchy from the DB: keep it off the loop
+    prompt = await asyncio.to_thread(_sql_prompt, user_query)
+    sql = _clean_sql((await llm.ainvoke(prompt)).content)
 
     start = time.perf_counter()
+
+    if stream:
+        try:
+            summary = await aquery_summary(async_engine, sql, sample_rows)
+        except Exception as e:
+            return _sql_error(sql, e, start)
+        return _streamed_result(summary, start)
+
     try:
-        with engine.begin() as conn:
-            res = conn.execute(text(sql))
-            rows = [dict(r._mapping) for r in res.fetchmany(sample_rows)]
-            columns = list(rows[0].keys()) if rows else list(res.keys())
-            try:
-                rowcount = res.rowcount if res.rowcount != -1 else None
-            except Exception:
-                rowcount = None
+        async with async_engine.connect() as conn, cancel_on_abort(conn, async_engine):
+            res = await conn.execute(text(sql))
+            result = _sampled_result(res, sample_rows)
     except Exception as e:
-        print("❌ SQL Execution Error:", sql, str(e))
-        return {
-            "dialect": "postgresql",
-            "columns": [],
-            "rows": [],
-            "rowcount": 0,
-            "elapsed_ms": int((time.perf_counter() - start) * 1000),
-            "error": str(e),
-        }
+        return _sql_error(sql, e, start)
+
+    result["elapsed_ms"] = int((time.perf_counter() - start) * 1000)
+    return result
 
-    return {
-        "dialect": "postgresql",
-        "columns": columns,
-        "rows": rows,
-        "rowcount": rowcount if rowcount is not None else len(rows),
-        "elapsed_ms": int((time.perf_counter() - start) * 1000),
-    }
 
+# =========================
+# image_search
+# =========================
 TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
 
-@tool("image_search")
-def image_search(query: str, max_results: int = 5) -> Dict[str, Any]:
-    """
-    Contextual image search using Tavily (returns both context and images).
-    """
-    try:
-        resp = requests.post(
-            "https://api.tavily.com/search",
-            json={
-                "api_key": TAVILY_API_KEY,
-                "query": query,
-                "search_depth": "advanced",
-                "include_images": True,
-                "max_results": max_results,
-            },
-            timeout=15,
-        )
-        data = resp.json()
-    except Exception as e:
-        print("Tavily request failed:", e)
-        return {
-            "engine": "tavily",
-            "query": query,
-            "context": [],
-            "images": [],
-        }
 
+def _image_search_body(query: str, max_results: int) -> Dict[str, Any]:
+    return {
+        "api_key": TAVILY_API_KEY,
+        "query": query,
+        "search_depth": "advanced",
+        "include_images": True,
+        "max_results": max_results,
+    }
+
+
+def _format_image_results(data: Dict[str, Any], query: str, max_results: int) -> Dict[str, Any]:
     # --- Step 1: Extract context from results ---
     context = []
     for r in data.get("results", []):
@@ -207,9 +380,200 @@ def image_search(query: str, max_results: int = 5) -> Dict[str, Any]:
     }
 
 
+def _empty_images(query: str) -> Dict[str, Any]:
+    return {
+        "engine": "tavily",
+        "query": query,
+        "context": [],
+        "images": [],
+    }
+
+
+def _image_search(query: str, max_results: int = 5) -> Dict[str, Any]:
+    """
+    Contextual image search using Tavily (returns both context and images).
+    """
+    def _fetch():
+        resp = requests.post(
+            "https://api.tavily.com/search",
+            json=_image_search_body(query, max_results),
+            timeout=15,
+        )
+        resp.raise_for_status()
+        return resp.json()
+
+    try:
+        data = search_cache.get_or_fetch(make_key("image", query, "advanced", max_results), _fetch)
+    except Exception as e:
+        print("Tavily request failed:", e)
+        return _empty_images(query)
+
+    return _format_image_results(data, query, max_results)
+
+
+async def _aimage_search(query: str, max_results: int = 5) -> Dict[str, Any]:
+    async def _fetch():
+        resp = await _http.post(
+            "https://api.tavily.com/search",
+            json=_image_search_body(query, max_results),
+        )
+        resp.raise_for_status()
+        return resp.json()
+
+    try:
+        data = await search_cache.aget_or_fetch(make_key("image", query, "advanced", max_results), _fetch)
+    except Exception as e:
+        print("Tavily request failed:", e)
+        return _empty_images(query)
+
+    return _format_image_results(data, query, max_results)
+
+
+# =========================
+# transactions_analytics
+# =========================
+def _transactions_analytics(
+    area: Optional[str] = None,
+    group_by: Optional[List[str]] = None,
+    property_type: Optional[str] = None,
+    rooms: Optional[str] = None,
+    trans_group: Optional[str] = None,
+    start_year: Optional[int] = None,
+    end_year: Optional[int] = None,
+    limit: int = 50,
+) -> Dict[str, Any]:
+    """
+    Fast aggregates over a local snapshot of all DLD transactions (no SQL).
+    Prefer this over pgsql_query_structured for volumes, prices and trends.
+
+    Input:
+    - area: area/community name as the user wrote it ("JVC", "Dubai Land");
+      communities include their sub-locations
+    - group_by: any of year, month, area, property_type, rooms, trans_group,
+      usage (default ["year"])
+    - property_type: Apartment | Villa | Stacked Townhouses | Office | Shop |
+      Hotel Apartment | Hotel Rooms
+    - rooms: e.g. "Studio", "1 B/R", "2 B/R"
+    - trans_group: e.g. "Sales", "Mortgages", "Gifts"
+    - start_year / end_year: inclusive year range
+    - limit: max rows returned
+
+    Output:
+    {
+      "columns": [...group keys, "transactions", "sales_volume", "avg_price",
+                  "avg_meter_sale_price", "median_meter_sale_price", "avg_rent",
+                  "yoy_price_pct", "yoy_transactions_pct" (when grouped by year)],
+      "rows": [...],
+      "rowcount": <int>,
+      "as_of": <latest instance_date in the snapshot>,
+      "error": <optional error string>
+    }
+    """
+    snapshot = get_tx_snapshot(engine)
+    if snapshot.is_empty:
+        return {"error": "Local transactions snapshot is still being built; use pgsql_query_structured.", "rowcount": 0}
+
+    area_ids = None
+    if area:
+        area_ids = get_area_resolver(engine).area_ids(area, get_location_hierarchy(engine))
+        if not area_ids:
+            return {"error": f"Unknown area: {area}", "rowcount": 0}
+
+    return transactions_summary(
+        snapshot, group_by or ["year"], area_ids, property_type, rooms,
+        trans_group, start_year, end_year, limit,
+    )
+
+
+async def _atransactions_analytics(
+    area: Optional[str] = None,
+    group_by: Optional[List[str]] = None,
+    property_type: Optional[str] = None,
+    rooms: Optional[str] = None,
+    trans_group: Optional[str] = None,
+    start_year: Optional[int] = None,
+    end_year: Optional[int] = None,
+    limit: int = 50,
+) -> Dict[str, Any]:
+    # Arrow kernels release the GIL; run them off the event loop
+    return await asyncio.to_thread(
+        _transactions_analytics, area, group_by, property_type, rooms,
+        trans_group, start_year, end_year, limit,
+    )
+
+
+# =========================
+# market_metrics
+# =========================
+def _market_metrics(area: str, property_type: Optional[str] = None, bedrooms: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Precomputed market metrics for an area, per property type and bedroom
+    group (no SQL). Use for yield, price-to-rent, YoY price change,
+    volatility and transaction volume questions.
+
+    Input:
+    - area: area/community name as the user wrote it ("JVC", "Dubai Marina")
+    - property_type: "apartment" | "villa" (default: both)
+    - bedrooms: "Studio", "1", "2BR", ... (default: all)
+
+    Output:
+    {
+      "area": "...",
+      "groups": [{"property_type", "bedroom_label", "period", "avg_ratio",
+                  "min_ratio", "max_ratio", "change_pct", "trend",
+                  "gross_yield_pct", "yoy_change", "volatility", "txn_volume",
+                  "avg_price_12m", "avg_rent_12m"}],
+      "overall": {"yield", "yoy_change", "volatility", "txn_volume"},
+      "error": <optional error string>
+    }
+    """
+    area_ids = get_area_resolver(engine).area_ids(area, get_location_hierarchy(engine))
+    if not area_ids:
+        return {"area": area, "groups": [], "error": f"Unknown area: {area}"}
+    metrics = get_market_metrics(engine)
+    return {
+        "area": area,
+        "groups": metrics.query(area_ids, property_type, bedrooms),
+        "overall": metrics.investment_inputs(area_ids, property_type, bedrooms),
+    }
+
+
+async def _amarket_metrics(area: str, property_type: Optional[str] = None, bedrooms: Optional[str] = None) -> Dict[str, Any]:
+    return await asyncio.to_thread(_market_metrics, area, property_type, bedrooms)
+
+
+# =========================
+# Tool registration
+# =========================
+# Each tool carries a sync body (insight graph, scripts) and a coroutine body.
+# Under graph.astream_events the ToolNode awaits the coroutines, so independent
+# tool calls from one model turn run concurrently on the event loop instead of
+# occupying worker threads.
+rag_tool = StructuredTool.from_function(
+    func=_rag_tool, coroutine=_arag_tool, name="rag_tool"
+)
+web_search = StructuredTool.from_function(
+    func=_web_search, coroutine=_aweb_search, name="web_search"
+)
+pgsql_query_structured = StructuredTool.from_function(
+    func=_pgsql_query_structured, coroutine=_apgsql_query_structured, name="pgsql_query_structured"
+)
+image_search = StructuredTool.from_function(
+    func=_image_search, coroutine=_aimage_search, name="image_search"
+)
+transactions_analytics = StructuredTool.from_function(
+    func=_transactions_analytics, coroutine=_atransactions_analytics, name="transactions_analytics"
+)
+market_metrics = StructuredTool.from_function(
+    func=_market_metrics, coroutine=_amarket_metrics, name="market_metrics"
+)
+
+
 ALL_TOOLS: list[BaseTool] = [
     rag_tool,
     web_search,
     pgsql_query_structured,
     image_search,
-]
\ No newline at end of file
+    transactions_analytics,
+    market_metrics,
+]
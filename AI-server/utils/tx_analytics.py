@@ -0,0 +1,187 @@
+# tx_analytics.py
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from utils.tx_snapshot import TransactionsSnapshot, DIMENSIONS
+
+GROUP_KEYS = ("year", "month", "area", "property_type", "rooms", "trans_group", "usage")
+MAX_RESULT_ROWS = 200
+
+
+# =========================
+# Derived columns
+# =========================
+def _dim_lookup(snapshot: TransactionsSnapshot, dim: str, ids: pa.ChunkedArray) -> pa.Array:
+    """Vectorized id -> label join against a snapshot dimension (null when unknown)."""
+    key, label = DIMENSIONS[dim]
+    table = snapshot.dims.get(dim)
+    if table is None:
+        return pa.nulls(len(ids), pa.string())
+    idx = pc.index_in(ids, value_set=table[key].combine_chunks())
+    return pc.take(table[label], idx)
+
+
+def property_type_label(snapshot: TransactionsSnapshot, t: pa.Table) -> pa.Array:
+    """Same buckets as the dashboard backend's property type CASE expression."""
+    ptype = _dim_lookup(snapshot, "dim_property_type", t["property_type_id"])
+    sub = _dim_lookup(snapshot, "dim_property_sub_type", t["property_sub_type_id"])
+    unit = pc.equal(ptype, "Unit")
+
+    def unit_sub(name):
+        return pc.and_kleene(unit, pc.equal(sub, name))
+
+    conditions = {
+        "Apartment": unit_sub("Flat"),
+        "Stacked Townhouses": unit_sub("Stacked Townhouses"),
+        "Villa": pc.equal(ptype, "Villa"),
+        "Shop": unit_sub("Shop"),
+        "Hotel Apartment": unit_sub("Hotel Apartment"),
+        "Hotel Rooms": unit_sub("Hotel Rooms"),
+        "Office": pc.or_kleene(pc.equal(ptype, "Office"), unit_sub("Office")),
+    }
+    cond = pc.make_struct(*[pc.fill_null(c, False) for c in conditions.values()], field_names=list(conditions))
+    return pc.case_when(cond, *[pa.scalar(label) for label in conditions])
+
+
+def _derive(snapshot: TransactionsSnapshot, t: pa.Table, key: str) -> pa.Array:
+    if key == "year":
+        return pc.year(t["instance_date"])
+    if key == "month":
+        return pc.strftime(pc.cast(t["instance_date"], pa.timestamp("s")), format="%Y-%m")
+    if key == "area":
+        return _dim_lookup(snapshot, "dim_area", t["area_id"])
+    if key == "property_type":
+        return property_type_label(snapshot, t)
+    if key == "rooms":
+        return t["num_rooms_en"]
+    if key == "trans_group":
+        return _dim_lookup(snapshot, "dim_trans_group", t["trans_group_id"])
+    if key == "usage":
+        return _dim_lookup(snapshot, "dim_usage", t["property_usage_id"])
+    raise ValueError(f"Unknown group key: {key}")
+
+
+# =========================
+# Kernels
+# =========================
+def filter_transactions(
+    snapshot: TransactionsSnapshot,
+    area_ids: Optional[List[int]] = None,
+    property_type: Optional[str] = None,
+    rooms: Optional[str] = None,
+    trans_group: Optional[str] = None,
+    start_year: Optional[int] = None,
+    end_year: Optional[int] = None,
+) -> pa.Table:
+    t = snapshot.fact
+    mask = None
+
+    def both(m):
+        return m if mask is None else pc.and_(mask, m)
+
+    if area_ids:
+        mask = both(pc.is_in(t["area_id"], value_set=pa.array(area_ids, pa.int64())))
+    if start_year is not None or end_year is not None:
+        years = pc.year(t["instance_date"])
+        if start_year is not None:
+            mask = both(pc.greater_equal(years, start_year))
+        if end_year is not None:
+            mask = both(pc.less_equal(years, end_year))
+    if rooms:
+        mask = both(pc.equal(pc.utf8_lower(t["num_rooms_en"]), rooms.lower()))
+    if trans_group:
+        mask = both(pc.equal(pc.utf8_lower(_derive(snapshot, t, "trans_group")), trans_group.lower()))
+    if mask is not None:
+        t = t.filter(pc.fill_null(mask, False))
+    # Label after the cheap filters so the CASE runs on fewer rows
+    if property_type:
+        t = t.filter(pc.fill_null(pc.equal(property_type_label(snapshot, t), property_type), False))
+    return t
+
+
+def aggregate(snapshot: TransactionsSnapshot, t: pa.Table, group_by: List[str]) -> pa.Table:
+    """Grouped count / sales volume / price per m² / rent in one hash-aggregate pass."""
+    keyed = t.select(["actual_worth", "meter_sale_price", "rent_value"])
+    for key in group_by:
+        keyed = keyed.append_column(key, _derive(snapshot, t, key))
+
+    out = keyed.group_by(group_by).aggregate([
+        ([], "count_all"),
+        ("actual_worth", "sum"),
+        ("actual_worth", "mean"),
+        ("meter_sale_price", "mean"),
+        ("meter_sale_price", "approximate_median"),
+        ("rent_value", "mean"),
+    ])
+    out = out.rename_columns([
+        {
+            "count_all": "transactions",
+            "actual_worth_sum": "sales_volume",
+            "actual_worth_mean": "avg_price",
+            "meter_sale_price_mean": "avg_meter_sale_price",
+            "meter_sale_price_approximate_median": "median_meter_sale_price",
+            "rent_value_mean": "avg_rent",
+        }.get(c, c)
+        for c in out.column_names
+    ])
+    return out.sort_by([(k, "ascending") for k in group_by])
+
+
+def add_yoy(t: pa.Table, group_by: List[str]) -> pa.Table:
+    """YoY % change of avg_meter_sale_price and transactions vs the previous year of the same group."""
+    if "year" not in group_by or t.num_rows == 0:
+        return t
+    others = [k for k in group_by if k != "year"]
+    t = t.sort_by([(k, "ascending") for k in others + ["year"]])
+
+    years = t["year"].to_numpy(zero_copy_only=False)
+    same_group = np.ones(t.num_rows, dtype=bool)
+    for k in others:
+        col = np.asarray(t[k].to_pylist(), dtype=object)
+        same_group[1:] &= col[1:] == col[:-1]
+    prev_ok = np.zeros(t.num_rows, dtype=bool)
+    prev_ok[1:] = same_group[1:] & (years[1:] == years[:-1] + 1)
+
+    for col, name in (("avg_meter_sale_price", "yoy_price_pct"), ("transactions", "yoy_transactions_pct")):
+        v = t[col].to_numpy(zero_copy_only=False).astype(np.float64)
+        prev = np.roll(v, 1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            yoy = np.where(prev_ok & (prev != 0), (v / prev - 1) * 100, np.nan)
+        t = t.append_column(name, pa.array(np.round(yoy, 2), mask=np.isnan(yoy)))
+    return t
+
+
+def transactions_summary(
+    snapshot: TransactionsSnapshot,
+    group_by: List[str],
+    area_ids: Optional[List[int]] = None,
+    property_type: Optional[str] = None,
+    rooms: Optional[str] = None,
+    trans_group: Optional[str] = None,
+    start_year: Optional[int] = None,
+    end_year: Optional[int] = None,
+    limit: int = 50,
+) -> Dict[str, Any]:
+    """Filter + aggregate + YoY over the snapshot, in the SQL tool's result shape."""
+    start = time.perf_counter()
+    bad = [k for k in group_by if k not in GROUP_KEYS]
+    if bad:
+        return {"error": f"Unsupported group_by {bad}; use any of {list(GROUP_KEYS)}", "rowcount": 0}
+
+    t = filter_transactions(snapshot, area_ids, property_type, rooms, trans_group, start_year, end_year)
+    result = add_yoy(aggregate(snapshot, t, group_by), group_by)
+    limit = max(1, min(limit, MAX_RESULT_ROWS))
+    return {
+        "dialect": "arrow",
+        "source": "local_snapshot",
+        "as_of": snapshot.manifest.get("watermark"),
+        "columns": result.column_names,
+        "rows": result.slice(0, limit).to_pylist(),
+        "rowcount": result.num_rows,
+        "scanned_rows": t.num_rows,
+        "elapsed_ms": int((time.perf_counter() - start) * 1000),
+    }
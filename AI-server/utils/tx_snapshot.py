@@ -0,0 +1,267 @@
+# tx_snapshot.py
+"""
+Local columnar snapshot of the transactions fact table + key dimensions.
+
+    cd AI-server && python -m utils.tx_snapshot          # build / refresh now
+
+Facts are stored as Arrow IPC part files and memory-mapped on load. Each
+refresh pulls rows with instance_date >= watermark into a new part (the
+watermark day is re-fetched so late rows for it are not missed; older
+parts are clipped below it). Small dimension tables are re-pulled whole.
+
+The directory is shared by the workers of a deployment: a refresh holds
+an exclusive file lock, builds on the manifest on disk (not this worker's
+copy) and adopts it as is when another worker refreshed in the meantime.
+"""
+import os
+import json
+import time
+import datetime
+import threading
+from typing import Any, Dict, List, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from utils.arrow_results import iter_record_batches
+from utils.mmap_store import file_lock
+
+TX_SNAPSHOT_DIR = os.getenv("TX_SNAPSHOT_DIR", ".cache/tx_snapshot")
+TX_SNAPSHOT_TABLE = os.getenv("TX_SNAPSHOT_TABLE", "transactions")
+TX_SNAPSHOT_REFRESH_S = float(os.getenv("TX_SNAPSHOT_REFRESH_S", "900"))
+# Incremental parts are merged into one file beyond this count
+TX_SNAPSHOT_MAX_PARTS = int(os.getenv("TX_SNAPSHOT_MAX_PARTS", "8"))
+
+FACT_SCHEMA = pa.schema([
+    ("instance_date", pa.date32()),
+    ("area_id", pa.int64()),
+    ("project_number", pa.int64()),
+    ("property_type_id", pa.int64()),
+    ("property_sub_type_id", pa.int64()),
+    ("trans_group_id", pa.int64()),
+    ("property_usage_id", pa.int64()),
+    ("num_rooms_en", pa.string()),
+    ("actual_worth", pa.float64()),
+    ("meter_sale_price", pa.float64()),
+    ("rent_value", pa.float64()),
+    ("meter_rent_price", pa.float64()),
+])
+_FLOAT_COLUMNS = {f.name for f in FACT_SCHEMA if pa.types.is_floating(f.type)}
+
+# name -> (key column, label column)
+DIMENSIONS = {
+    "dim_area": ("area_id", "area_name_en"),
+    "dim_property_type": ("property_type_id", "property_type"),
+    "dim_property_sub_type": ("property_sub_type_id", "property_sub_type"),
+    "dim_trans_group": ("trans_group_id", "trans_group_en"),
+    "dim_usage": ("property_usage_id", "property_usage_en"),
+}
+
+
+def _fact_sql(since: Optional[datetime.date]) -> str:
+    cols = ", ".join(
+        "instance_date::date AS instance_date" if c == "instance_date"
+        else f"{c}::float8 AS {c}" if c in _FLOAT_COLUMNS
+        else c
+        for c in FACT_SCHEMA.names
+    )
+    where = f" WHERE instance_date >= DATE '{since.isoformat()}'" if since else ""
+    return f"SELECT {cols} FROM {TX_SNAPSHOT_TABLE}{where}"
+
+
+def _write_ipc(path: str, batches, schema: pa.Schema) -> Dict[str, Any]:
+    """Stream batches into an Arrow IPC file (atomic). Returns rows + date range."""
+    rows, lo, hi = 0, None, None
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+        for batch in batches:
+            table = pa.Table.from_batches([batch]).select(schema.names).cast(schema)
+            writer.write_table(table)
+            rows += table.num_rows
+            if "instance_date" in schema.names and table.num_rows:
+                mm = pc.min_max(table["instance_date"]).as_py()
+                if mm["min"] is not None:
+                    lo = mm["min"] if lo is None else min(lo, mm["min"])
+                    hi = mm["max"] if hi is None else max(hi, mm["max"])
+    os.replace(tmp, path)
+    return {"rows": rows, "min_date": lo.isoformat() if lo else None, "max_date": hi.isoformat() if hi else None}
+
+
+def _read_ipc(path: str) -> pa.Table:
+    # Zero-copy: buffers point into the mapped file
+    return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+
+
+class TransactionsSnapshot:
+    def __init__(self, directory: str = TX_SNAPSHOT_DIR):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, "manifest.json")
+        self.manifest: Dict[str, Any] = {"parts": [], "watermark": None, "refreshed_at": 0}
+        self.fact: pa.Table = FACT_SCHEMA.empty_table()
+        self.dims: Dict[str, pa.Table] = {}
+        self._refresh_lock = threading.Lock()
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding="utf-8") as f:
+                self.manifest = json.load(f)
+            self._load()
+
+    # -----------------------
+    # Load
+    # -----------------------
+    def _load(self):
+        tables = []
+        for part in self.manifest["parts"]:
+            t = _read_ipc(os.path.join(self.directory, part["file"]))
+            if part.get("valid_before"):
+                cutoff = pa.scalar(datetime.date.fromisoformat(part["valid_before"]), pa.date32())
+                t = t.filter(pc.less(t["instance_date"], cutoff))
+            tables.append(t)
+        dims = {}
+        for name in DIMENSIONS:
+            path = os.path.join(self.directory, f"{name}.arrow")
+            if os.path.exists(path):
+                dims[name] = _read_ipc(path)
+        # Swap in one assignment each so readers never see a half-loaded state
+        self.fact = pa.concat_tables(tables) if tables else FACT_SCHEMA.empty_table()
+        self.dims = dims
+
+    @property
+    def watermark(self) -> Optional[datetime.date]:
+        wm = self.manifest.get("watermark")
+        return datetime.date.fromisoformat(wm) if wm else None
+
+    @property
+    def is_empty(self) -> bool:
+        return not self.manifest["parts"]
+
+    def is_stale(self) -> bool:
+        return time.time() - self.manifest.get("refreshed_at", 0) > TX_SNAPSHOT_REFRESH_S
+
+    # -----------------------
+    # Refresh
+    # -----------------------
+    def _read_manifest(self) -> Dict[str, Any]:
+        if not os.path.exists(self.manifest_path):
+            return {"parts": [], "watermark": None, "refreshed_at": 0}
+        with open(self.manifest_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def refresh(self, engine, force: bool = False) -> Dict[str, Any]:
+        """
+        Pull rows since the watermark into a new part, re-pull dimensions,
+        reload. Unless `force`, a manifest refreshed within
+        TX_SNAPSHOT_REFRESH_S (by another worker) is loaded instead.
+        """
+        with self._refresh_lock, file_lock(self.manifest_path):
+            start = time.perf_counter()
+            manifest = self._read_manifest()
+            if not force and time.time() - manifest.get("refreshed_at", 0) <= TX_SNAPSHOT_REFRESH_S:
+                # Another worker refreshed while this one waited for the lock
+                if manifest != self.manifest:
+                    self.manifest = manifest
+                    self._load()
+                return {"new_rows": 0, "total_rows": self.fact.num_rows, "watermark": manifest["watermark"],
+                        "parts": len(manifest["parts"]), "elapsed_s": round(time.perf_counter() - start, 2)}
+            wm = datetime.date.fromisoformat(manifest["watermark"]) if manifest.get("watermark") else None
+
+            name = f"part-{int(time.time() * 1000)}.arrow"
+            path = os.path.join(self.directory, name)
+            batches = iter_record_batches(engine, _fact_sql(wm), max_rows=None)
+            part = {"file": name, **_write_ipc(path, batches, FACT_SCHEMA), "valid_before": None}
+
+            if part["rows"]:
+                if wm is not None:
+                    for p in manifest["parts"]:
+                        if p["max_date"] and p["max_date"] >= wm.isoformat():
+                            p["valid_before"] = min(filter(None, [p.get("valid_before"), wm.isoformat()]))
+                manifest["parts"].append(part)
+                manifest["watermark"] = max(filter(None, [manifest.get("watermark"), part["max_date"]]))
+            else:
+                os.remove(path)
+
+            for dim, (key, label) in DIMENSIONS.items():
+                try:
+                    _write_ipc(
+                        os.path.join(self.directory, f"{dim}.arrow"),
+                        iter_record_batches(engine, f"SELECT {key}, {label} FROM {dim}", max_rows=None),
+                        pa.schema([(key, pa.int64()), (label, pa.string())]),
+                    )
+                except Exception as e:
+                    print(f"Snapshot of {dim} failed: {e}")
+
+            manifest["refreshed_at"] = time.time()
+            self._commit(manifest)
+            if len(manifest["parts"]) > TX_SNAPSHOT_MAX_PARTS:
+                self._compact()
+
+            stats = {
+                "new_rows": part["rows"],
+                "total_rows": self.fact.num_rows,
+                "watermark": self.manifest["watermark"],
+                "parts": len(self.manifest["parts"]),
+                "elapsed_s": round(time.perf_counter() - start, 2),
+            }
+            print(f"📦 Transactions snapshot refreshed: {stats}")
+            return stats
+
+    def _commit(self, manifest: Dict[str, Any]):
+        """Replace the manifest on disk (file lock held) and drop the parts it no longer lists."""
+        on_disk = self._read_manifest()
+        tmp = f"{self.manifest_path}.tmp-{os.getpid()}"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, self.manifest_path)
+        old_files = {p["file"] for p in on_disk["parts"]} - {p["file"] for p in manifest["parts"]}
+        self.manifest = manifest
+        self._load()
+        # Workers still serving an older manifest keep their mapping of a
+        # removed file; they reload from the new manifest on their next refresh
+        for f in old_files:
+            try:
+                os.remove(os.path.join(self.directory, f))
+            except OSError:
+                pass
+
+    def _compact(self):
+        """Rewrite all parts (already clipped on load) as a single file (file lock held)."""
+        name = f"part-{int(time.time() * 1000)}-compact.arrow"
+        info = _write_ipc(os.path.join(self.directory, name), self.fact.to_batches(), FACT_SCHEMA)
+        self._commit({**self.manifest, "parts": [{"file": name, **info, "valid_before": None}]})
+
+
+# -----------------------
+# Process-wide instance
+# -----------------------
+_snapshot: Optional[TransactionsSnapshot] = None
+_snapshot_lock = threading.Lock()
+_refresh_thread: Optional[threading.Thread] = None
+
+
+def _background_refresh(snapshot: TransactionsSnapshot, engine):
+    try:
+        snapshot.refresh(engine)
+    except Exception as e:
+        print(f"❌ Transactions snapshot refresh failed: {e}")
+
+
+def get_tx_snapshot(engine=None) -> TransactionsSnapshot:
+    """
+    The on-disk snapshot; when it is stale (or missing) a refresh is started
+    in a background thread and the current data keeps being served.
+    """
+    global _snapshot, _refresh_thread
+    with _snapshot_lock:
+        if _snapshot is None:
+            _snapshot = TransactionsSnapshot()
+        if engine is not None and _snapshot.is_stale() and not (_refresh_thread and _refresh_thread.is_alive()):
+            _refresh_thread = threading.Thread(
+                target=_background_refresh, args=(_snapshot, engine), name="tx-snapshot-refresh", daemon=True
+            )
+            _refresh_thread.start()
+    return _snapshot
+
+
+if __name__ == "__main__":
+    from utils.tools import engine
+
+    print(TransactionsSnapshot().refresh(engine, force=True))
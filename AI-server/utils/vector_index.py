@@ -0,0 +1,374 @@
+# vector_index.py
+import os
+import json
+import math
+import heapq
+import time
+import random
+import shutil
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from utils.retrieval_cache import collection_version
+
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", ".cache/vector_index")
+# Above this many vectors searches go through the HNSW graph instead of a full scan
+HNSW_THRESHOLD = int(os.getenv("HNSW_THRESHOLD", "20000"))
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "100"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+SYNC_CHECK_INTERVAL = int(os.getenv("RAG_COLLECTION_CHECK_S", "60"))
+
+
+def _normalize_rows(x: np.ndarray) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return x / norms
+
+
+# =========================
+# HNSW graph
+# =========================
+class HNSWGraph:
+    """
+    Hierarchical navigable small-world graph over unit vectors (cosine = dot).
+    Layer 0 is stored as a dense (N, 2M) neighbour array so it can be
+    memory-mapped; the sparse upper layers are small and kept as dicts.
+    """
+
+    def __init__(self, vectors: np.ndarray, m: int = HNSW_M, ef_construction: int = HNSW_EF_CONSTRUCTION, seed: int = 42):
+        self.vectors = vectors
+        self.m = m
+        self.m0 = 2 * m
+        self.ef_construction = ef_construction
+        self.level0: Optional[np.ndarray] = None
+        self.upper: List[Dict[int, List[int]]] = []
+        self.entry = -1
+        self.max_level = -1
+        self._rng = random.Random(seed)
+
+    # -----------------------
+    # Search primitives
+    # -----------------------
+    def _neighbors(self, node: int, layer: int, build_l0: Optional[List[List[int]]] = None) -> List[int]:
+        if layer == 0:
+            if build_l0 is not None:
+                return build_l0[node]
+            row = self.level0[node]
+            return row[row >= 0].tolist()
+        return self.upper[layer - 1].get(node, [])
+
+    def _search_layer(self, q: np.ndarray, entries: List[int], ef: int, layer: int, build_l0=None) -> List[Tuple[float, int]]:
+        """Best-first search; returns up to ef (similarity, node) pairs, best first."""
+        visited = set(entries)
+        sims = self.vectors[entries] @ q
+        candidates = [(-float(s), n) for s, n in zip(sims, entries)]  # max-heap on similarity
+        heapq.heapify(candidates)
+        results = [(float(s), n) for s, n in zip(sims, entries)]      # min-heap of the ef best
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            neg_sim, node = heapq.heappop(candidates)
+            if -neg_sim < results[0][0] and len(results) >= ef:
+                break
+            nbrs = [n for n in self._neighbors(node, layer, build_l0) if n not in visited]
+            if not nbrs:
+                continue
+            visited.update(nbrs)
+            nbr_sims = self.vectors[nbrs] @ q
+            for s, n in zip(nbr_sims.tolist(), nbrs):
+                if len(results) < ef or s > results[0][0]:
+                    heapq.heappush(candidates, (-s, n))
+                    heapq.heappush(results, (s, n))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+
+        return sorted(results, reverse=True)
+
+    def _select(self, node_vec: np.ndarray, candidates: List[int], m: int) -> List[int]:
+        """Keep the m candidates closest to node_vec."""
+        if len(candidates) <= m:
+            return candidates
+        sims = self.vectors[candidates] @ node_vec
+        top = np.argpartition(-sims, m - 1)[:m]
+        return [candidates[i] for i in top]
+
+    # -----------------------
+    # Build
+    # -----------------------
+    def build(self):
+        n = len(self.vectors)
+        ml = 1.0 / math.log(self.m)
+        l0: List[List[int]] = [[] for _ in range(n)]
+
+        for node in range(n):
+            level = int(-math.log(1.0 - self._rng.random()) * ml)
+            while len(self.upper) < level:
+                self.upper.append({})
+            q = self.vectors[node]
+
+            if self.entry < 0:
+                self.entry, self.max_level = node, level
+                for lyr in range(1, level + 1):
+                    self.upper[lyr - 1][node] = []
+                continue
+
+            ep = [self.entry]
+            for lyr in range(self.max_level, level, -1):
+                ep = [self._search_layer(q, ep, 1, lyr, l0)[0][1]]
+
+            for lyr in range(min(level, self.max_level), -1, -1):
+                found = self._search_layer(q, ep, self.ef_construction, lyr, l0)
+                cap = self.m0 if lyr == 0 else self.m
+                nbrs = self._select(q, [nd for _, nd in found], self.m)
+                if lyr == 0:
+                    l0[node] = nbrs
+                else:
+                    self.upper[lyr - 1][node] = nbrs
+                for nb in nbrs:
+                    lst = l0[nb] if lyr == 0 else self.upper[lyr - 1].setdefault(nb, [])
+                    lst.append(node)
+                    if len(lst) > cap:
+                        pruned = self._select(self.vectors[nb], lst, cap)
+                        if lyr == 0:
+                            l0[nb] = pruned
+                        else:
+                            self.upper[lyr - 1][nb] = pruned
+                ep = [nd for _, nd in found]
+
+            for lyr in range(self.max_level + 1, level + 1):
+                self.upper[lyr - 1][node] = []
+            if level > self.max_level:
+                self.entry, self.max_level = node, level
+
+        self.level0 = np.full((n, self.m0), -1, dtype=np.int32)
+        for node, nbrs in enumerate(l0):
+            self.level0[node, : len(nbrs)] = nbrs
+        return self
+
+    def search(self, q: np.ndarray, k: int, ef: int = HNSW_EF_SEARCH) -> List[Tuple[float, int]]:
+        if self.entry < 0:
+            return []
+        ep = [self.entry]
+        for lyr in range(self.max_level, 0, -1):
+            ep = [self._search_layer(q, ep, 1, lyr)[0][1]]
+        return self._search_layer(q, ep, max(ef, k), 0)[:k]
+
+    # -----------------------
+    # Snapshot
+    # -----------------------
+    def save(self, path: str):
+        np.save(os.path.join(path, "hnsw_level0.npy"), self.level0)
+        with open(os.path.join(path, "hnsw_upper.json"), "w") as f:
+            json.dump({
+                "m": self.m,
+                "entry": self.entry,
+                "max_level": self.max_level,
+                "upper": [{str(k): v for k, v in layer.items()} for layer in self.upper],
+            }, f)
+
+    @classmethod
+    def load(cls, path: str, vectors: np.ndarray) -> "HNSWGraph":
+        with open(os.path.join(path, "hnsw_upper.json")) as f:
+            meta = json.load(f)
+        g = cls(vectors, m=meta["m"])
+        g.level0 = np.load(os.path.join(path, "hnsw_level0.npy"), mmap_mode="r")
+        g.upper = [{int(k): v for k, v in layer.items()} for layer in meta["upper"]]
+        g.entry, g.max_level = meta["entry"], meta["max_level"]
+        return g
+
+
+# =========================
+# Vector index
+# =========================
+class LocalVectorIndex:
+    """
+    In-process replacement for the Qdrant vectorstore behind CachedRetriever.
+    Qdrant stays the source of truth: the index is synced from it, snapshotted
+    to memory-mapped .npy files, and re-synced in a background thread when the
+    collection's version changes; searches use the previous arrays until
+    the new ones are swapped in.
+    """
+
+    def __init__(self, source, path: Optional[str] = None, hnsw_threshold: int = HNSW_THRESHOLD):
+        self.source = source  # langchain Qdrant vectorstore
+        self.client = source.client
+        self.collection_name = source.collection_name
+        self.path = path or os.path.join(VECTOR_INDEX_DIR, self.collection_name)
+        self.hnsw_threshold = hnsw_threshold
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.docs: List[Document] = []
+        self.graph: Optional[HNSWGraph] = None
+        self.version: Optional[str] = None  # collection_version() the snapshot was synced at
+        self._checked_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    # -----------------------
+    # Sync / snapshot
+    # -----------------------
+    def _set(self, vectors: np.ndarray, docs: List[Document], graph: Optional[HNSWGraph] = None):
+        if graph is None and len(vectors) > self.hnsw_threshold:
+            started = time.perf_counter()
+            graph = HNSWGraph(vectors).build()
+            print(f"🕸️ HNSW built over {len(vectors)} vectors in {time.perf_counter() - started:.1f}s")
+        with self._lock:
+            self.vectors, self.docs, self.graph = vectors, docs, graph
+
+    def sync(self):
+        """Pull every point (vector + payload) from Qdrant and rewrite the snapshot."""
+        vectors, docs = [], []
+        # Read before the scroll: a write during it shows up as a newer version
+        version = collection_version(self.client, self.collection_name)
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                with_vectors=True,
+                with_payload=True,
+                limit=512,
+                offset=offset,
+            )
+            for p in points:
+                vec = p.vector
+                if isinstance(vec, dict):  # named vectors: take the first
+                    vec = next(iter(vec.values()))
+                payload = p.payload or {}
+                vectors.append(vec)
+                docs.append(Document(
+                    page_content=payload.get(self.source.content_payload_key, ""),
+                    metadata=payload.get(self.source.metadata_payload_key) or {},
+                ))
+            if offset is None:
+                break
+
+        dim = len(vectors[0]) if vectors else 0
+        matrix = _normalize_rows(np.array(vectors, dtype=np.float32).reshape(len(vectors), dim))
+        self._set(matrix, docs)
+        self.version = version
+        self.save()
+        print(f"🔄 Local vector index synced: {len(docs)} points from {self.collection_name}")
+
+    def save(self):
+        """
+        Write the snapshot to a fresh directory and swap it in: the files of
+        the current snapshot may be memory-mapped by this or another process,
+        so they are never overwritten in place. A crash mid-swap leaves no
+        snapshot, which the next start answers with a full sync.
+        """
+        tmp = f"{self.path}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        np.save(os.path.join(tmp, "vectors.npy"), self.vectors)
+        with open(os.path.join(tmp, "docs.json"), "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": self.version,
+                    "docs": [{"page_content": d.page_content, "metadata": d.metadata} for d in self.docs],
+                },
+                f,
+                ensure_ascii=False,
+            )
+        if self.graph is not None:
+            self.graph.save(tmp)
+
+        old = f"{self.path}.old-{os.getpid()}"
+        if os.path.exists(self.path):
+            os.replace(self.path, old)
+        os.replace(tmp, self.path)
+        shutil.rmtree(old, ignore_errors=True)
+
+    def load(self) -> bool:
+        vec_path = os.path.join(self.path, "vectors.npy")
+        if not os.path.exists(vec_path):
+            return False
+        vectors = np.load(vec_path, mmap_mode="r")
+        with open(os.path.join(self.path, "docs.json"), encoding="utf-8") as f:
+            raw = json.load(f)
+        docs = [Document(**d) for d in raw["docs"]]
+        graph = None
+        if len(vectors) > self.hnsw_threshold and os.path.exists(os.path.join(self.path, "hnsw_level0.npy")):
+            graph = HNSWGraph.load(self.path, vectors)
+        self._set(vectors, docs, graph)
+        self.version = raw.get("version")
+        return True
+
+    def _refresh(self):
+        try:
+            if collection_version(self.client, self.collection_name) != self.version:
+                self.sync()
+        except Exception as e:
+            print(f"Local vector index refresh failed: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def ensure_fresh(self, force: bool = False, wait: bool = False):
+        """
+        Re-sync when the collection's version differs from the snapshot's (throttled).
+        The check and rebuild run in a background thread unless `wait`.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._refreshing or (not force and now - self._checked_at < SYNC_CHECK_INTERVAL):
+                return
+            self._checked_at = now
+            self._refreshing = True
+        if wait:
+            self._refresh()
+        else:
+            threading.Thread(target=self._refresh, name="vector-index-refresh", daemon=True).start()
+
+    @classmethod
+    def open(cls, source, **kwargs) -> "LocalVectorIndex":
+        """Load the snapshot (memory-mapped) and sync from Qdrant: inline without one, else in the background."""
+        index = cls(source, **kwargs)
+        loaded = index.load()
+        if loaded:
+            print(f"📂 Local vector index loaded: {len(index.docs)} points")
+        index.ensure_fresh(force=True, wait=not loaded)
+        return index
+
+    # -----------------------
+    # Vectorstore interface used by CachedRetriever
+    # -----------------------
+    def add_documents(self, documents: List[Document], **kwargs) -> List[str]:
+        ids = self.source.add_documents(documents, **kwargs)
+        self.sync()
+        return ids
+
+    def similarity_search_with_score_by_vector(
+        self, embedding: List[float], k: int = 4, score_threshold: Optional[float] = None, **kwargs
+    ) -> List[Tuple[Document, float]]:
+        self.ensure_fresh()
+        with self._lock:
+            vectors, docs, graph = self.vectors, self.docs, self.graph
+        if len(docs) == 0:
+            return []
+
+        q = _normalize_rows(np.asarray(embedding, dtype=np.float32))
+        if graph is not None:
+            hits = graph.search(q, k)
+        else:
+            sims = vectors @ q
+            k_eff = min(k, len(sims))
+            top = np.argpartition(-sims, k_eff - 1)[:k_eff]
+            top = top[np.argsort(-sims[top])]
+            hits = [(float(sims[i]), int(i)) for i in top]
+
+        return [
+            (docs[i], s) for s, i in hits
+            if score_threshold is None or s >= score_threshold
+        ]
+
+    async def asimilarity_search_with_score_by_vector(
+        self, embedding: List[float], k: int = 4, score_threshold: Optional[float] = None, **kwargs
+    ) -> List[Tuple[Document, float]]:
+        # Pure in-memory compute (microseconds for small corpora); no I/O to await
+        return self.similarity_search_with_score_by_vector(embedding, k, score_threshold, **kwargs)
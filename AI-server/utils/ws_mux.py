@@ -0,0 +1,170 @@
+# ws_mux.py
+"""
+Several chat / insight streams over one WebSocket.
+
+Client -> server (JSON text frames):
+    {"type": "start", "stream": "a", "kind": "chat", "query": "...", "user_id": "...", "db_format": "rows"}
+    {"type": "start", "stream": "b", "kind": "insight", "request": {...InsightRequest...}}
+    {"type": "resume", "stream": "a", "last_event_id": "<stream_id>:<seq>", "user_id": "..."}
+    {"type": "credit", "stream": "a", "n": 32}
+    {"type": "cancel", "stream": "a"}
+    {"type": "ping"}
+Server -> client:
+    {"stream": "a", "id": "<stream_id>:<seq>", "event": {...}}   event = the /chat_stream SSE payload
+    {"stream": "a", "type": "end"}
+    {"stream": "a", "type": "cancelled"}
+    {"stream": "a" | null, "type": "error", "code": "...", "message": "..."}
+    {"type": "pong"}
+
+Stream ids are chosen by the client and unique per connection. Each
+stream starts with WS_STREAM_WINDOW credits, one per event, and the
+client grants more with "credit" as it renders. A stream out of credit
+only stops being forwarded: its run keeps filling the replay buffer
+(utils.stream_runs), so a slow panel never stalls the other streams or
+the agent. Closing the socket detaches the streams without cancelling
+them; they can be resumed here or over SSE with their last id.
+"""
+import os
+import json
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+from starlette.websockets import WebSocketDisconnect
+
+from utils import metrics
+from utils.stream_runs import StreamRun, split_sse_frame
+
+# Events a stream may send ahead of the client's credits
+WS_STREAM_WINDOW = int(os.getenv("WS_STREAM_WINDOW", "64"))
+# Concurrent streams per connection
+WS_MAX_STREAMS = int(os.getenv("WS_MAX_STREAMS", "8"))
+
+
+class StreamRequestError(ValueError):
+    """A start/resume message that cannot be served; sent back as an error event."""
+
+    def __init__(self, code: str, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+class _Stream:
+    def __init__(self, run: StreamRun):
+        self.run = run
+        self.credit = WS_STREAM_WINDOW
+        self.task: Optional[asyncio.Task] = None
+        self._granted = asyncio.Event()
+
+    async def take_credit(self):
+        if self.credit <= 0:
+            metrics.incr("ws_credit_stalls")
+        while self.credit <= 0:
+            self._granted.clear()
+            await self._granted.wait()
+        self.credit -= 1
+
+    def grant(self, n: int):
+        self.credit = min(self.credit + max(n, 0), WS_STREAM_WINDOW)
+        self._granted.set()
+
+
+class ChatMultiplexer:
+    """
+    Serves one WebSocket. `open_stream(message)` turns a start/resume
+    message into (run, follower of its SSE frames), or raises
+    StreamRequestError.
+    """
+
+    def __init__(self, websocket, open_stream: Callable[[dict], Awaitable[Tuple[StreamRun, AsyncIterator[str]]]]):
+        self.ws = websocket
+        self.open_stream = open_stream
+        self.streams: Dict[str, _Stream] = {}
+        self._send_lock = asyncio.Lock()
+
+    async def _send(self, text: str):
+        async with self._send_lock:
+            await self.ws.send_text(text)
+
+    async def _error(self, stream_id: Optional[str], code: str, message: str):
+        await self._send(json.dumps({"stream": stream_id, "type": "error", "code": code, "message": message}))
+
+    async def serve(self):
+        metrics.incr("ws_connections")
+        try:
+            while True:
+                await self._handle(await self.ws.receive_text())
+        except WebSocketDisconnect:
+            pass
+        finally:
+            tasks = [s.task for s in self.streams.values() if s.task]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _handle(self, raw: str):
+        try:
+            message = json.loads(raw)
+            if not isinstance(message, dict):
+                raise ValueError("not an object")
+        except ValueError:
+            await self._error(None, "BAD_MESSAGE", "Messages must be JSON objects.")
+            return
+
+        mtype = message.get("type")
+        stream_id = message.get("stream")
+        if mtype == "ping":
+            await self._send('{"type":"pong"}')
+        elif mtype in ("start", "resume"):
+            await self._open(stream_id, message)
+        elif mtype == "credit":
+            stream = self.streams.get(stream_id)
+            if stream is not None:
+                try:
+                    stream.grant(int(message.get("n", WS_STREAM_WINDOW)))
+                except (TypeError, ValueError):
+                    await self._error(stream_id, "BAD_MESSAGE", "credit.n must be an integer.")
+        elif mtype == "cancel":
+            stream = self.streams.pop(stream_id, None)
+            if stream is not None:
+                # The run itself, even before its follower forwarded (or attached to) anything
+                stream.task.cancel()
+                stream.run.cancel()
+                await self._send(json.dumps({"stream": stream_id, "type": "cancelled"}))
+        else:
+            await self._error(stream_id, "BAD_MESSAGE", f"Unknown message type: {mtype}")
+
+    async def _open(self, stream_id, message: dict):
+        if not isinstance(stream_id, str) or not stream_id or stream_id in self.streams:
+            await self._error(stream_id, "BAD_STREAM_ID", "Each stream needs a new, non-empty id.")
+            return
+        if len(self.streams) >= WS_MAX_STREAMS:
+            await self._error(stream_id, "TOO_MANY_STREAMS", f"At most {WS_MAX_STREAMS} concurrent streams.")
+            return
+        try:
+            run, follower = await self.open_stream(message)
+        except StreamRequestError as e:
+            await self._error(stream_id, e.code, str(e))
+            return
+
+        stream = _Stream(run)
+        stream.task = asyncio.create_task(self._forward(stream_id, stream, follower))
+        self.streams[stream_id] = stream
+        metrics.incr("ws_streams", label=message.get("kind") or message["type"])
+
+    async def _forward(self, stream_id: str, stream: _Stream, follower: AsyncIterator[str]):
+        prefix = f'{{"stream":{json.dumps(stream_id)},"id":'
+        try:
+            async for frame in follower:
+                event_id, data = split_sse_frame(frame)
+                await stream.take_credit()
+                await self._send(f'{prefix}{json.dumps(event_id)},"event":{data or "null"}}}')
+            await self._send(json.dumps({"stream": stream_id, "type": "end"}))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Socket gone mid-send: the receive loop sees the disconnect
+            print(f"WebSocket stream {stream_id} stopped: {e}")
+        finally:
+            await follower.aclose()
+            if self.streams.get(stream_id) is stream:
+                del self.streams[stream_id]